@@ -0,0 +1,239 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+"""
+
+This module implements the local action cache of ninja building actions.
+The command of a cacheable ninja rule is wrapped as:
+
+    python -S -m action_cache <cache_dir> <fingerprint> <stats_file> <command> ${out} -- ${in}
+
+An action is identified by the command line, the content digests of its
+inputs and the toolchain fingerprint. On a hit, the outputs are restored
+from the cache by hardlink (or copy across file systems) and the console
+output of the action is replayed, otherwise the command is run and its
+outputs are stored. Entries in the cache are read-only so the restored
+outputs sharing the same inode can not be modified in place.
+
+Each action appends a hit('h') or miss('m') record into the stats file,
+blade reports the hit rate and evicts least recently used entries to
+keep the cache size bounded after building.
+
+"""
+
+
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+
+
+# Name of the stats file in the build dir
+STATS_FILE = '.action_cache_stats'
+
+# Mode bits cleared from the cached files
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def quote(command):
+    """Quote the command as one argument of the wrapper. """
+    return "'%s'" % command.replace("'", "'\\''")
+
+
+def wrap_command(command):
+    """Wrap the command of a ninja rule with the action cache.
+
+    ${action_cache} is defined in the header of build.ninja, and
+    ${implicit_ins} are additional inputs which are not in ${in}.
+
+    """
+    return '${action_cache} %s ${out} -- ${in} ${implicit_ins}' % quote(command)
+
+
+def _digest_file(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def action_key(fingerprint, command, outputs, inputs):
+    """Return the key of the action, or None if any input is not a file. """
+    md5 = hashlib.md5()
+    md5.update(fingerprint)
+    md5.update('\0%s\0%s\0' % (command, ' '.join(outputs)))
+    for path in inputs:
+        if not os.path.isfile(path):
+            return None
+        md5.update('%s %s\0' % (path, _digest_file(path)))
+    return md5.hexdigest()
+
+
+def _remove(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+class ActionCache(object):
+    """The cache directory of actions.
+
+    Layout:
+        <cache_dir>/<key[:2]>/<key>/<index of output>
+        <cache_dir>/<key[:2]>/<key>/output   console output of the action
+        <cache_dir>/tmp/                     entries being stored
+
+    The mtime of an entry directory is its last used time.
+
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key, outputs):
+        """Restore outputs from the entry, return the console output or None on a miss. """
+        entry = self._entry_path(key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            for i, output in enumerate(outputs):
+                self._restore_file(os.path.join(entry, str(i)), output)
+            with open(os.path.join(entry, 'output'), 'rb') as f:
+                console_output = f.read()
+            os.utime(entry, None)
+        except (IOError, OSError):
+            return None
+        return console_output
+
+    @staticmethod
+    def _restore_file(src, dst):
+        _remove(dst)
+        dir = os.path.dirname(dst)
+        if dir and not os.path.isdir(dir):
+            os.makedirs(dir)
+        try:
+            os.link(src, dst)
+            # Make the output newer than its inputs for ninja
+            os.utime(dst, None)
+            return
+        except OSError:
+            _remove(dst)
+        shutil.copyfile(src, dst)
+        shutil.copymode(src, dst)
+
+    def store(self, key, outputs, console_output):
+        """Store outputs of the action as a new entry. """
+        if not all(os.path.isfile(output) for output in outputs):
+            return
+        tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        tmp_entry = os.path.join(tmp_dir, '%s.%d' % (key, os.getpid()))
+        try:
+            os.makedirs(tmp_entry)
+            for i, output in enumerate(outputs):
+                path = os.path.join(tmp_entry, str(i))
+                shutil.copyfile(output, path)
+                os.chmod(path, stat.S_IMODE(os.stat(output).st_mode) & ~_WRITE_BITS)
+            with open(os.path.join(tmp_entry, 'output'), 'wb') as f:
+                f.write(console_output)
+            entry = self._entry_path(key)
+            if not os.path.isdir(os.path.dirname(entry)):
+                os.makedirs(os.path.dirname(entry))
+            os.rename(tmp_entry, entry)
+        except (IOError, OSError):
+            # Concurrent store of the same action or the cache is unwritable
+            pass
+        finally:
+            if os.path.isdir(tmp_entry):
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def entries(self):
+        """Return list of (mtime, size, path) of all entries. """
+        result = []
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for prefix in os.listdir(self.cache_dir):
+            if len(prefix) != 2:
+                continue
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, name))
+                               for name in os.listdir(entry))
+                    result.append((os.path.getmtime(entry), size, entry))
+                except OSError:
+                    pass
+        return result
+
+    def evict(self, limit):
+        """Remove least recently used entries until total size is under limit.
+
+        Returns (number of entries, total size, number of evicted, evicted size).
+
+        """
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        evicted, evicted_size = 0, 0
+        if limit >= 0 and total > limit:
+            entries.sort()
+            for mtime, size, entry in entries:
+                if total - evicted_size <= limit:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                evicted += 1
+                evicted_size += size
+        return len(entries) - evicted, total - evicted_size, evicted, evicted_size
+
+
+def load_stats(stats_file):
+    """Return (hits, misses) recorded in the stats file. """
+    if not os.path.exists(stats_file):
+        return 0, 0
+    with open(stats_file) as f:
+        records = f.read()
+    return records.count('h'), records.count('m')
+
+
+def _append_stats(stats_file, record):
+    # Writes with O_APPEND are atomic among concurrent actions
+    fd = os.open(stats_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        os.write(fd, record)
+    finally:
+        os.close(fd)
+
+
+def main(argv):
+    cache_dir, fingerprint, stats_file, command = argv[:4]
+    sep = argv.index('--', 4)
+    outputs, inputs = argv[4:sep], argv[sep + 1:]
+    cache = ActionCache(cache_dir)
+    key = action_key(fingerprint, command, outputs, inputs)
+    if key:
+        console_output = cache.restore(key, outputs)
+        if console_output is not None:
+            _append_stats(stats_file, 'h')
+            sys.stdout.write(console_output)
+            return 0
+    # Outputs may be hardlinks to the cache entries, never write them in place
+    for output in outputs:
+        _remove(output)
+    p = subprocess.Popen(command, shell=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    console_output = p.communicate()[0]
+    sys.stdout.write(console_output)
+    if p.returncode == 0 and key:
+        cache.store(key, outputs, console_output)
+        _append_stats(stats_file, 'm')
+    return p.returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
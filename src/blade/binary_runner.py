@@ -47,9 +47,11 @@ class BinaryRunner(object):
         """Returns the executable path. """
         return os.path.join(self.build_dir, target.path, target.name)
 
-    def _runfiles_dir(self, target):
-        """Returns runfiles dir. """
-        return '%s.runfiles' % self._executable(target)
+    def _runfiles_dir(self, target, shard=None):
+        """Returns runfiles dir, each shard of a test has its own one. """
+        if shard is None:
+            return '%s.runfiles' % self._executable(target)
+        return '%s.shard%d.runfiles' % (self._executable(target), shard)
 
     def _get_prebuilt_files(self, target):
         """Get prebuilt files for one target that it depends. """
@@ -79,9 +81,9 @@ class BinaryRunner(object):
                 console.error_exit('%s could not exist with %s in testdata of %s' % (
                                    dest, item, target.fullname))
 
-    def _prepare_env(self, target):
+    def _prepare_env(self, target, shard=None):
         """Prepare the test environment. """
-        runfiles_dir = self._runfiles_dir(target)
+        runfiles_dir = self._runfiles_dir(target, shard)
         shutil.rmtree(runfiles_dir, ignore_errors=True)
         os.mkdir(runfiles_dir)
         # Build profile symlink
@@ -103,7 +105,7 @@ class BinaryRunner(object):
                 continue
             os.symlink(src, dst)
 
-        self._prepare_test_data(target)
+        self._prepare_test_data(target, shard)
         run_env = dict(os.environ)
         environ_add_path(run_env, 'LD_LIBRARY_PATH', runfiles_dir)
         run_lib_paths = config.get_item('cc_binary_config', 'run_lib_paths')
@@ -120,10 +122,10 @@ class BinaryRunner(object):
 
         return run_env
 
-    def _prepare_test_data(self, target):
+    def _prepare_test_data(self, target, shard=None):
         if 'testdata' not in target.data:
             return
-        runfiles_dir = self._runfiles_dir(target)
+        runfiles_dir = self._runfiles_dir(target, shard)
         dest_list = []
         for i in target.data['testdata']:
             if isinstance(i, tuple):
@@ -158,14 +160,14 @@ class BinaryRunner(object):
             elif os.path.isdir(src):
                 shutil.copytree(src, dest_path)
 
-        self._prepare_extra_test_data(target)
+        self._prepare_extra_test_data(target, shard)
 
-    def _prepare_extra_test_data(self, target):
+    def _prepare_extra_test_data(self, target, shard=None):
         """Prepare extra test data specified in the .testdata file if it exists. """
         testdata = os.path.join(self.build_dir, target.path,
                                 '%s.testdata' % target.name)
         if os.path.isfile(testdata):
-            runfiles_dir = self._runfiles_dir(target)
+            runfiles_dir = self._runfiles_dir(target, shard)
             for line in open(testdata):
                 data = line.strip().split()
                 if len(data) == 1:
@@ -178,10 +180,11 @@ class BinaryRunner(object):
                     os.makedirs(dst_dir)
                 shutil.copy2(src, dst)
 
-    def _clean_target(self, target):
+    def _clean_target(self, target, shard=None):
         """clean the test target environment. """
         profile_link_name = os.path.basename(self.build_dir)
-        profile_link_path = os.path.join(self._runfiles_dir(target), profile_link_name)
+        profile_link_path = os.path.join(self._runfiles_dir(target, shard),
+                                         profile_link_name)
         if os.path.exists(profile_link_path):
             os.remove(profile_link_path)
 
@@ -14,10 +14,11 @@
 
 import os
 import time
-import json
 
+import blade_trace
 import config
 import console
+import cost_report
 
 from blade_util import cpu_count
 from dependency_analyzer import analyze_deps
@@ -89,32 +90,40 @@ class Blade(object):
 
         self.__build_time = time.time()
 
-        self.__build_platform = BuildPlatform()
+        self.__build_platform = BuildPlatform(self.__build_path)
         self.build_environment = BuildEnvironment(self.__root_dir)
+        if config.get_item('global_config', 'native_builder') == 'ninja':
+            self.build_environment.setup_action_cache(self.__options)
 
         self.svn_root_dirs = []
+        self.__load_cache_stats = (0, 0)
 
-        self._verify_history_path = os.path.join(build_path, '.blade_verify.json')
-        self._verify_history = {
-            'header_inclusion_dependencies': {},  # path(.H) -> mtime(modification time)
-        }
+        # Outputs of ninja build statements -> (target key, rule)
+        self.__ninja_outputs = {}
 
     def load_targets(self):
         """Load the targets. """
         console.info('loading BUILDs...')
-        (self.__direct_targets,
-         self.__all_command_targets,
-         self.__build_targets) = load_targets(self.__command_targets,
-                                              self.__root_dir,
-                                              self)
+        with blade_trace.span('load_targets'):
+            (self.__direct_targets,
+             self.__all_command_targets,
+             self.__build_targets) = load_targets(self.__command_targets,
+                                                  self.__root_dir,
+                                                  self)
         console.info('loading done.')
+        hits, misses = self.__load_cache_stats
+        if hits:
+            console.info('%d BUILD files loaded from cache, %d parsed.' % (hits, misses))
         return self.__direct_targets, self.__all_command_targets  # For test
 
     def analyze_targets(self):
         """Expand the targets. """
         console.info('analyzing dependency graph...')
-        (self.__sorted_targets_keys,
-         self.__depended_targets) = analyze_deps(self.__build_targets)
+        with blade_trace.span('analyze_targets'):
+            (self.__sorted_targets_keys,
+             self.__depended_targets) = analyze_deps(
+                     self.__build_targets,
+                     os.path.join(self.__build_path, '.blade_deps_cache'))
         self.__targets_expanded = True
 
         console.info('analyzing done.')
@@ -129,8 +138,9 @@ class Blade(object):
     def generate_build_rules(self):
         """Generate the constructing rules. """
         console.info('generating build rules...')
-        generator = self.get_build_rules_generator()
-        rules = generator.generate_build_script()
+        with blade_trace.span('generate_build_rules'):
+            generator = self.get_build_rules_generator()
+            rules = generator.generate_build_script()
         console.info('generating done.')
         return rules
 
@@ -139,22 +149,6 @@ class Blade(object):
         if self.__command != 'query':
             self.generate_build_rules()
 
-    def verify(self):
-        """Verify specific targets after build is complete. """
-        verify_history = self.load_verify_history()
-        error = 0
-        header_inclusion_dependencies = config.get_item('cc_config',
-                                                        'header_inclusion_dependencies')
-        header_inclusion_history = verify_history['header_inclusion_dependencies']
-        for k in self.__sorted_targets_keys:
-            target = self.__build_targets[k]
-            if (header_inclusion_dependencies and
-                target.type == 'cc_library' and target.srcs):
-                if not target.verify_header_inclusion_dependencies(header_inclusion_history):
-                    error += 1
-        self.dump_verify_history()
-        return error == 0
-
     def run(self, target):
         """Run the target. """
         runner = BinaryRunner(self.__build_targets,
@@ -168,7 +162,8 @@ class Blade(object):
                                  self.__options,
                                  self.__target_database,
                                  self.__direct_targets)
-        return test_runner.run()
+        with blade_trace.span('test'):
+            return test_runner.run()
 
     def query(self, targets):
         """Query the targets. """
@@ -293,6 +288,10 @@ class Blade(object):
     def get_build_time(self):
         return self.__build_time
 
+    def get_blade_path(self):
+        """The path of blade, where the toolchain modules are. """
+        return self.__blade_path
+
     def get_build_path(self):
         """The current building path. """
         return self.__build_path
@@ -313,6 +312,21 @@ class Blade(object):
         """Get the current source path. """
         return self.__current_source_path
 
+    def set_load_cache_stats(self, hits, misses):
+        """Set the hits and misses of the BUILD load cache. """
+        self.__load_cache_stats = (hits, misses)
+
+    def register_ninja_outputs(self, key, rule, outputs):
+        """Record the target and rule which generate the outputs. """
+        for output in outputs:
+            self.__ninja_outputs[output] = (key, rule)
+
+    def report_costs(self):
+        """Report the building costs of targets from the ninja log. """
+        cost_report.report_costs(os.path.join(self.__build_path, '.ninja_log'),
+                                 self.__build_targets,
+                                 self.__ninja_outputs)
+
     def get_target_database(self):
         """Get the whole target database that haven't been expanded. """
         return self.__target_database
@@ -361,9 +375,8 @@ class Blade(object):
         """
         return target_type != 'system_library'
 
-    def gen_targets_rules(self):
-        """Get the build rules and return to the object who queries this. """
-        rules_buf = []
+    def _gen_targets_rules(self):
+        """Generate the build rules of targets, yield (target, rules). """
         skip_test = getattr(self.__options, 'no_test', False)
         skip_package = not getattr(self.__options, 'generate_package', False)
         native_builder = config.get_item('global_config', 'native_builder')
@@ -382,16 +395,41 @@ class Blade(object):
                 and k not in self.__direct_targets):
                 continue
 
-            if native_builder == 'ninja':
-                blade_object.ninja_rules()
-            else:
-                blade_object.scons_rules()
+            with blade_trace.span(target.fullname, 'generate'):
+                if native_builder == 'ninja':
+                    blade_object.ninja_rules()
+                else:
+                    blade_object.scons_rules()
             rules = blade_object.get_rules()
             if rules:
-                rules_buf.append('\n')
-                rules_buf += rules
+                yield target, rules
+
+    def gen_targets_rules(self):
+        """Get the build rules and return to the object who queries this. """
+        rules_buf = []
+        for target, rules in self._gen_targets_rules():
+            rules_buf.append('\n')
+            rules_buf += rules
         return rules_buf
 
+    def gen_targets_rules_by_dir(self):
+        """Get the build rules grouped by the dirs of targets.
+
+        Returns a list of (dir, rules) in the order the dirs first appear.
+
+        """
+        dirs = []
+        rules_by_dir = {}
+        for target, rules in self._gen_targets_rules():
+            rules_buf = rules_by_dir.get(target.path)
+            if rules_buf is None:
+                rules_buf = []
+                rules_by_dir[target.path] = rules_buf
+                dirs.append(target.path)
+            rules_buf.append('\n')
+            rules_buf += rules
+        return [(d, rules_by_dir[d]) for d in dirs]
+
     def get_scons_platform(self):
         """Return handle of the platform class. """
         return self.__build_platform
@@ -407,16 +445,6 @@ class Blade(object):
         keywords = ['thirdparty']
         return keywords
 
-    def load_verify_history(self):
-        if os.path.exists(self._verify_history_path):
-            with open(self._verify_history_path) as f:
-                self._verify_history = json.load(f)
-        return self._verify_history
-
-    def dump_verify_history(self):
-        with open(self._verify_history_path, 'w') as f:
-            json.dump(self._verify_history, f)
-
     def parallel_jobs_num(self):
         """Tune the jobs num. """
         # User has the highest priority
@@ -428,15 +456,21 @@ class Blade(object):
         jobs_num = 0
         distcc_enabled = config.get_item('distcc_config', 'enabled')
 
+        cpu_core_num = cpu_count()
+        # Machines with many cores are usually shared by multiple users,
+        # only use the cores which are idle recently to avoid interfering
+        # other users. Memory heavy actions are limited by ninja pools.
+        try:
+            load_average = os.getloadavg()[0]
+        except OSError:
+            load_average = 0
+        jobs_num = max(int(cpu_core_num - load_average), 0) + 2
+
         if distcc_enabled and self.build_environment.distcc_env_prepared:
-            # Distcc cost doesn;t much local cpu, jobs can be quite large.
+            # Distcc cost doesn;t much local cpu, jobs can be quite large,
+            # but preprocessing and linking are still run locally.
             distcc_num = len(self.build_environment.get_distcc_hosts_list())
-            jobs_num = min(max(int(1.5 * distcc_num), 1), 20)
-        else:
-            cpu_core_num = cpu_count()
-            # machines with cpu_core_num > 4 is usually shared by multiple users,
-            # set an upper bound to avoid interfering other users
-            jobs_num = min(2 * cpu_core_num, 8)
+            jobs_num = max(min(int(1.5 * distcc_num), 4 * jobs_num), jobs_num)
 
         if jobs_num != user_jobs_num:
             console.info('tunes the parallel jobs number(-j N) to be %d' % (
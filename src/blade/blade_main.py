@@ -79,10 +79,13 @@ import traceback
 from string import Template
 
 import blade
+import blade_trace
 import build_attributes
 import console
 import config
+import toolchain_server
 
+from blade_util import cpu_count
 from blade_util import find_blade_root_dir, find_file_bottom_up
 from blade_util import get_cwd
 from blade_util import lock_file, unlock_file
@@ -223,12 +226,14 @@ def _check_code_style(targets):
 
 
 def _run_native_builder(cmd):
-    p = subprocess.Popen(subprocess.list2cmdline(cmd), shell=True)
-    try:
-        p.wait()
-        return p.returncode
-    except:  # KeyboardInterrupt
-        return 1
+    cmdline = subprocess.list2cmdline(cmd)
+    with blade_trace.span(cmd[0], 'build', {'command': cmdline}):
+        p = subprocess.Popen(cmdline, shell=True)
+        try:
+            p.wait()
+            return p.returncode
+        except:  # KeyboardInterrupt
+            return 1
 
 
 def native_builder_options(options):
@@ -259,11 +264,25 @@ def _ninja_build(options):
         # so only set it when user specified it explicitly.
         # cmd.append('-j%s' % options.jobs)
     cmd.append('-j%s' % (options.jobs or blade.blade.parallel_jobs_num()))
+    if not options.jobs:
+        # Stop starting new actions when the machine is overloaded
+        cmd.append('-l%s' % cpu_count())
     if options.keep_going:
         cmd.append('-k0')
     if options.verbose:
         cmd.append('-v')
-    return _run_native_builder(cmd)
+    if not config.get_item('global_config', 'toolchain_server'):
+        returncode = _run_native_builder(cmd)
+    else:
+        server = toolchain_server.ToolchainServer(blade.blade.get_build_path(),
+                                                  blade.blade.get_blade_path())
+        server.start()
+        try:
+            returncode = _run_native_builder(cmd)
+        finally:
+            server.stop()
+    blade.blade.build_environment.report_action_cache(blade.blade.get_build_path())
+    return returncode
 
 
 def build(options):
@@ -277,10 +296,12 @@ def build(options):
     if returncode != 0:
         console.error('building failure.')
         return returncode
-    if not blade.blade.verify():
-        console.error('building failure.')
-        return 1
     console.info('building done.')
+    if options.report_costs:
+        if config.get_item('global_config', 'native_builder') == 'ninja':
+            blade.blade.report_costs()
+        else:
+            console.warning('--report-costs is only supported by ninja')
     return 0
 
 
@@ -412,12 +433,13 @@ def adjust_config_by_options(config, options):
 
 
 def clear_build_script():
-    for script in ('SConstruct', 'build.ninja'):
-        script = os.path.join(_BLADE_ROOT_DIR, script)
-        try:
-            os.remove(script)
-        except OSError:
-            pass
+    # build.ninja is kept and only rewritten when it changes, so ninja
+    # needn't reload everything and its logs keep valid
+    script = os.path.join(_BLADE_ROOT_DIR, 'SConstruct')
+    try:
+        os.remove(script)
+    except OSError:
+        pass
 
 
 def run_subcommand(command, options, targets, blade_path, build_dir):
@@ -477,9 +499,21 @@ def run_subcommand_profile(command, options, targets, blade_path, build_dir):
     return exit_code[0]
 
 
+def _make_import_paths_absolute():
+    """Target modules are imported lazily, after blade changed the working dir,
+    so relative import paths must be made absolute before that. """
+    sys.path[:] = [os.path.abspath(p) if p else p for p in sys.path]
+    package = sys.modules.get(__name__.rpartition('.')[0])
+    if package is not None:
+        package.__path__ = [os.path.abspath(p) for p in package.__path__]
+
+
 def _main(blade_path):
     """The main entry of blade. """
+    _make_import_paths_absolute()
     command, options, targets = parse_command_line()
+    if options.trace:
+        blade_trace.start(os.path.abspath(options.trace))
     if not targets:
         targets = ['.']
     global _BLADE_ROOT_DIR
@@ -499,6 +533,7 @@ def _main(blade_path):
         return run_subcommand(command, options, targets, blade_path, build_dir)
     finally:
         unlock_workspace(lock_file_fd)
+        blade_trace.stop()
 
 
 def main(blade_path):
@@ -11,11 +11,16 @@
 """
 
 
+import cPickle
+import json
 import os
 import subprocess
+import time
+from distutils.spawn import find_executable
 
 import config
 import console
+from blade_util import cpu_count
 from blade_util import var_to_list
 
 
@@ -94,21 +99,85 @@ class BuildArchitecture(object):
 
 
 class BuildPlatform(object):
-    """The build platform class which handles and gets the platform info. """
-    def __init__(self):
+    """The build platform class which handles and gets the platform info.
+
+    Each kind of info is probed on demand by running the tool, and cached
+    in the build dir along with the fingerprint of the tool binaries and
+    related environment variables, so it is probed again only when any of
+    them changes.
+
+    """
+    _VERSION = 1
+
+    def __init__(self, build_dir=None):
         """Init. """
-        self.gcc_version = self._get_gcc_version()
-        self.python_inc = self._get_python_include()
-        self.php_inc_list = self._get_php_include()
-        self.java_inc_list = self._get_java_include()
-        self.nvcc_version = self._get_nvcc_version()
-        self.cuda_inc_list = self._get_cuda_include()
+        self.cache_file = None
+        if build_dir:
+            self.cache_file = os.path.join(build_dir, '.blade_platform')
+        self.cache = None  # name -> (fingerprint, info), loaded on demand
+        self.info = {}
+
+    def _load_cache(self):
+        self.cache = {}
+        if self.cache_file and os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'rb') as f:
+                    version, cache = cPickle.load(f)
+                if version == self._VERSION:
+                    self.cache = cache
+            except Exception:
+                console.warning('Failed to load %s, ignored' % self.cache_file)
+
+    def _save_cache(self):
+        if not self.cache_file or not os.path.isdir(os.path.dirname(self.cache_file)):
+            return
+        tmp = self.cache_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((self._VERSION, self.cache), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.cache_file)
+
+    @staticmethod
+    def _fingerprint(tools, env_names):
+        """Return the fingerprint of the tool commands and environment variables. """
+        fingerprint = []
+        for tool in tools:
+            for word in tool.split():
+                path = find_executable(word)
+                if path:
+                    path = os.path.realpath(path)
+                    fingerprint.append((word, path, os.path.getmtime(path)))
+                else:
+                    fingerprint.append((word, None, None))
+        fingerprint += [(name, os.environ.get(name)) for name in env_names]
+        return tuple(fingerprint)
+
+    def _get_info(self, name, probe, tools, env_names=()):
+        """Return the info from the cache or the probe function. """
+        if name in self.info:
+            return self.info[name]
+        if self.cache is None:
+            self._load_cache()
+        fingerprint = self._fingerprint(tools, env_names)
+        entry = self.cache.get(name)
+        if entry is not None and entry[0] == fingerprint:
+            info = entry[1]
+        else:
+            info = probe()
+            if info is not None:
+                self.cache[name] = (fingerprint, info)
+                self._save_cache()
+        self.info[name] = info
+        return info
+
+    @staticmethod
+    def _gcc_command():
+        return os.path.join(os.environ.get('TOOLCHAIN_DIR', ''),
+                            os.environ.get('CC', 'gcc'))
 
     @staticmethod
     def _get_gcc_version():
         """Get the gcc version. """
-        gcc = os.path.join(os.environ.get('TOOLCHAIN_DIR', ''),
-                           os.environ.get('CC', 'gcc'))
+        gcc = BuildPlatform._gcc_command()
         returncode, stdout, stderr = BuildPlatform._execute(gcc + ' -dumpversion')
         if returncode == 0:
             return stdout.strip()
@@ -125,15 +194,20 @@ class BuildPlatform(object):
         return ''
 
     @staticmethod
-    def _get_nvcc_version():
-        """Get the nvcc version. """
+    def _get_nvcc_info():
+        """Get the nvcc version and the cuda include dirs. """
         nvcc = os.environ.get('NVCC', 'nvcc')
         returncode, stdout, stderr = BuildPlatform._execute(nvcc + ' --version')
         if returncode == 0:
             version_line = stdout.splitlines(True)[-1]
             version = version_line.split()[5]
-            return version
-        return ''
+            cuda_version = version_line.split()[4].replace(',', '')
+            include_list = []
+            if os.path.isdir('/usr/local/cuda-%s' % cuda_version):
+                include_list.append('/usr/local/cuda-%s/include' % cuda_version)
+                include_list.append('/usr/local/cuda-%s/samples/common/inc' % cuda_version)
+            return version, include_list
+        return '', []
 
     @staticmethod
     def _get_python_include():
@@ -158,11 +232,6 @@ class BuildPlatform(object):
     @staticmethod
     def _get_java_include():
         include_list = []
-        java_home = os.environ.get('JAVA_HOME', '')
-        if java_home:
-            include_list.append('%s/include' % java_home)
-            include_list.append('%s/include/linux' % java_home)
-            return include_list
         returncode, stdout, stderr = BuildPlatform._execute(
                 'java -version', redirect_stderr_to_stdout = True)
         if returncode == 0:
@@ -175,23 +244,18 @@ class BuildPlatform(object):
         return []
 
     @staticmethod
-    def _get_cuda_include():
-        include_list = []
-        cuda_path = os.environ.get('CUDA_PATH')
-        if cuda_path:
-            include_list.append('%s/include' % cuda_path)
-            include_list.append('%s/samples/common/inc' % cuda_path)
-            return include_list
-        returncode, stdout, stderr = BuildPlatform._execute('nvcc --version')
-        if returncode == 0:
-            version_line = stdout.splitlines(True)[-1]
-            version = version_line.split()[4]
-            version = version.replace(',', '')
-            if os.path.isdir('/usr/local/cuda-%s' % version):
-                include_list.append('/usr/local/cuda-%s/include' % version)
-                include_list.append('/usr/local/cuda-%s/samples/common/inc' % version)
-                return include_list
-        return []
+    def _get_go_env(go):
+        """Get the go environment variables such as GOOS and GOARCH. """
+        returncode, stdout, stderr = BuildPlatform._execute(go + ' env')
+        if returncode:
+            console.warning('Failed to run "%s env": %s' % (go, stderr))
+            return None
+        go_env = {}
+        for line in stdout.splitlines():
+            if '=' in line:
+                key, value = line.split('=', 1)
+                go_env[key.strip()] = value.strip().strip('"')
+        return go_env
 
     @staticmethod
     def _execute(cmd, redirect_stderr_to_stdout = False):
@@ -209,27 +273,43 @@ class BuildPlatform(object):
 
     def get_gcc_version(self):
         """Returns gcc version. """
-        return self.gcc_version
+        return self._get_info('gcc_version', self._get_gcc_version,
+                              [self._gcc_command()])
 
     def get_python_include(self):
         """Returns python include. """
-        return self.python_inc
+        return self._get_info('python_include', self._get_python_include,
+                              ['python-config'])
 
     def get_php_include(self):
         """Returns a list of php include. """
-        return self.php_inc_list
+        return self._get_info('php_include', self._get_php_include,
+                              ['php-config'])
 
     def get_java_include(self):
         """Returns a list of java include. """
-        return self.java_inc_list
+        java_home = os.environ.get('JAVA_HOME', '')
+        if java_home:
+            return ['%s/include' % java_home, '%s/include/linux' % java_home]
+        return self._get_info('java_include', self._get_java_include, ['java'])
 
     def get_nvcc_version(self):
         """Returns nvcc version. """
-        return self.nvcc_version
+        return self._get_info('nvcc', self._get_nvcc_info,
+                              [os.environ.get('NVCC', 'nvcc')])[0]
 
     def get_cuda_include(self):
         """Returns a list of cuda include. """
-        return self.cuda_inc_list
+        cuda_path = os.environ.get('CUDA_PATH')
+        if cuda_path:
+            return ['%s/include' % cuda_path, '%s/samples/common/inc' % cuda_path]
+        return self._get_info('nvcc', self._get_nvcc_info,
+                              [os.environ.get('NVCC', 'nvcc')])[1]
+
+    def get_go_env(self, go):
+        """Returns a dict of go environment variables, or None if failed. """
+        return self._get_info('go_env:' + go, lambda: self._get_go_env(go), [go],
+                              ['GOROOT', 'GOPATH', 'GOOS', 'GOARCH'])
 
 
 class CcFlagsManager(object):
@@ -241,20 +321,98 @@ class CcFlagsManager(object):
         self.options = options
         self.build_dir = build_dir
         self.gcc_version = gcc_version
+        self.flags_cache_file = os.path.join(build_dir, '.blade_cc_flags.json')
+        self.flags_cache = None  # Loaded on demand, key -> supported
+
+    def _compiler_key(self):
+        """Return the key identifies the compiler, its path, mtime and version. """
+        # The compiler may be wrapped, such as 'ccache gcc'
+        compiler = self.cc.split()[-1] if self.cc else 'gcc'
+        path = find_executable(compiler) or compiler
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = 0
+        return '%s:%s:%s' % (os.path.realpath(path), mtime, self.gcc_version)
+
+    def _load_flags_cache(self):
+        self.flags_cache = {}
+        if os.path.exists(self.flags_cache_file):
+            try:
+                with open(self.flags_cache_file) as f:
+                    self.flags_cache = json.load(f)
+            except (IOError, ValueError):
+                console.warning('Failed to load %s, ignored' % self.flags_cache_file)
+
+    def _save_flags_cache(self):
+        if not os.path.isdir(self.build_dir):
+            return
+        tmp = self.flags_cache_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.flags_cache, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.flags_cache_file)
+
+    def _probe_flags(self, flags):
+        """Check whether the compiler supports the (flag, language) pairs by
+        compiling an empty program, run in parallel. """
+        result = {}
+        pending = list(enumerate(flags))
+        running = []
+        max_jobs = cpu_count()
+        while pending or running:
+            while pending and len(running) < max_jobs:
+                index, (flag, language) = pending.pop(0)
+                # Put compilation output into build dir instead of /dev/null
+                # because the command line with '--coverage' below exit
+                # with status 1 which makes '--coverage' unsupported
+                # echo "int main() { return 0; }" | gcc -o /dev/null -c -x c --coverage - > /dev/null 2>&1
+                obj = os.path.join(self.build_dir, '.flag_probe_%d.o' % index)
+                cmd = ('echo "int main() { return 0; }" | '
+                       '%s -o %s -c -x %s %s - > /dev/null 2>&1 && rm -f %s' % (
+                       self.cc, obj, language, flag, obj))
+                running.append(((flag, language),
+                                subprocess.Popen(cmd, shell=True)))
+            item, p = running.pop(0)
+            result[item] = p.wait() == 0
+        return result
+
+    def _check_flags(self, flags):
+        """Return a dict of (flag, language) -> whether it is supported.
+
+        The results are cached persistently and keyed by the compiler, only
+        the flags not in the cache are probed.
+
+        """
+        if self.flags_cache is None:
+            self._load_flags_cache()
+        compiler_key = self._compiler_key()
+        result, missing = {}, []
+        for flag, language in flags:
+            supported = self.flags_cache.get(
+                    '%s:%s:%s' % (compiler_key, language, flag))
+            if supported is None:
+                missing.append((flag, language))
+            else:
+                result[(flag, language)] = supported
+        if missing:
+            start_time = time.time()
+            probed = self._probe_flags(missing)
+            console.info('checked %d C/C++ flags in %.2fs' % (
+                         len(missing), time.time() - start_time))
+            for (flag, language), supported in probed.iteritems():
+                self.flags_cache['%s:%s:%s' % (
+                        compiler_key, language, flag)] = supported
+            result.update(probed)
+            self._save_flags_cache()
+        return result
 
     def _filter_out_invalid_flags(self, flag_list, language='c'):
         """Filter the unsupported compilation flags. """
+        flag_list = var_to_list(flag_list)
+        checked = self._check_flags([(flag, language) for flag in flag_list])
         supported_flags, unsupported_flags = [], []
-        # Put compilation output into test.o instead of /dev/null
-        # because the command line with '--coverage' below exit
-        # with status 1 which makes '--coverage' unsupported
-        # echo "int main() { return 0; }" | gcc -o /dev/null -c -x c --coverage - > /dev/null 2>&1
-        obj = os.path.join(self.build_dir, 'test.o')
-        for flag in var_to_list(flag_list):
-            cmd = ('echo "int main() { return 0; }" | '
-                   '%s -o %s -c -x %s %s - > /dev/null 2>&1 && rm -f %s' % (
-                   self.cc, obj, language, flag, obj))
-            if subprocess.call(cmd, shell=True) == 0:
+        for flag in flag_list:
+            if checked[(flag, language)]:
                 supported_flags.append(flag)
             else:
                 unsupported_flags.append(flag)
@@ -314,10 +472,13 @@ class CcFlagsManager(object):
     def get_warning_flags(self):
         """Get the warning flags. """
         cc_config = config.get_section('cc_config')
-        cppflags = cc_config['warnings']
-        cxxflags = cc_config['cxx_warnings']
-        cflags = cc_config['c_warnings']
+        cppflags = var_to_list(cc_config['warnings'])
+        cxxflags = var_to_list(cc_config['cxx_warnings'])
+        cflags = var_to_list(cc_config['c_warnings'])
 
+        # Check all of the flags at once to probe them in parallel
+        self._check_flags([(flag, 'c') for flag in cppflags + cflags] +
+                          [(flag, 'c++') for flag in cxxflags])
         filtered_cppflags = self._filter_out_invalid_flags(cppflags)
         filtered_cxxflags = self._filter_out_invalid_flags(cxxflags, 'c++')
         filtered_cflags = self._filter_out_invalid_flags(cflags, 'c')
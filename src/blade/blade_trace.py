@@ -0,0 +1,121 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+
+"""
+ This is the trace module which records the timeline of blade phases in
+ the Chrome trace event format, the trace file can be viewed in
+ chrome://tracing or https://ui.perfetto.dev.
+
+"""
+
+
+import json
+import os
+import threading
+import time
+
+import console
+
+
+# Events recorded, None means tracing is disabled
+_events = None
+_trace_file = ''
+_start_time = 0
+_thread_ids = {}  # thread ident -> tid in trace
+_lock = threading.Lock()
+
+
+def start(trace_file):
+    """Start tracing, the events are written into trace_file when stopped. """
+    global _events, _trace_file, _start_time
+    _events = []
+    _trace_file = trace_file
+    _start_time = time.time()
+    _events.append({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                    'args': {'name': 'blade'}})
+
+
+def enabled():
+    return _events is not None
+
+
+def _thread_id():
+    """Return the tid of current thread, name the track at the first time. """
+    ident = threading.current_thread().ident
+    tid = _thread_ids.get(ident)
+    if tid is None:
+        with _lock:
+            tid = len(_thread_ids)
+            _thread_ids[ident] = tid
+            _events.append({'name': 'thread_name', 'ph': 'M',
+                            'pid': os.getpid(), 'tid': tid,
+                            'args': {'name': threading.current_thread().name}})
+    return tid
+
+
+def add_event(name, category, start_time, end_time, args=None):
+    """Record a complete event of current thread from start_time to end_time. """
+    if _events is None:
+        return
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': int((start_time - _start_time) * 1000000),
+        'dur': int((end_time - start_time) * 1000000),
+        'pid': os.getpid(),
+        'tid': _thread_id(),
+    }
+    if args:
+        event['args'] = args
+    _events.append(event)
+
+
+class _Span(object):
+    """Record the execution of a with block as a complete event. """
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_time = 0
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_event(self.name, self.category, self.start_time, time.time(), self.args)
+
+
+class _NullSpan(object):
+    """Do nothing when tracing is disabled. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+def span(name, category='blade', args=None):
+    """Return a context manager which records the with block as an event. """
+    if _events is None:
+        return _null_span
+    return _Span(name, category, args)
+
+
+def stop():
+    """Stop tracing and write the events into the trace file. """
+    global _events
+    if _events is None:
+        return
+    events, _events = _events, None
+    try:
+        with open(_trace_file, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        console.info('trace is written into %s' % _trace_file)
+    except IOError, e:
+        console.warning('Failed to write trace file %s: %s' % (_trace_file, e))
@@ -13,6 +13,7 @@
 
 """
 
+import copy
 import fcntl
 import os
 import json
@@ -20,7 +21,9 @@ import sys
 import re
 import string
 import signal
+import struct
 import subprocess
+import zipfile
 
 import console
 
@@ -45,10 +48,14 @@ def md5sum_str(user_str):
 
 def md5sum_file(file_name):
     """Calculate md5sum of the file. """
-    f = open(file_name)
-    digest = md5sum_str(f.read())
-    f.close()
-    return digest
+    m = md5.md5()
+    with open(file_name, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            m.update(data)
+    return m.hexdigest()
 
 
 def md5sum(obj):
@@ -221,6 +228,26 @@ def cpu_count():
         return int(os.sysconf('SC_NPROCESSORS_ONLN'))
 
 
+def available_memory():
+    """Return the available physical memory in bytes. """
+    try:
+        meminfo = {}
+        with open('/proc/meminfo') as f:
+            for line in f:
+                fields = line.split()
+                meminfo[fields[0].rstrip(':')] = int(fields[1]) * 1024
+        if 'MemAvailable' in meminfo:
+            return meminfo['MemAvailable']
+        return meminfo['MemFree'] + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)
+    except (IOError, KeyError, ValueError):
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def physical_memory():
+    """Return the total physical memory in bytes. """
+    return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
 def regular_variable_name(var):
     """regular_variable_name.
 
@@ -238,3 +265,43 @@ def regular_variable_name(var):
 
     """
     return var.translate(string.maketrans(',-/.+*', '______'))
+
+
+def zip_copy_member(src, zinfo, dst, arcname=None):
+    """Copy a member from src zip file into dst zip file without recompressing.
+
+    The compressed data is copied byte-for-byte along with the crc and sizes
+    recorded in zinfo. Encrypted and zip64 members are copied by the normal
+    decompressing way.
+
+    """
+    if (zinfo.flag_bits & 0x1 or
+        zinfo.file_size > zipfile.ZIP64_LIMIT or
+        zinfo.compress_size > zipfile.ZIP64_LIMIT):
+        dst.writestr(arcname or zinfo.filename, src.read(zinfo))
+        return
+    src.fp.seek(zinfo.header_offset)
+    header = struct.unpack(zipfile.structFileHeader,
+                           src.fp.read(zipfile.sizeFileHeader))
+    src.fp.seek(header[zipfile._FH_FILENAME_LENGTH] +
+                header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    info = copy.copy(zinfo)
+    if arcname:
+        info.filename = arcname
+    # Sizes and crc are known, they are written in the local header
+    # rather than the data descriptor
+    info.flag_bits &= ~0x08
+    info.header_offset = dst.fp.tell()
+    dst._writecheck(info)
+    dst._didModify = True
+    dst.fp.write(info.FileHeader())
+    remain = info.compress_size
+    while remain > 0:
+        data = src.fp.read(min(remain, 1024 * 1024))
+        if not data:
+            raise zipfile.BadZipfile('Truncated member %s' % zinfo.filename)
+        dst.fp.write(data)
+        remain -= len(data)
+    dst.filelist.append(info)
+    dst.NameToInfo[info.filename] = info
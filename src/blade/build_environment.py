@@ -11,12 +11,16 @@
 """
 
 
-import glob
+import atexit
+import cPickle
 import math
 import os
+import stat
 import subprocess
+import threading
 import time
 
+import action_cache
 import console
 
 
@@ -57,6 +61,10 @@ class BuildEnvironment(object):
         else:
             self.dccc_env_prepared = False
 
+        # Local action cache of ninja
+        self.action_cache_dir = ''
+        self.action_cache_size = -1
+
         self.rules_buf = []
 
     @staticmethod
@@ -137,11 +145,50 @@ class BuildEnvironment(object):
         self._add_rule('CacheDir("%s")' % cache_dir)
         self._add_rule('scache_manager = build_environment.ScacheManager("%s", cache_limit=%d)' % (
                     cache_dir, cache_size))
+        self._add_rule('scache_manager.start()')
         self._add_rule('Progress(scache_manager, interval=100)')
 
         console.info('using cache directory %s' % cache_dir)
         console.info('scache size %d' % cache_size)
 
+    def setup_action_cache(self, options):
+        """Setup the local action cache of ninja building actions. """
+        cache_dir = getattr(options, 'cache_dir', None)
+        if cache_dir is None:
+            cache_dir = os.environ.get('BLADE_CACHE_DIR')
+        if not cache_dir:
+            # '' to disable cache
+            return
+        cache_size = getattr(options, 'cache_size', None)
+        if cache_size is None:
+            cache_size = os.environ.get('BLADE_CACHE_SIZE', '2')
+        if cache_size == 'unlimited':
+            self.action_cache_size = -1
+        else:
+            self.action_cache_size = int(cache_size) * 1024 * 1024 * 1024
+        # Separated from the scons cache whose files are purged by ScacheManager
+        self.action_cache_dir = os.path.join(
+                os.path.abspath(os.path.expanduser(cache_dir)), 'actions')
+
+    def report_action_cache(self, build_dir):
+        """Report the hit rate of the action cache and evict the least
+        recently used entries beyond the cache size. """
+        if not self.action_cache_dir:
+            return
+        stats_file = os.path.join(build_dir, action_cache.STATS_FILE)
+        hits, misses = action_cache.load_stats(stats_file)
+        if os.path.exists(stats_file):
+            os.remove(stats_file)
+        if hits + misses:
+            console.info('action cache: %d hits, %d misses, hit rate %.1f%%' % (
+                         hits, misses, 100.0 * hits / (hits + misses)))
+        cache = action_cache.ActionCache(self.action_cache_dir)
+        count, size, evicted, evicted_size = cache.evict(self.action_cache_size)
+        if evicted:
+            console.info('action cache: evicted %d entries of %.1fM, '
+                         '%d entries of %.1fM left' % (
+                         evicted, evicted_size / 1048576.0, count, size / 1048576.0))
+
     def setup_build_cache(self, options):
         if self.ccache_installed:  # Perfer ccache because it also cache warning
             self.setup_ccache()
@@ -170,14 +217,22 @@ class ScacheManager(object):
     """Scons cache manager.
 
     Scons cache manager, which should be output to scons script.
-    It will periodically check the cache folder and purge the files
-    with smallest weight. The weight for each file is caculated as
-    file_size * exp(-age * log(2) / half_time).
-
-    We should pay attention that this progress will impact large builds
-    and we should not reduce the progress interval(the evaluating nodes).
+    It keeps a persistent index of the size and atime of files in the
+    cache directory. Files are stored in the subdirectories of the cache,
+    adding or removing files changes the mtime of the subdirectory, so
+    only the changed subdirectories are listed again and only the new
+    files are stated when the index is loaded. During building, the index
+    is updated incrementally by the hooks of the scons cache, and when the
+    total size exceeds the limit, the files with smallest weight are
+    purged in a background thread. The weight for each file is caculated
+    as file_size * exp(-age * log(2) / half_time).
 
     """
+    _VERSION = 1
+
+    # Purge to this ratio of the cache limit to avoid purging frequently
+    _PURGE_TARGET_RATIO = 0.9
+
     def __init__(self, cache_path=None, cache_limit=0,
                  cache_life=6 * 60 * 60):
         self.cache_path = cache_path
@@ -185,48 +240,200 @@ class ScacheManager(object):
         self.cache_life = cache_life
         self.exponent_scale = math.log(2) / cache_life
         self.purge_cnt = 0
+        self.dirs = {}  # subdir -> mtime
+        self.files = {}  # subdir -> {name: [size, atime]}
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.purged = 0
+        self.purged_size = 0
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.purge_thread = None
+        if cache_path:
+            self.index_path = os.path.join(cache_path, '.blade_scache_index')
+            self._load_index()
+
+    def start(self):
+        """Hook the scons cache and report statistics at exit. """
+        import SCons.CacheDir
+        manager = self
+        cache_dir_class = SCons.CacheDir.CacheDir
+        retrieve, push = cache_dir_class.retrieve, cache_dir_class.push
+
+        def retrieve_hook(cache, node):
+            retrieved = retrieve(cache, node)
+            if cache.is_enabled():
+                manager._on_retrieve(cache.cachepath(node)[1], retrieved)
+            return retrieved
+
+        def push_hook(cache, node):
+            ret = push(cache, node)
+            if cache.is_enabled():
+                manager._on_push(cache.cachepath(node)[1])
+            return ret
+
+        cache_dir_class.retrieve = retrieve_hook
+        cache_dir_class.push = push_hook
+        atexit.register(self.finish)
 
     def __call__(self, node, *args, **kwargs):
-        self.purge(self.get_file_list())
-
-    def cache_remove(self, file_item):
-        if not file_item:
+        if self.cache_limit < 0 or self.total_size <= self.cache_limit:
             return
-        if not os.path.exists(file_item):
+        if self.purge_thread and self.purge_thread.is_alive():
             return
-        os.remove(file_item)
-
-    def purge(self, file_list):
-        self.purge_cnt += 1
-        if not file_list:
+        self.purge_thread = threading.Thread(target=self.purge)
+        self.purge_thread.daemon = True
+        self.purge_thread.start()
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'rb') as f:
+                    version, dirs, files = cPickle.load(f)
+                if version == self._VERSION:
+                    self.dirs, self.files = dirs, files
+            except Exception:
+                console.warning('Failed to load scons cache index %s, ignored' %
+                                self.index_path)
+        self._refresh_index()
+
+    def _refresh_index(self):
+        """Update the files of subdirectories changed since the index was saved. """
+        subdirs = {}
+        if os.path.isdir(self.cache_path):
+            for name in os.listdir(self.cache_path):
+                path = os.path.join(self.cache_path, name)
+                if os.path.isdir(path):
+                    subdirs[name] = os.stat(path).st_mtime
+        for name in set(self.files) - set(subdirs):
+            del self.files[name]
+            self.dirs.pop(name, None)
+        for name, mtime in subdirs.iteritems():
+            if name in self.files and self.dirs.get(name) == mtime:
+                continue
+            self.files[name] = self._scan_dir(name, self.files.get(name, {}))
+            # Changes in the same time slot of mtime can not be detected
+            if mtime < self.start_time - 1:
+                self.dirs[name] = mtime
+            else:
+                self.dirs.pop(name, None)
+        self.total_size = sum(f[0] for files in self.files.itervalues()
+                              for f in files.itervalues())
+
+    def _scan_dir(self, name, old_files):
+        """Return files of the subdir, only the new files are stated. """
+        dir = os.path.join(self.cache_path, name)
+        files = {}
+        for filename in os.listdir(dir):
+            entry = old_files.get(filename)
+            if entry is None:
+                try:
+                    st = os.stat(os.path.join(dir, filename))
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                entry = [st.st_size, st.st_atime]
+            files[filename] = entry
+        return files
+
+    def _split_path(self, cache_file):
+        return os.path.split(os.path.relpath(cache_file, self.cache_path))
+
+    def _on_retrieve(self, cache_file, retrieved):
+        with self.lock:
+            if not retrieved:
+                self.misses += 1
+                return
+            self.hits += 1
+            dir, name = self._split_path(cache_file)
+            entry = self.files.get(dir, {}).get(name)
+            if entry:
+                entry[1] = time.time()
+
+    def _on_push(self, cache_file):
+        try:
+            size = os.path.getsize(cache_file)
+        except OSError:
             return
-        map(self.cache_remove, file_list)
-        console.info('scons cache purged')
+        dir, name = self._split_path(cache_file)
+        with self.lock:
+            files = self.files.setdefault(dir, {})
+            entry = files.get(name)
+            if entry:
+                self.total_size -= entry[0]
+            files[name] = [size, time.time()]
+            self.total_size += size
 
     def get_file_list(self):
-        if not self.cache_path:
-            return []
-
-        file_stat_list = [(x, os.stat(x)[6:8])
-                for x in glob.glob(os.path.join(self.cache_path, '*', '*'))]
-        if not file_stat_list:
+        """Return the files with smallest weight to be purged. """
+        if not self.cache_path or self.cache_limit < 0:
             return []
-
         current_time = time.time()
-        file_stat_list = [(x[0], x[1][0],
-            x[1][0] * math.exp(self.exponent_scale * (x[1][1] - current_time)))
-            for x in file_stat_list]
-
+        with self.lock:
+            file_stat_list = [((dir, name), f[0],
+                f[0] * math.exp(self.exponent_scale * (f[1] - current_time)))
+                for dir, files in self.files.iteritems()
+                for name, f in files.iteritems()]
         file_stat_list.sort(key=lambda x: x[2], reverse=True)
 
-        total_sz, start_index = 0, None
+        target_size = self.cache_limit * self._PURGE_TARGET_RATIO
+        total_sz = 0
         for i, x in enumerate(file_stat_list):
             total_sz += x[1]
-            if total_sz >= self.cache_limit:
-                start_index = i
-                break
+            if total_sz >= target_size:
+                return [x[0] for x in file_stat_list[i:]]
+        return []
 
-        if not start_index:
-            return []
-        else:
-            return [x[0] for x in file_stat_list[start_index:]]
+    def cache_remove(self, file_item):
+        dir, name = file_item
+        try:
+            os.remove(os.path.join(self.cache_path, dir, name))
+        except OSError:
+            pass
+        with self.lock:
+            entry = self.files.get(dir, {}).pop(name, None)
+            if entry:
+                self.total_size -= entry[0]
+                self.purged += 1
+                self.purged_size += entry[0]
+
+    def purge(self, file_list=None):
+        if file_list is None:
+            file_list = self.get_file_list()
+        self.purge_cnt += 1
+        if not file_list:
+            return
+        map(self.cache_remove, file_list)
+        console.info('scons cache purged')
+
+    def save_index(self):
+        if not self.cache_path or not os.path.isdir(self.cache_path):
+            return
+        tmp = '%s.%d.tmp' % (self.index_path, os.getpid())
+        try:
+            with self.lock:
+                with open(tmp, 'wb') as f:
+                    cPickle.dump((self._VERSION, self.dirs, self.files), f,
+                                 cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.index_path)
+        except (IOError, OSError), e:
+            console.warning('Failed to save scons cache index %s: %s' % (
+                            self.index_path, e))
+
+    def finish(self):
+        """Wait the purging, save the index and report statistics. """
+        if self.purge_thread:
+            self.purge_thread.join()
+        self.save_index()
+        requests = self.hits + self.misses
+        if requests:
+            console.info('scons cache: %d hits, %d misses, hit rate %.1f%%' % (
+                         self.hits, self.misses, 100.0 * self.hits / requests))
+        if self.purged:
+            console.info('scons cache: purged %d files of %.1fM' % (
+                         self.purged, self.purged_size / 1048576.0))
+        console.info('scons cache: %d files of %.1fM' % (
+                     sum(len(files) for files in self.files.itervalues()),
+                     self.total_size / 1048576.0))
@@ -22,6 +22,27 @@ def register_function(f):
     register_variable(f.__name__, f)
 
 
+def _lazy_function(module_name, name):
+    """Return a stub which imports the module and calls the real function. """
+    def stub(*args, **kwargs):
+        # Importing the module registers the real functions in place of stubs
+        module = __import__(module_name, globals())
+        return getattr(module, name)(*args, **kwargs)
+    stub.__name__ = name
+    return stub
+
+
+def register_lazy_functions(module_name, names):
+    """Register build functions defined in a module without importing it.
+
+    The module is imported the first time any of these functions is called
+    in a BUILD file.
+
+    """
+    for name in names:
+        register_variable(name, _lazy_function(module_name, name))
+
+
 def get_all():
     """Get the globals dict"""
     return __build_rules.copy()
@@ -730,9 +730,6 @@ class CcTarget(Target):
                         usr_libs.append(lib)
         return sys_libs, usr_libs, link_all_symbols_libs
 
-    def _cc_hdrs_ninja(self, hdrs_inclusion_srcs, vars):
-        pass
-
     def _cc_objects_generated_header_files_dependency(self):
         """Return a stamp which depends on targets which generate header files. """
         deps = self._generated_header_files_dependencies()
@@ -761,6 +758,9 @@ class CcTarget(Target):
                          variables=vars)
         self.ninja_build(obj, 'securecc', inputs=secure_obj)
 
+    def _cc_hdrs_verify_ninja(self, hdrs_inclusion_srcs):
+        pass
+
     def _cc_objects_ninja(self, sources=None, generated=False, generated_headers=None):
         """Generate cc objects build rules in ninja. """
         vars = {}
@@ -775,6 +775,7 @@ class CcTarget(Target):
 
         objs_dir = self._target_file_path() + '.objs'
         objs, hdrs_inclusion_srcs = [], []
+        hdrs_inclusion = config.get_item('cc_config', 'header_inclusion_dependencies')
         if sources:
             srcs = sources
         else:
@@ -785,6 +786,10 @@ class CcTarget(Target):
                 self._securecc_object_ninja(obj, src, implicit_deps, vars)
             else:
                 rule = self._get_ninja_rule_from_suffix(src)
+                implicit_outputs = None
+                if hdrs_inclusion:
+                    # Header inclusion stack written by compiling
+                    implicit_outputs = ['%s.H' % obj]
                 if generated:
                     input = self._target_file_path(src)
                     if generated_headers and len(generated_headers) > 1:
@@ -793,18 +798,20 @@ class CcTarget(Target):
                     path = self._source_file_path(src)
                     if os.path.exists(path):
                         input = path
-                        hdrs_inclusion_srcs.append((path, obj, rule))
+                        if hdrs_inclusion:
+                            # Generated sources are not verified
+                            hdrs_inclusion_srcs.append((path, '%s.H' % obj))
                     else:
                         input = self._target_file_path(src)
                 self.ninja_build(obj, rule, inputs=input,
                                  implicit_deps=implicit_deps,
-                                 variables=vars)
+                                 variables=vars,
+                                 implicit_outputs=implicit_outputs)
             objs.append(obj)
 
         self.data['objs'] = objs
-        if (config.get_item('cc_config', 'header_inclusion_dependencies') and
-            hdrs_inclusion_srcs):
-            self._cc_hdrs_ninja(hdrs_inclusion_srcs, vars)
+        if hdrs_inclusion_srcs:
+            self._cc_hdrs_verify_ninja(hdrs_inclusion_srcs)
 
     def _static_cc_library_ninja(self):
         output = self._target_file_path('lib%s.a' % self.name)
@@ -914,7 +921,7 @@ class CcLibrary(CcTarget):
         return True
 
     def _extract_cc_hdrs_from_stack(self, path):
-        """Extract headers from header stack(.H) generated during preprocessing. """
+        """Extract headers from header stack(.H) generated during compiling. """
         hdrs = []
         level_two_hdrs = {}
         with open(path) as f:
@@ -982,91 +989,15 @@ class CcLibrary(CcTarget):
         else:
             return hdrs[:self_hdr_index] + level_two_hdrs[hdr] + hdrs[self_hdr_index + 1:]
 
-    @staticmethod
-    def _parse_hdr_level(line):
-        pos = line.find(' ')
-        if pos == -1:
-            return -1, ''
-        level, hdr = line[:pos].count('.'), line[pos + 1:]
-        if hdr.startswith('./'):
-            hdr = hdr[2:]
-        return level, hdr
-
-    def _extract_generated_hdrs_inclusion_stacks(self, src, history):
-        """Extract generated headers and inclusion stacks for each one of them.
-
-        Given the following inclusions found in the app/example/foo.cc.o.H:
-
-            . ./app/example/foo.h
-            .. build64_release/app/example/proto/foo.pb.h
-            ... build64_release/common/rpc/rpc_service.pb.h
-            . build64_release/app/example/proto/bar.pb.h
-            . ./common/rpc/rpc_client.h
-            .. build64_release/common/rpc/rpc_options.pb.h
-
-        Return a list with each item being a list representing where the
-        generated header is included from in the current translation unit.
-
-        Note that ONLY the first generated header is tracked while other
-        headers included from the generated header directly or indirectly
-        are ignored since that part of inclusion is ensured by imports of
-        proto_library.
-
-        As shown in the example above, it returns:
-
-            [
-                ['app/example/foo.h', 'build64_release/app/example/proto/foo.pb.h'],
-                ['build64_release/app/example/proto/bar.pb.h'],
-                ['common/rpc/rpc_client.h', 'build64_release/common/rpc/rpc_options.pb.h'],
-            ]
-        """
-        objs_dir = self._target_file_path() + '.objs'
-        path = '%s.o.H' % os.path.join(objs_dir, src)
-        if (not os.path.exists(path) or
-            (path in history and int(os.path.getmtime(path)) == history[path])):
-            return '', []
-
-        build_dir = self.build_path
-        stacks, hdrs_stack = [], []
-
-        def _process_hdr(level, hdr, current_level):
-            if hdr.startswith('/'):
-                skip_level = level
-            elif hdr.startswith(build_dir):
-                skip_level = level
-                stacks.append(hdrs_stack + [hdr])
-            else:
-                current_level = level
-                hdrs_stack.append(hdr)
-                skip_level = -1
-            return current_level, skip_level
-
-        current_level = 0
-        skip_level = -1
-        with open(path) as f:
-            for line in f.read().splitlines():
-                if line.startswith('Multiple include guards may be useful for'):
-                    break
-                level, hdr = self._parse_hdr_level(line)
-                if level == -1:
-                    console.log('%s: Unrecognized line %s' % (self.fullname, line))
-                    break
-                if level > current_level:
-                    if skip_level != -1 and level > skip_level:
-                        continue
-                    assert level == current_level + 1
-                    current_level, skip_level = _process_hdr(level, hdr, current_level)
-                else:
-                    while current_level >= level:
-                        current_level -= 1
-                        hdrs_stack.pop()
-                    current_level, skip_level = _process_hdr(level, hdr, current_level)
-
-        return path, stacks
+    def _cc_hdrs_verify_ninja(self, hdrs_inclusion_srcs):
+        """Verify generated headers included by srcs are declared in deps.
 
-    def verify_header_inclusion_dependencies(self, history):
+        The verification is a ninja action depending on the header inclusion
+        stacks(.H) written by compiling, so it runs in parallel with other
+        actions and is skipped when none of the stacks changed.
+        """
         if not self._need_generate_hdrs():
-            return True
+            return
 
         build_targets = self.blade.get_build_targets()
         # TODO(wentingli): Check regular headers as well
@@ -1075,50 +1006,15 @@ class CcLibrary(CcTarget):
             dep = build_targets[key]
             declared_hdrs.update(dep.data.get('generated_hdrs', []))
 
-        preprocess_paths, failed_preprocess_paths = set(), set()
-        for src in self.srcs:
-            source = self._source_file_path(src)
-            path, stacks = self._extract_generated_hdrs_inclusion_stacks(src, history)
-            if not path:
-                continue
-            preprocess_paths.add(path)
-            for stack in stacks:
-                generated_hdr = stack[-1]
-                if generated_hdr not in declared_hdrs:
-                    failed_preprocess_paths.add(path)
-                    stack.pop()
-                    if not stack:
-                        msg = ['In file included from %s' % source]
-                    else:
-                        stack.reverse()
-                        msg = ['In file included from %s' % stack[0]]
-                        prefix = '                 from %s'
-                        msg += [prefix % h for h in stack[1:]]
-                        msg.append(prefix % source)
-                    console.info('\n%s' % '\n'.join(msg))
-                    console.error('%s: Missing dependency declaration in BUILD for %s.' % (
-                                  self.fullname, generated_hdr))
-
-        for preprocess in failed_preprocess_paths:
-            if preprocess in history:
-                del history[preprocess]
-        for preprocess in preprocess_paths - failed_preprocess_paths:
-            history[preprocess] = int(os.path.getmtime(preprocess))
-        return not failed_preprocess_paths
-
-    def _cc_hdrs_ninja(self, hdrs_inclusion_srcs, vars):
-        if not self._need_generate_hdrs():
-            return
-
-        for key in ('c_warnings', 'cxx_warnings'):
-            if key in vars:
-                del vars[key]
-        for src, obj, rule in hdrs_inclusion_srcs:
-            output = '%s.H' % obj
-            rule = '%shdrs' % rule
-            self.ninja_build(output, rule, inputs=src,
-                             implicit_deps=[obj],
-                             variables=vars)
+        sources = [source for source, hdrs_stack in hdrs_inclusion_srcs]
+        hdrs_stacks = [hdrs_stack for source, hdrs_stack in hdrs_inclusion_srcs]
+        stamp = self._target_file_path('%s.hdrs.verified' % self.name)
+        self.ninja_build(stamp, 'hdrsverify', inputs=hdrs_stacks,
+                         variables={
+                             'name' : self.fullname,
+                             'srcs' : ' '.join(sources),
+                             'declared_hdrs' : ' '.join(sorted(declared_hdrs)),
+                         })
 
     def scons_rules(self):
         """scons_rules.
@@ -1624,6 +1520,9 @@ class CcTest(CcBinary):
                  exclusive,
                  heap_check,
                  heap_check_debug,
+                 shard_count,
+                 cpu,
+                 memory,
                  blade,
                  kwargs):
         """Init method.
@@ -1654,6 +1553,12 @@ class CcTest(CcBinary):
         self.data['testdata'] = var_to_list(testdata)
         self.data['always_run'] = always_run
         self.data['exclusive'] = exclusive
+        self._init_test_resources(cpu, memory)
+        if shard_count is not None:
+            if not isinstance(shard_count, int) or shard_count <= 0:
+                console.error_exit('//%s:%s: shard_count should be a positive integer' % (
+                    self.path, self.name))
+            self.data['shard_count'] = shard_count
 
         gtest_lib = var_to_list(cc_test_config['gtest_libs'])
         gtest_main_lib = var_to_list(cc_test_config['gtest_main_libs'])
@@ -1699,6 +1604,9 @@ def cc_test(name,
             exclusive=False,
             heap_check=None,
             heap_check_debug=False,
+            shard_count=None,
+            cpu=1,
+            memory=0,
             **kwargs):
     """cc_test target. """
     cc_test_target = CcTest(name,
@@ -1718,6 +1626,9 @@ def cc_test(name,
                             exclusive,
                             heap_check,
                             heap_check_debug,
+                            shard_count,
+                            cpu,
+                            memory,
                             blade.blade,
                             kwargs)
     blade.blade.register_target(cc_test_target)
@@ -231,6 +231,12 @@ class CmdArguments(object):
             '-n', '--dry-run', dest='dry_run', action='store_true', default=False,
             help='Dry run (don\'t run commands but act like they succeeded)')
 
+        parser.add_argument(
+            '--report-costs', dest='report_costs', action='store_true',
+            default=False,
+            help=('Report building costs of targets and directories and the '
+                  'critical path from the ninja log after building'))
+
     def __add_cache_arguments(self, parser):
         """Add cache related arguments. """
         parser.add_argument(
@@ -330,6 +336,10 @@ class CmdArguments(object):
             parser.add_argument(
                 '--profiling', dest='profiling', action='store_true',
                 help='Blade performance profiling, for blade developing')
+            parser.add_argument(
+                '--trace', dest='trace', type=str, default='',
+                help=('Write the timeline of blade phases into the file in '
+                      'Chrome trace event format'))
             parser.add_argument(
                 '--stop-after', dest='stop_after', type=str,
                 choices=['load', 'analyze', 'generate', 'build', 'all'], default='all',
@@ -337,6 +347,10 @@ class CmdArguments(object):
             parser.add_argument(
                 '--color', dest='color', choices=['yes', 'no', 'auto'], default='auto',
                 help='Output color mode selection')
+            parser.add_argument(
+                '--load-jobs', dest='load_jobs', type=int, default=1,
+                help=('Specifies the number of processes to load BUILD files '
+                      'of path/... targets simultaneously'))
             parser.add_argument(
                 '--load-local-config', dest='load_local_config',
                 default=True, action='store_true',
@@ -16,8 +16,6 @@ import sys
 import console
 import build_attributes
 from blade_util import var_to_list
-from cc_targets import HEAP_CHECK_VALUES
-from proto_library_target import ProtocPlugin
 
 
 _config_globals = {}
@@ -33,6 +31,7 @@ class BladeConfig(object):
     """BladeConfig. A configuration parser class. """
     def __init__(self):
         self.current_file_name = ''
+        self.loaded_files = []
         self.configs = {
             'global_config' : {
                 'build_path_template': 'build${bits}_${profile}',
@@ -40,6 +39,21 @@ class BladeConfig(object):
                 'test_timeout': None,
                 'native_builder': 'scons',
                 'debug_info_level': 'mid',
+                # Dirs whose name or path matches these patterns are not
+                # searched for BUILD files by path/... targets
+                'load_excludes': ['.*', 'build32_debug*', 'build32_release*',
+                                  'build64_debug*', 'build64_release*'],
+                # Run toolchain actions of ninja in a long-lived server
+                'toolchain_server': True,
+                # How to detect changes of the files related to tests in
+                # incremental test, can be 'content' or 'mtime'
+                'test_related_digest': 'content',
+                # Depths of ninja pools of the memory heavy actions, 0 means
+                # derived from the physical memory and cpu cores
+                'link_jobs': 0,
+                'java_jobs': 0,
+                'package_jobs': 0,
+                'heavy_gen_rule_jobs': 0,
             },
 
             'cc_test_config': {
@@ -50,6 +64,7 @@ class BladeConfig(object):
                 'gtest_libs': [],
                 'gtest_main_libs': [],
                 'pprof_path': '',
+                'auto_shard_time': 0,
             },
 
             'cc_binary_config': {
@@ -184,6 +199,8 @@ class BladeConfig(object):
             self.current_file_name = filename
             if os.path.exists(filename):
                 execfile(filename, _config_globals, None)
+                if filename not in self.loaded_files:
+                    self.loaded_files.append(filename)
         except SystemExit:
             console.error_exit('Parse error in config file %s' % filename)
         finally:
@@ -255,6 +272,11 @@ def get_section(section_name):
     return _blade_config.get_section(section_name)
 
 
+def get_loaded_files():
+    """Return the config files which have been loaded. """
+    return _blade_config.loaded_files
+
+
 def get_item(section_name, item_name):
     return _blade_config.get_section(section_name)[item_name]
 
@@ -277,6 +299,7 @@ def config_items(**kwargs):
 @config_rule
 def cc_test_config(append=None, **kwargs):
     """cc_test_config section. """
+    from cc_targets import HEAP_CHECK_VALUES
     heap_check = kwargs.get('heap_check')
     if heap_check is not None and heap_check not in HEAP_CHECK_VALUES:
         console.error_exit('cc_test_config: heap_check can only be in %s' %
@@ -297,12 +320,14 @@ def cc_library_config(append=None, **kwargs):
 
 
 __DUPLICATED_SOURCE_ACTION_VALUES = set(['warning', 'error', 'none', None])
+__TEST_RELATED_DIGEST_VALUES = set(['content', 'mtime'])
 
 
 @config_rule
 def global_config(append=None, **kwargs):
     """global_config section. """
     _check_kwarg_enum_value(kwargs, 'duplicated_source_action', __DUPLICATED_SOURCE_ACTION_VALUES)
+    _check_kwarg_enum_value(kwargs, 'test_related_digest', __TEST_RELATED_DIGEST_VALUES)
     debug_info_levels = _blade_config.get_section('cc_config')['debug_info_levels'].keys()
     _check_kwarg_enum_value(kwargs, 'debug_info_level', debug_info_levels)
     _blade_config.update_config('global_config', append, kwargs)
@@ -376,6 +401,7 @@ def proto_library_config(append=None, **kwargs):
 @config_rule
 def protoc_plugin(**kwargs):
     """protoc_plugin. """
+    from proto_library_target import ProtocPlugin
     if 'name' not in kwargs:
         console.error_exit("Missing 'name' in protoc_plugin parameters: %s" % kwargs)
     section = _blade_config.get_section('protoc_plugin_config')
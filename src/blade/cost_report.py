@@ -0,0 +1,167 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+
+"""
+ This module reports the building costs of targets from the .ninja_log,
+ aggregated per target and per directory, and the critical path through
+ the target graph.
+
+"""
+
+
+import os
+
+import console
+
+
+_COMPILE_RULES = frozenset(['cc', 'cxx', 'securecccompile', 'securecc',
+                            'javac', 'scalac', 'gopackage'])
+_LINK_RULES = frozenset(['ar', 'link', 'solink', 'javajar', 'fatjar', 'onejar',
+                         'javabinary', 'pythonbinary', 'gocommand'])
+
+
+def parse_ninja_log(path):
+    """Parse the ninja log, return a dict of output -> (start, end, cmdhash).
+
+    Times are in milliseconds. Only the latest record of each output is kept.
+
+    """
+    records = {}
+    with open(path) as f:
+        header = f.readline()
+        if not header.startswith('# ninja log v'):
+            console.warning('%s: unknown ninja log format' % path)
+            return records
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 5:
+                continue
+            start, end, mtime, output, cmdhash = fields
+            records[output] = (int(start), int(end), cmdhash)
+    return records
+
+
+def _rule_kind(rule):
+    if rule in _COMPILE_RULES:
+        return 'compile'
+    if rule in _LINK_RULES:
+        return 'link'
+    return 'other'
+
+
+def _target_costs(records, output_rules):
+    """Aggregate costs of actions into targets.
+
+    An action with multiple outputs is logged once for each output, so the
+    actions are identified by their times and command hash.
+
+    """
+    costs = {}  # key -> {'compile': ms, 'link': ms, 'other': ms, 'actions': n}
+    unknown = 0
+    counted = set()
+    for output, (start, end, cmdhash) in records.iteritems():
+        if output not in output_rules:
+            unknown += end - start
+            continue
+        key, rule = output_rules[output]
+        action = (key, start, end, cmdhash)
+        if action in counted:
+            continue
+        counted.add(action)
+        cost = costs.setdefault(key, {'compile': 0, 'link': 0, 'other': 0,
+                                      'actions': 0})
+        cost[_rule_kind(rule)] += end - start
+        cost['actions'] += 1
+    for cost in costs.itervalues():
+        cost['total'] = cost['compile'] + cost['link'] + cost['other']
+    return costs, unknown
+
+
+def _critical_path(targets, costs):
+    """Return the critical path, the most costly chain of dependencies. """
+    # key -> (cost of the path ends at key, previous key on the path)
+    paths = {}
+    for key in targets:
+        if key in paths:
+            continue
+        stack = [key]
+        while stack:
+            k = stack[-1]
+            deps = [d for d in targets[k].deps if d in targets and d not in paths]
+            if deps:
+                stack += deps
+                continue
+            stack.pop()
+            if k in paths:
+                continue
+            best = None
+            for dep in targets[k].deps:
+                if dep in paths and (best is None or paths[dep][0] > paths[best][0]):
+                    best = dep
+            cost = costs.get(k, {}).get('total', 0)
+            paths[k] = (cost + (paths[best][0] if best else 0), best)
+    if not paths:
+        return 0, []
+    key = max(paths, key=lambda k: paths[k][0])
+    total = paths[key][0]
+    path = []
+    while key:
+        path.append(key)
+        key = paths[key][1]
+    path.reverse()
+    return total, path
+
+
+def _seconds(ms):
+    return '%.2fs' % (ms / 1000.0)
+
+
+def report_costs(ninja_log, targets, output_rules, top=20):
+    """Report building costs.
+
+    Parameters
+    -----------
+    ninja_log: path of the .ninja_log
+    targets: the dict of build targets
+    output_rules: dict of output -> (target key, ninja rule)
+
+    """
+    if not os.path.exists(ninja_log):
+        console.warning('%s does not exist, no costs to report' % ninja_log)
+        return
+    records = parse_ninja_log(ninja_log)
+    costs, unknown = _target_costs(records, output_rules)
+
+    console.info('{0} Building Costs {0}'.format('=' * 13))
+    console.info('%d targets, %s in total, %s of actions not belonging to '
+                 'any target' % (
+                 len(costs), _seconds(sum(c['total'] for c in costs.itervalues())),
+                 _seconds(unknown)))
+
+    console.info('Top %d targets:' % top)
+    console.info('%10s %10s %10s %10s %8s  %s' % (
+                 'total', 'compile', 'link', 'other', 'actions', 'target'),
+                 prefix=False)
+    keys = sorted(costs, key=lambda k: costs[k]['total'], reverse=True)
+    for key in keys[:top]:
+        cost = costs[key]
+        console.info('%10s %10s %10s %10s %8d  %s' % (
+                     _seconds(cost['total']), _seconds(cost['compile']),
+                     _seconds(cost['link']), _seconds(cost['other']),
+                     cost['actions'], targets[key].fullname), prefix=False)
+
+    dir_costs = {}
+    for key, cost in costs.iteritems():
+        dir_costs[key[0]] = dir_costs.get(key[0], 0) + cost['total']
+    console.info('Top %d directories:' % top)
+    for path in sorted(dir_costs, key=dir_costs.get, reverse=True)[:top]:
+        console.info('%10s  %s' % (_seconds(dir_costs[path]), path), prefix=False)
+
+    total, path = _critical_path(targets, costs)
+    # Targets without actions, such as system libraries, are omitted
+    path = [key for key in path if key in costs]
+    console.info('Critical path, %s in %d targets:' % (_seconds(total), len(path)))
+    for key in path:
+        console.info('%10s  %s' % (_seconds(costs.get(key, {}).get('total', 0)),
+                                   targets[key].fullname), prefix=False)
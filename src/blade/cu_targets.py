@@ -307,6 +307,8 @@ class CuTest(CuBinary):
                  testdata,
                  always_run,
                  exclusive,
+                 cpu,
+                 memory,
                  blade,
                  kwargs):
         CuBinary.__init__(self,
@@ -324,6 +326,7 @@ class CuTest(CuBinary):
         self.data['testdata'] = var_to_list(testdata)
         self.data['always_run'] = always_run
         self.data['exclusive'] = exclusive
+        self._init_test_resources(cpu, memory)
 
         cc_test_config = config.get_section('cc_test_config')
         gtest_lib = var_to_list(cc_test_config['gtest_libs'])
@@ -345,6 +348,8 @@ def cu_test(name,
             testdata=[],
             always_run=False,
             exclusive=False,
+            cpu=1,
+            memory=0,
             **kwargs):
     target = CuTest(name,
                     srcs,
@@ -357,6 +362,8 @@ def cu_test(name,
                     testdata,
                     always_run,
                     exclusive,
+                    cpu,
+                    memory,
                     blade.blade,
                     kwargs)
     blade.blade.register_target(target)
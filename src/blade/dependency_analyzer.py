@@ -15,6 +15,8 @@
 
 """
 
+import cPickle
+import os
 from collections import deque
 
 import console
@@ -32,7 +34,7 @@ and then provide the query interface to users by blade manager.
 """
 
 
-def analyze_deps(related_targets):
+def analyze_deps(related_targets, cache_path=None):
     """analyze the dependency relationship between targets.
 
     Input: related targets after loading targets from BUILD files.
@@ -46,22 +48,109 @@ def analyze_deps(related_targets):
         3. the targets successors dict which is the transpose of #1
             {(target_path, target_name) : [the depended target keys]}
 
+    If cache_path is given, the result of last analyzing is loaded from it
+    and only the targets whose dependencies may be changed are expanded
+    again, then the new result is saved into it.
+
+    """
+    cache = _DepsCache(cache_path)
+    fingerprints = _deps_fingerprints(related_targets)
+    deps_map_cache = cache.reusable_deps(fingerprints)
+    _expand_deps(related_targets, deps_map_cache)
+    if cache.unchanged:
+        return cache.sorted_keys, cache.successors
+    sorted_keys, successors = _topological_sort(related_targets)
+    cache.save(fingerprints, deps_map_cache, sorted_keys, successors)
+    return sorted_keys, successors
+
+
+def _deps_fingerprints(targets):
+    """Return the fingerprints of dependency definitions of targets.
+
+    Must be called before the deps are expanded, so the expanded_deps
+    is just the direct deps.
+
     """
-    _expand_deps(related_targets)
-    return _topological_sort(related_targets)
+    fingerprints = {}
+    for target_id, target in targets.iteritems():
+        fingerprints[target_id] = (tuple(target.expanded_deps),
+                                   repr(getattr(target, 'visibility', 'PUBLIC')))
+    return fingerprints
 
 
-def _expand_deps(targets):
+class _DepsCache(object):
+    """The persistent result of last dependency analyzing.
+
+    The expanded deps of a target can be reused if neither it nor any
+    target it depends on is changed. The successors map is the transpose
+    of expanded deps, so the targets affected by a changed target are
+    exactly its successors in last analyzing.
+
+    """
+    _VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+        self.expanded_deps = {}
+        self.sorted_keys = []
+        self.successors = {}
+        self.unchanged = False
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    version, data = cPickle.load(f)
+                if version == self._VERSION:
+                    (self.fingerprints, self.expanded_deps,
+                     self.sorted_keys, self.successors) = data
+            except Exception:
+                console.warning('Failed to load dependency cache %s, ignored' % path)
+
+    def reusable_deps(self, fingerprints):
+        """Return the cached expanded deps of targets which are not affected. """
+        changed = set([key for key in fingerprints
+                       if self.fingerprints.get(key) != fingerprints[key]])
+        # Removed targets also affect their dependers
+        changed.update([key for key in self.fingerprints if key not in fingerprints])
+        self.unchanged = bool(self.fingerprints) and not changed
+
+        dirty = set(changed)
+        for key in changed:
+            dirty.update(self.successors.get(key, []))
+        deps_map_cache = {}
+        for key in fingerprints:
+            if key not in dirty:
+                deps_map_cache[key] = self.expanded_deps[key]
+        if deps_map_cache:
+            console.info('reused expanded deps of %d targets, %d to be expanded' % (
+                         len(deps_map_cache), len(fingerprints) - len(deps_map_cache)))
+        return deps_map_cache
+
+    def save(self, fingerprints, expanded_deps, sorted_keys, successors):
+        """Save the result of analyzing. """
+        if not self.path or not os.path.isdir(os.path.dirname(self.path)):
+            return
+        data = (fingerprints, expanded_deps, sorted_keys, successors)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((self._VERSION, data), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+
+def _expand_deps(targets, deps_map_cache=None):
     """_expand_deps.
 
     Find out all the targets that certain target depeneds on them.
     Fill the related options according to different targets.
 
     """
-    deps_map_cache = {}  # Cache expanded target deps to avoid redundant expand
+    if deps_map_cache is None:
+        # Cache expanded target deps to avoid redundant expand
+        deps_map_cache = {}
+    closure = _DepsClosure(targets, deps_map_cache)
     for target_id in targets:
         target = targets[target_id]
-        target.expanded_deps = _find_all_deps(target_id, targets, deps_map_cache)
+        target.expanded_deps = closure.find_all_deps(target_id)
         target._expand_deps_generation()
 
 
@@ -70,7 +159,7 @@ def _check_dep_visibility(target, dep, targets):
     if dep not in targets:
         console.error_exit('Target %s:%s depends on %s:%s, '
                            'but it is missing, exit...' % (
-                           target_id[0], target_id[1], dep[0], dep[1]))
+                           target[0], target[1], dep[0], dep[1]))
     # Targets are visible inside the same BUILD file by default
     if target[0] == dep[0]:
         return
@@ -85,51 +174,106 @@ def _check_dep_visibility(target, dep, targets):
                            target[0], target[1], d.fullname))
 
 
-def _unique_deps(new_deps_list):
-   # Append new_deps_piece to new_deps_list, be aware of de-duplication
-   result = []
-   deps = set()
-   for dep in reversed(new_deps_list):
-       if dep not in deps:
-           result.append(dep)
-           deps.add(dep)
-   return list(reversed(result))
+class _DepsClosure(object):
+    """Compute all targets depended by a target directly and/or indirectly.
 
+    The closure of a target is the concatenation of each direct dep
+    followed by its closure, with duplications removed by keeping the last
+    occurrence, so a library always appears after all libraries depending
+    on it, which is the order required by static linking.
 
-def _find_all_deps(target_id, targets, deps_map_cache, root_targets=None):
-    """_find_all_deps.
-
-    Return all targets depended by target_id directly and/or indirectly.
-    We need the parameter root_target_id to check loopy dependency.
+    Target keys are interned as integer ids, which are much cheaper to hash
+    than key tuples. The concatenation is never built, the closures of
+    direct deps are merged in reverse order instead, and a dep already
+    merged is skipped as a whole because its closure must have been merged
+    together with it.
 
     """
-    new_deps_list = deps_map_cache.get(target_id)
-    if new_deps_list is not None:
-        return new_deps_list
-
-    if root_targets is None:
-        root_targets = set()
-
-    root_targets.add(target_id)
-    new_deps_list = []
-
-    for d in targets[target_id].expanded_deps:
-        # loop dependency
-        if d in root_targets:
-            err_msg = ''
-            for t in root_targets:
-                err_msg += '//%s:%s --> ' % (t[0], t[1])
-            console.error_exit('loop dependency found: //%s:%s --> [%s]' % (
-                       d[0], d[1], err_msg))
-        _check_dep_visibility(target_id, d, targets)
-        new_deps_list.append(d)
-        new_deps_list += _find_all_deps(d, targets, deps_map_cache, root_targets)
-
-    new_deps_list = _unique_deps(new_deps_list)
-    deps_map_cache[target_id] = new_deps_list
-    root_targets.remove(target_id)
-
-    return new_deps_list
+
+    def __init__(self, targets, deps_map_cache):
+        self.targets = targets
+        self.deps_map_cache = deps_map_cache
+        self.keys = list(targets)
+        self.ids = dict((key, i) for i, key in enumerate(self.keys))
+        count = len(self.keys)
+        self.direct_deps = [None] * count
+        self.closures = [None] * count
+        self.visiting = bytearray(count)
+
+    def find_all_deps(self, target_id):
+        """Return the expanded deps list of the target. """
+        result = self.deps_map_cache.get(target_id)
+        if result is None:
+            i = self.ids[target_id]
+            self._expand(i)
+            result = map(self.keys.__getitem__, self.closures[i])
+            self.deps_map_cache[target_id] = result
+        return result
+
+    def _is_expanded(self, i):
+        if self.closures[i] is not None:
+            return True
+        # Reuse the expanded deps given by the caller
+        cached = self.deps_map_cache.get(self.keys[i])
+        if cached is not None:
+            self.closures[i] = map(self.ids.__getitem__, cached)
+            return True
+        return False
+
+    def _direct_deps(self, i):
+        target_id = self.keys[i]
+        deps = []
+        for dkey in self.targets[target_id].expanded_deps:
+            _check_dep_visibility(target_id, dkey, self.targets)
+            deps.append(self.ids[dkey])
+        self.direct_deps[i] = deps
+        return deps
+
+    def _report_loop(self, stack, d):
+        err_msg = ''
+        for i, _ in stack:
+            err_msg += '//%s:%s --> ' % self.keys[i]
+        console.error_exit('loop dependency found: //%s:%s --> [%s]' % (
+                           self.keys[d] + (err_msg,)))
+
+    def _expand(self, root):
+        """Expand the closures of root and its deps in post order. """
+        if self._is_expanded(root):
+            return
+        # Iterative depth first search to avoid recursion limit on deep graphs
+        self.visiting[root] = 1
+        stack = [(root, iter(self._direct_deps(root)))]
+        while stack:
+            i, deps = stack[-1]
+            for d in deps:
+                if self._is_expanded(d):
+                    continue
+                if self.visiting[d]:
+                    self._report_loop(stack, d)
+                self.visiting[d] = 1
+                stack.append((d, iter(self._direct_deps(d))))
+                break
+            else:
+                stack.pop()
+                self.visiting[i] = 0
+                self._merge(i)
+
+    def _merge(self, i):
+        """Merge closures of direct deps into the closure of target i. """
+        closures = self.closures
+        merged = set()
+        result = []
+        for d in reversed(self.direct_deps[i]):
+            if d in merged:
+                continue
+            new_deps = [x for x in reversed(closures[d]) if x not in merged]
+            merged.update(new_deps)
+            merged.add(d)
+            result += new_deps
+            result.append(d)
+        result.reverse()
+        closures[i] = result
+        self.direct_deps[i] = None
 
 
 def _topological_sort(pairlist):
@@ -67,11 +67,13 @@ def generate_fat_jar(target, jars):
 
     for dep_jar in jars:
         jar = zipfile.ZipFile(dep_jar, 'r')
-        name_list = jar.namelist()
-        for name in name_list:
+        for info in jar.infolist():
+            name = info.filename
             if name.endswith('/') or not _is_fat_jar_excluded(name):
                 if name not in path_jar_dict:
-                    target_fat_jar.writestr(name, jar.read(name))
+                    # Copy the compressed data directly, which is much
+                    # faster than decompressing and recompressing it
+                    blade_util.zip_copy_member(jar, info, target_fat_jar)
                     path_jar_dict[name] = os.path.basename(dep_jar)
                 else:
                     if name.endswith('/'):
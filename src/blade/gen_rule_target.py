@@ -14,6 +14,7 @@
 
 import os
 
+import action_cache
 import blade
 import build_rules
 import console
@@ -34,6 +35,8 @@ class GenRuleTarget(Target):
                  deps,
                  outs,
                  cmd,
+                 heavy,
+                 cacheable,
                  blade,
                  kwargs):
         """Init method.
@@ -55,6 +58,8 @@ class GenRuleTarget(Target):
                         kwargs)
 
         self.data['outs'] = outs
+        self.data['heavy'] = heavy
+        self.data['cacheable'] = cacheable
         self.data['locations'] = []
         self.data['cmd'] = location_re.sub(self._process_location_reference, cmd)
 
@@ -182,19 +187,32 @@ class GenRuleTarget(Target):
         cmd = self.ninja_command()
         description = '%sCOMMAND //%s%s' % (
                       console.colors('dimpurple'), self.fullname, console.colors('end'))
+        command = '%s && cd %s && ls ${out} > /dev/null' % (cmd, self.blade.get_root_dir())
+        # The command may read files not declared, so only cache it on demand
+        cached = (self.data['cacheable'] and
+                  bool(self.blade.build_environment.action_cache_dir))
+        if cached:
+            command = action_cache.wrap_command(command)
+        pool = ''
+        if self.data['heavy']:
+            # Memory heavy commands are limited by the pool defined in build.ninja
+            pool = '  pool = heavy_gen_rule_pool\n'
         self._write_rule('''rule %s
-  command = %s && cd %s && ls ${out} > /dev/null
+  command = %s
   description = %s
-''' % (rule, cmd, self.blade.get_root_dir(), description))
+%s''' % (rule, command, description, pool))
         outputs = [self._target_file_path(o) for o in self.data['outs']]
         inputs = [self._source_file_path(s) for s in self.srcs]
+        implicit_deps = self.implicit_dependencies()
         vars = {}
         if '${_in_1}' in cmd:
             vars['_in_1'] = inputs[0]
         if '${_out_1}' in cmd:
             vars['_out_1'] = outputs[0]
+        if cached and implicit_deps:
+            vars['implicit_ins'] = ' '.join(implicit_deps)
         self.ninja_build(outputs, rule, inputs=inputs,
-                         implicit_deps=self.implicit_dependencies(),
+                         implicit_deps=implicit_deps,
                          variables=vars)
         for i, out in enumerate(outputs):
             self._add_target_file(str(i), out)
@@ -206,6 +224,8 @@ def gen_rule(name,
              deps=[],
              outs=[],
              cmd='',
+             heavy=False,
+             cacheable=False,
              **kwargs):
     """scons_gen_rule. """
     gen_rule_target = GenRuleTarget(name,
@@ -213,6 +233,8 @@ def gen_rule(name,
                                     deps,
                                     outs,
                                     cmd,
+                                    heavy,
+                                    cacheable,
                                     blade.blade,
                                     kwargs)
     blade.blade.register_target(gen_rule_target)
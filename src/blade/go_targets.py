@@ -9,7 +9,6 @@ Implement go_library, go_binary and go_test
 """
 
 import os
-import subprocess
 import re
 
 import blade
@@ -50,7 +49,6 @@ class GoTarget(Target):
                         kwargs)
 
         self._set_go_package()
-        self._init_go_environment()
 
     def _set_go_package(self):
         """
@@ -70,20 +68,12 @@ class GoTarget(Target):
     def _init_go_environment(self):
         if GoTarget._go_os is None and GoTarget._go_arch is None:
             go = config.get_item('go_config', 'go')
-            p = subprocess.Popen('%s env' % go,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 shell=True,
-                                 universal_newlines=True)
-            stdout, stderr = p.communicate()
-            if p.returncode:
-                console.error_exit('%s: Failed to initialize go environment: %s' %
-                                   (self.fullname, stderr))
-            for line in stdout.splitlines():
-                if line.startswith('GOOS='):
-                    GoTarget._go_os = line.replace('GOOS=', '').strip('"')
-                elif line.startswith('GOARCH='):
-                    GoTarget._go_arch = line.replace('GOARCH=', '').strip('"')
+            go_env = self.blade.get_scons_platform().get_go_env(go)
+            if go_env is None:
+                console.error_exit('%s: Failed to initialize go environment' %
+                                   self.fullname)
+            GoTarget._go_os = go_env.get('GOOS')
+            GoTarget._go_arch = go_env.get('GOARCH')
 
     def _prepare_to_generate_rule(self):
         self._clone_env()
@@ -144,6 +134,7 @@ class GoLibrary(GoTarget):
 
     def _target_file_path(self):
         """Return package object path according to the standard go directory layout. """
+        self._init_go_environment()
         go_home = config.get_item('go_config', 'go_home')
         return os.path.join(go_home, 'pkg',
                             '%s_%s' % (GoTarget._go_os, GoTarget._go_arch),
@@ -182,10 +173,11 @@ class GoBinary(GoTarget):
 
 class GoTest(GoTarget):
     """GoTest generates build rules for a go test binary. """
-    def __init__(self, name, srcs, deps, testdata, kwargs):
+    def __init__(self, name, srcs, deps, testdata, cpu, memory, kwargs):
         GoTarget.__init__(self, name, 'go_test', srcs, deps, kwargs)
         self.data['go_rule'] = 'gotest'
         self.data['testdata'] = var_to_list(testdata)
+        self._init_test_resources(cpu, memory)
 
     def scons_rules(self):
         self._prepare_to_generate_rule()
@@ -222,11 +214,15 @@ def go_test(name,
             srcs,
             deps=[],
             testdata=[],
+            cpu=1,
+            memory=0,
             **kwargs):
     blade.blade.register_target(GoTest(name,
                                        srcs,
                                        deps,
                                        testdata,
+                                       cpu,
+                                       memory,
                                        kwargs))
 
 
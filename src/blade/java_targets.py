@@ -898,6 +898,9 @@ class JavaBinary(JavaTarget):
         inputs += dep_jars + maven_jars
         output = self._target_file_path() + '.one.jar'
         vars = { 'mainclass' : self.data['main_class'] }
+        if self.blade.build_environment.action_cache_dir:
+            # The boot jar is in the command only, hash it in the cache key
+            vars['implicit_ins'] = config.get_item('java_binary_config', 'one_jar_boot_jar')
         self.ninja_build(output, 'onejar', inputs=inputs, variables=vars)
         self._add_target_file('onejar', output)
         return output
@@ -938,11 +941,12 @@ class JavaTest(JavaBinary):
     """JavaTest"""
     def __init__(self, name, srcs, deps, resources, source_encoding,
                  warnings, main_class, exclusions,
-                 testdata, target_under_test, kwargs):
+                 testdata, target_under_test, cpu, memory, kwargs):
         JavaBinary.__init__(self, name, srcs, deps, resources,
                             source_encoding, warnings, main_class, exclusions, kwargs)
         self.type = 'java_test'
         self.data['testdata'] = var_to_list(testdata)
+        self._init_test_resources(cpu, memory)
         if target_under_test:
             self.data['target_under_test'] = self._unify_dep(target_under_test)
 
@@ -1061,6 +1065,8 @@ def java_test(name,
               exclusions=[],
               testdata=[],
               target_under_test='',
+              cpu=1,
+              memory=0,
               **kwargs):
     """Define java_test target. """
     target = JavaTest(name,
@@ -1073,6 +1079,8 @@ def java_test(name,
                       exclusions,
                       testdata,
                       target_under_test,
+                      cpu,
+                      memory,
                       kwargs)
     blade.blade.register_target(target)
 
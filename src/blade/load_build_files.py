@@ -16,35 +16,53 @@
 """
 
 
+import cPickle
+import fnmatch
+import multiprocessing
 import os
+import sys
+import time
 import traceback
 
 import build_rules
 import blade
+import blade_trace
+import config
 import console
 import build_attributes
-from blade_util import var_to_list
+from blade_util import md5sum, md5sum_file, var_to_list
 from pathlib import Path
 
 
-# import these modules make build functions registered into build_rules
+# Build functions are registered as stubs, the target modules are imported
+# on demand when the functions are called in BUILD files
 # TODO(chen3feng): Load build modules dynamically to enable extension.
-import cc_targets
-import cu_targets
-import gen_rule_target
-import go_targets
-import java_jar_target
-import java_targets
-import scala_targets
-import lex_yacc_target
-import package_target
-import proto_library_target
-import py_targets
-import resource_library_target
-import sh_test_target
-import swig_library_target
-import thrift_library
-import fbthrift_library
+_BUILD_FUNCTIONS = [
+    ('cc_targets', ['cc_library', 'cc_binary', 'cc_benchmark', 'cc_plugin', 'cc_test']),
+    ('cu_targets', ['cu_library', 'cu_binary', 'cu_test']),
+    ('gen_rule_target', ['gen_rule']),
+    ('go_targets', ['go_library', 'go_binary', 'go_test', 'go_target']),
+    ('java_jar_target', ['java_jar']),
+    ('java_targets', ['maven_jar', 'java_binary', 'java_library', 'java_test',
+                      'java_fat_library']),
+    ('scala_targets', ['scala_library', 'scala_fat_library', 'scala_test']),
+    ('lex_yacc_target', ['lex_yacc_library']),
+    ('package_target', ['package']),
+    ('proto_library_target', ['proto_library']),
+    ('py_targets', ['py_egg', 'py_library', 'py_binary', 'py_test']),
+    ('resource_library_target', ['resource_library']),
+    ('sh_test_target', ['sh_test']),
+    ('swig_library_target', ['swig_library']),
+    ('thrift_library', ['thrift_library']),
+    ('fbthrift_library', ['fbthrift_library']),
+]
+
+for module_name, function_names in _BUILD_FUNCTIONS:
+    build_rules.register_lazy_functions(module_name, function_names)
+
+
+# The path of blade, may be a dir or the blade.zip
+_BLADE_PATH = os.path.dirname(os.path.abspath(__file__))
 
 
 def _find_dir_depender(dir, blade):
@@ -113,13 +131,20 @@ def glob(srcs, excludes=[]):
                 return True
         return False
 
-    return sorted(set([str(p) for p in includes_iterator() if not exclusion(p)]))
+    result = sorted(set([str(p) for p in includes_iterator() if not exclusion(p)]))
+    if __current_load_deps is not None:
+        __current_load_deps['globs'].append((str(source_dir), srcs, excludes, result))
+    return result
 
 
 # Each include in a BUILD file can only affect itself
 __current_globles = None
 
 
+# Files and glob results the current loading BUILD file depends on
+__current_load_deps = None
+
+
 # Include a defination file in a BUILD file
 def include(name):
     if name.startswith('//'):
@@ -127,7 +152,10 @@ def include(name):
         name = name[2:]
     else:
         dir = blade.blade.get_current_source_path()
-    execfile(os.path.join(dir, name), __current_globles, None)
+    path = os.path.join(dir, name)
+    if __current_load_deps is not None:
+        __current_load_deps['includes'].append((path, md5sum_file(path)))
+    execfile(path, __current_globles, None)
 
 
 build_rules.register_function(enable_if)
@@ -135,6 +163,255 @@ build_rules.register_function(glob)
 build_rules.register_function(include)
 
 
+class LoadCache(object):
+    """Persistent cache of the targets parsed from BUILD files.
+
+    Each entry is keyed by the source dir and records everything the
+    execution of the BUILD file depended on: the content of the BUILD file
+    and the files it included, the listing of the source dir and the results
+    of glob() calls. The registered targets are stored pickled, so a cache
+    hit rehydrates them without executing the BUILD file.
+
+    The whole cache is dropped when blade itself, the config files or the
+    options which affect target creation are changed.
+
+    """
+    _VERSION = 1
+
+    def __init__(self, build_dir, options):
+        self.path = os.path.join(build_dir, '.blade_load_cache')
+        self.context = self._context_digest(options)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.modified = False
+        self._load()
+
+    @staticmethod
+    def _blade_fingerprint():
+        """Fingerprint of blade itself, either the blade.zip or the source dir. """
+        blade_path = _BLADE_PATH
+        if os.path.isfile(blade_path):
+            st = os.stat(blade_path)
+            return '%s %s' % (st.st_mtime, st.st_size)
+        mtimes = [os.path.getmtime(os.path.join(blade_path, f))
+                  for f in os.listdir(blade_path) if f.endswith('.py')]
+        return str(max(mtimes))
+
+    def _context_digest(self, options):
+        context = [str(self._VERSION), self._blade_fingerprint()]
+        for path in config.get_loaded_files():
+            context.append('%s %s' % (path, md5sum_file(path)))
+        for name in sorted(vars(options)):
+            if name in ('m', 'arch', 'profile') or name.startswith('generate_'):
+                context.append('%s=%s' % (name, getattr(options, name)))
+        return md5sum('\n'.join(context))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                context, entries = cPickle.load(f)
+            if context == self.context:
+                self.entries = entries
+        except Exception:
+            console.warning('Failed to load BUILD cache %s, ignored' % self.path)
+
+    def save(self):
+        """Write the cache back to disk if it was modified. """
+        if not self.modified or not os.path.isdir(os.path.dirname(self.path)):
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((self.context, self.entries), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+    @staticmethod
+    def _is_entry_valid(entry, source_dir, build_file):
+        if entry['digest'] != md5sum_file(build_file):
+            return False
+        if entry['listing'] != sorted(os.listdir(source_dir)):
+            return False
+        for path, digest in entry['includes']:
+            if not os.path.isfile(path) or md5sum_file(path) != digest:
+                return False
+        for glob_dir, srcs, excludes, result in entry['globs']:
+            blade.blade.set_current_source_path(glob_dir)
+            if glob(srcs, excludes) != result:
+                return False
+        return True
+
+    def lookup(self, source_dir, build_file):
+        """Return pickled targets of the BUILD file if the entry is still valid. """
+        entry = self.entries.get(source_dir)
+        if entry is not None and self._is_entry_valid(entry, source_dir, build_file):
+            self.hits += 1
+            return entry['targets']
+        self.misses += 1
+        return None
+
+    def store(self, source_dir, build_file, load_deps, pickled_targets):
+        """Store the pickled targets registered by executing the BUILD file. """
+        if pickled_targets is None:
+            self.entries.pop(source_dir, None)
+            return
+        self.entries[source_dir] = {
+            'digest': md5sum_file(build_file),
+            'listing': sorted(os.listdir(source_dir)),
+            'includes': load_deps['includes'],
+            'globs': load_deps['globs'],
+            'targets': pickled_targets,
+        }
+        self.modified = True
+
+
+def _pickle_targets(build_file, targets):
+    """Pickle targets registered by the BUILD file, return None if failed.
+
+    System libraries are excluded, they are registered again when the
+    targets depending on them are rehydrated.
+
+    """
+    targets = [t for t in targets if t.type != 'system_library']
+    try:
+        return cPickle.dumps(targets, cPickle.HIGHEST_PROTOCOL)
+    except (cPickle.PicklingError, TypeError), e:
+        console.warning('%s: can not be cached: %s' % (build_file, e))
+        return None
+
+
+def _register_pickled_targets(pickled_targets, blade):
+    """Rehydrate the pickled targets and register them into blade. """
+    for target in cPickle.loads(pickled_targets):
+        target._rehydrate(blade)
+        blade.register_target(target)
+
+
+# The load cache used by current loading
+_load_cache = None
+
+
+def _load_build_file_from_cache(source_dir, build_file, blade):
+    """Register the targets of the BUILD file from cache, return whether hit. """
+    if _load_cache is None:
+        return False
+    targets = _load_cache.lookup(source_dir, build_file)
+    blade.set_current_source_path(source_dir)
+    if targets is None:
+        return False
+    _register_pickled_targets(targets, blade)
+    return True
+
+
+def _execute_build_file(source_dir, build_file, blade):
+    """Execute the BUILD file.
+
+    Returns the targets registered by it and the files and glob results
+    the execution depends on.
+
+    """
+    global __current_load_deps
+    target_database = blade.get_target_database()
+    existed_keys = set(target_database)
+    __current_load_deps = {'includes': [], 'globs': []}
+    try:
+        # The magic here is that a BUILD file is a Python script,
+        # which can be loaded and executed by execfile().
+        global __current_globles
+        __current_globles = build_rules.get_all()
+        execfile(build_file, __current_globles, None)
+    except SystemExit:
+        console.error_exit('%s: fatal error' % build_file)
+    except:
+        console.error_exit('Parse error in %s\n%s' % (
+                build_file, traceback.format_exc()))
+    finally:
+        load_deps, __current_load_deps = __current_load_deps, None
+        blade.set_current_source_path(source_dir)
+
+    targets = [target_database[key] for key in target_database
+               if key not in existed_keys]
+    return targets, load_deps
+
+
+def _execute_and_cache_build_file(source_dir, build_file, blade):
+    """Execute the BUILD file and put the targets into cache. """
+    targets, load_deps = _execute_build_file(source_dir, build_file, blade)
+    if _load_cache is not None:
+        _load_cache.store(source_dir, build_file, load_deps,
+                          _pickle_targets(build_file, targets))
+
+
+def _init_load_worker():
+    """Initialize the worker process to load BUILD files. """
+    # Duplicated source files are checked in the main process when the
+    # targets are registered
+    config.get_section('global_config')['duplicated_source_action'] = 'none'
+
+
+def _load_build_file_in_worker(source_dir):
+    """Execute the BUILD file in a worker process.
+
+    Returns the pickled targets and the load deps, or None on error, which
+    has already been reported by the worker.
+
+    """
+    build_file = os.path.join(source_dir, 'BUILD')
+    blade.blade.set_current_source_path(source_dir)
+    try:
+        targets, load_deps = _execute_build_file(source_dir, build_file, blade.blade)
+        return _pickle_targets(build_file, targets), load_deps
+    except SystemExit:
+        return None
+
+
+def _load_build_files_in_parallel(source_dirs, processed_source_dirs, blade, jobs):
+    """Load BUILD files of source_dirs by a pool of worker processes.
+
+    BUILD files are executed in the forked workers, and the targets are sent
+    back pickled and then registered in order, just like loading them from
+    the cache. Dirs without BUILD files are left to be reported by
+    _load_build_file later.
+
+    """
+    pending_dirs = []
+    for source_dir in source_dirs:
+        source_dir = os.path.normpath(source_dir)
+        build_file = os.path.join(source_dir, 'BUILD')
+        if source_dir in processed_source_dirs or not os.path.isfile(build_file):
+            continue
+        processed_source_dirs.add(source_dir)
+        if not _load_build_file_from_cache(source_dir, build_file, blade):
+            pending_dirs.append(source_dir)
+    if not pending_dirs:
+        return
+
+    jobs = min(jobs, len(pending_dirs))
+    pool = multiprocessing.Pool(jobs, _init_load_worker)
+    try:
+        chunksize = max(len(pending_dirs) // (jobs * 8), 1)
+        results = pool.imap(_load_build_file_in_worker, pending_dirs, chunksize)
+        for source_dir, result in zip(pending_dirs, results):
+            if result is None:
+                sys.exit(1)
+            build_file = os.path.join(source_dir, 'BUILD')
+            pickled_targets, load_deps = result
+            blade.set_current_source_path(source_dir)
+            # BUILD files executed in workers are traced by registering
+            with blade_trace.span(build_file, 'load', {'worker': True}):
+                if pickled_targets is None:
+                    _execute_and_cache_build_file(source_dir, build_file, blade)
+                    continue
+                _register_pickled_targets(pickled_targets, blade)
+                if _load_cache is not None:
+                    _load_cache.store(source_dir, build_file, load_deps, pickled_targets)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 def _load_build_file(source_dir, processed_source_dirs, blade):
     """Load the BUILD and place the targets into database.
 
@@ -160,17 +437,9 @@ def _load_build_file(source_dir, processed_source_dirs, blade):
     blade.set_current_source_path(source_dir)
     build_file = os.path.join(source_dir, 'BUILD')
     if os.path.exists(build_file) and not os.path.isdir(build_file):
-        try:
-            # The magic here is that a BUILD file is a Python script,
-            # which can be loaded and executed by execfile().
-            global __current_globles
-            __current_globles = build_rules.get_all()
-            execfile(build_file, __current_globles, None)
-        except SystemExit:
-            console.error_exit('%s: fatal error' % build_file)
-        except:
-            console.error_exit('Parse error in %s\n%s' % (
-                    build_file, traceback.format_exc()))
+        with blade_trace.span(build_file, 'load'):
+            if not _load_build_file_from_cache(source_dir, build_file, blade):
+                _execute_and_cache_build_file(source_dir, build_file, blade)
     else:
         _report_not_exist(source_dir, build_file, blade)
 
@@ -187,24 +456,96 @@ def _find_depender(dkey, blade):
     return None
 
 
-def _is_load_excluded(d):
+def _is_load_excluded(path):
     """Whether exclude the directory when loading BUILD.
 
-        1. Exclude build directory and directories starting with
-           '.', e.g. .svn.
-        2. TODO(wentingli): Exclude directories matching patterns
-           configured globally
+    Exclude directories whose name or path relative to the workspace root
+    matches any pattern of global_config.load_excludes, which excludes
+    build directories and directories starting with '.', e.g. .svn, by
+    default.
+
     """
-    if d.startswith('.'):
-        return True
-    for build_path in ('build32_debug', 'build32_release',
-                       'build64_debug', 'build64_release'):
-        if d.startswith(build_path):
+    name = os.path.basename(path)
+    for pattern in config.get_item('global_config', 'load_excludes'):
+        if fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(path, pattern):
             return True
-
     return False
 
 
+class BuildDirIndex(object):
+    """Persistent index of directories for expanding path/... targets.
+
+    Each directory is recorded with its mtime, whether it contains a BUILD
+    file and its subdirectories not excluded. Adding or removing entries of
+    a directory changes its mtime, so a directory is listed again only when
+    its mtime changes, other directories cost just one stat.
+
+    """
+    _VERSION = 1
+
+    def __init__(self, build_dir):
+        self.path = os.path.join(build_dir, '.blade_dir_index')
+        self.context = (self._VERSION,
+                        config.get_item('global_config', 'load_excludes'))
+        self.dirs = {}  # dir -> (mtime, has_build, subdirs)
+        self.modified = False
+        self.start_time = time.time()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    context, dirs = cPickle.load(f)
+                if context == self.context:
+                    self.dirs = dirs
+            except Exception:
+                console.warning('Failed to load dir index %s, ignored' % self.path)
+
+    def _scan(self, path, mtime):
+        has_build = False
+        subdirs = []
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            if not os.path.isdir(full_path):
+                if name == 'BUILD':
+                    has_build = True
+            elif (not os.path.islink(full_path) and
+                  not _is_load_excluded(os.path.normpath(full_path))):
+                subdirs.append(name)
+        entry = (mtime, has_build, subdirs)
+        # Changes in the same time slot of mtime can not be detected
+        if mtime < self.start_time - 1:
+            self.dirs[path] = entry
+            self.modified = True
+        return entry
+
+    def find_build_dirs(self, top):
+        """Return the dirs containing BUILD file under top in os.walk order. """
+        result = []
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            key = os.path.normpath(path)
+            entry = self.dirs.get(key)
+            if entry is None or entry[0] != mtime:
+                entry = self._scan(key, mtime)
+            if entry[1]:
+                result.append(path)
+            stack += [os.path.join(path, d) for d in reversed(entry[2])]
+        return result
+
+    def save(self):
+        """Write the index back to disk if it was modified. """
+        if not self.modified or not os.path.isdir(os.path.dirname(self.path)):
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((self.context, self.dirs), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+
 def load_targets(target_ids, blade_root_dir, blade):
     """load_targets.
 
@@ -215,6 +556,8 @@ def load_targets(target_ids, blade_root_dir, blade):
     """
     build_rules.register_variable('build_target', build_attributes.attributes)
     target_database = blade.get_target_database()
+    global _load_cache
+    _load_cache = LoadCache(blade.get_build_path(), blade.get_options())
 
     # targets specified in command line
     cited_targets = set()
@@ -227,6 +570,7 @@ def load_targets(target_ids, blade_root_dir, blade):
 
     direct_targets = []
     all_command_targets = []
+    dir_index = None
     # Parse command line target_ids.  For those in the form of <path>:<target>,
     # record (<path>,<target>) in cited_targets; for the rest (with <path>
     # but without <target>), record <path> into paths.
@@ -236,21 +580,23 @@ def load_targets(target_ids, blade_root_dir, blade):
         if target_name != '*' and target_name != '...':
             cited_targets.add((source_dir, target_name))
         elif target_name == '...':
-            for root, dirs, files in os.walk(source_dir):
-                # Note the dirs[:] = slice assignment; we are replacing the
-                # elements in dirs (and not the list referred to by dirs) so
-                # that os.walk() will not process deleted directories.
-                dirs[:] = [d for d in dirs if not _is_load_excluded(d)]
-                if 'BUILD' in files:
-                    source_dirs.append(root)
+            if dir_index is None:
+                dir_index = BuildDirIndex(blade.get_build_path())
+            source_dirs += dir_index.find_build_dirs(source_dir)
         else:
             source_dirs.append(source_dir)
 
     direct_targets = list(cited_targets)
+    if dir_index is not None:
+        dir_index.save()
 
     # Load BUILD files in paths, and add all loaded targets into
     # cited_targets.  Together with above step, we can ensure that all
     # targets mentioned in the command line are now in cited_targets.
+    load_jobs = getattr(blade.get_options(), 'load_jobs', 1)
+    if load_jobs > 1 and len(source_dirs) > 1:
+        _load_build_files_in_parallel(source_dirs, processed_source_dirs,
+                                      blade, load_jobs)
     for source_dir in source_dirs:
         _load_build_file(source_dir,
                          processed_source_dirs,
@@ -289,5 +635,8 @@ def load_targets(target_ids, blade_root_dir, blade):
         if root_dir not in blade.svn_root_dirs and '#' not in root_dir:
             blade.svn_root_dirs.append(root_dir)
 
+    _load_cache.save()
+    blade.set_load_cache_stats(_load_cache.hits, _load_cache.misses)
+
     return direct_targets, all_command_targets, related_targets
 
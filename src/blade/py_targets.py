@@ -421,6 +421,8 @@ class PythonTest(PythonBinary):
                  main,
                  base,
                  testdata,
+                 cpu,
+                 memory,
                  kwargs):
         """Init method. """
         PythonBinary.__init__(self,
@@ -432,6 +434,7 @@ class PythonTest(PythonBinary):
                               kwargs)
         self.type = 'py_test'
         self.data['testdata'] = testdata
+        self._init_test_resources(cpu, memory)
 
 
 def py_test(name,
@@ -440,6 +443,8 @@ def py_test(name,
             main=None,
             base=None,
             testdata=[],
+            cpu=1,
+            memory=0,
             **kwargs):
     """python test. """
     target = PythonTest(name,
@@ -448,6 +453,8 @@ def py_test(name,
                         main,
                         base,
                         testdata,
+                        cpu,
+                        memory,
                         kwargs)
     blade.blade.register_target(target)
 
@@ -18,10 +18,13 @@
 import os
 import time
 import subprocess
+from distutils.spawn import find_executable
 
+import action_cache
 import blade_util
 import config
 import console
+import toolchain_server
 
 from blade_platform import CcFlagsManager
 
@@ -385,17 +388,33 @@ import scons_helper
 
 
 class NinjaScriptHeaderGenerator(ScriptHeaderGenerator):
+    # Pools of the memory heavy actions and the estimated memory in MB
+    # used by each action
+    _POOLS = [
+        ('link', 2048),
+        ('java', 1024),
+        ('package', 512),
+        ('heavy_gen_rule', 2048),
+    ]
+
     def __init__(self, options, build_dir, blade_path, gcc_version,
                  python_inc, cuda_inc, build_environment, svn_roots):
         ScriptHeaderGenerator.__init__(
                 self, options, build_dir, gcc_version,
                 python_inc, cuda_inc, build_environment, svn_roots)
         self.blade_path = blade_path
+        self.toolchain_socket = None
+        if config.get_item('global_config', 'toolchain_server'):
+            self.toolchain_socket = toolchain_server.socket_path(build_dir)
+        self.action_cache_dir = build_environment.action_cache_dir
 
     def generate_rule(self, name, command, description=None,
                       depfile=None, generator=False, pool=None,
                       restat=False, rspfile=None,
-                      rspfile_content=None, deps=None):
+                      rspfile_content=None, deps=None, cached=False):
+        """Generate a ninja rule, cached rules are run via the action cache. """
+        if cached and self.action_cache_dir:
+            command = action_cache.wrap_command(command)
         self._add_rule('rule %s' % name)
         self._add_rule('  command = %s' % command)
         if description:
@@ -422,6 +441,57 @@ ninja_required_version = 1.7
 builddir = %s
 ''' % self.build_dir)
 
+    def _action_cache_fingerprint(self, tools):
+        """Fingerprint of blade itself and the tools used by cached rules. """
+        if os.path.isfile(self.blade_path):
+            fingerprint = [blade_util.md5sum_file(self.blade_path)]
+        else:
+            fingerprint = [blade_util.md5sum_file(os.path.join(self.blade_path, f))
+                           for f in sorted(os.listdir(self.blade_path)) if f.endswith('.py')]
+        for tool in tools:
+            path = find_executable(tool)
+            if path:
+                st = os.stat(os.path.realpath(path))
+                fingerprint.append('%s %s %s' % (path, st.st_size, st.st_mtime))
+            else:
+                fingerprint.append(tool)
+        return blade_util.md5sum('\n'.join(fingerprint))
+
+    def generate_action_cache_vars(self):
+        if not self.action_cache_dir:
+            return
+        java_config = config.get_section('java_config')
+        tools = [self.get_java_command(java_config, 'jar'), 'xxd', 'python']
+        stats_file = os.path.join(self.build_dir, action_cache.STATS_FILE)
+        self._add_rule('''
+action_cache = PYTHONPATH=%s:$$PYTHONPATH python -S -m action_cache %s %s %s
+implicit_ins =
+''' % (self.blade_path, self.action_cache_dir,
+       self._action_cache_fingerprint(tools), stats_file))
+        console.info('using action cache directory %s' % self.action_cache_dir)
+
+    def generate_pools(self):
+        """Generate pools whose depths are derived from the physical
+        memory and cpu cores unless configured explicitly.
+
+        The available memory is not used, it changes every run and so
+        would build.ninja.
+
+        """
+        memory = blade_util.physical_memory() / (1024 * 1024)
+        cpu_core_num = blade_util.cpu_count()
+        depths = []
+        for name, action_memory in self._POOLS:
+            depth = config.get_item('global_config', '%s_jobs' % name)
+            if not depth:
+                depth = max(min(memory // action_memory, cpu_core_num), 1)
+            self._add_rule('''
+pool %s_pool
+  depth = %d
+''' % (name, depth))
+            depths.append('%s %d' % (name, depth))
+        console.debug('ninja pools: %s' % ', '.join(depths))
+
     def generate_common_rules(self):
         self.generate_rule(name='stamp',
                            command='touch ${out}',
@@ -462,30 +532,34 @@ cxx_warnings = %s
         includes = ' '.join(['-I%s' % inc for inc in includes])
 
         self.generate_cc_warning_vars()
+        command = '%s -o ${out} -MMD -MF ${out}.d -c -fPIC %s %s %s ${cppflags} %s ${includes} ${in}'
+        if config.get_item('cc_config', 'header_inclusion_dependencies'):
+            # Write the header inclusion stack(-H) into ${out}.H by the compile
+            # itself, and print other messages on stderr
+            command += (' -H 2>${out}.H; ret=$$?; '
+                        'awk \'/^\\.+ /{next} '
+                        '/^Multiple include guards may be useful for:/{g=1;next} '
+                        'g&&/^[^ ]+$$/{next} {g=0;print}\' ${out}.H >&2; '
+                        'exit $$ret')
         self.generate_rule(name='cc',
-                command='%s -o ${out} -MMD -MF ${out}.d '
-                        '-c -fPIC %s %s ${c_warnings} ${cppflags} '
-                        '%s ${includes} ${in}' % (
-                        cc, ' '.join(cflags), ' '.join(cppflags), includes),
+                command=command % (cc, ' '.join(cflags), ' '.join(cppflags),
+                                   '${c_warnings}', includes),
                 description='CC ${in}',
                 depfile='${out}.d',
                 deps='gcc')
         self.generate_rule(name='cxx',
-                command='%s -o ${out} -MMD -MF ${out}.d '
-                        '-c -fPIC %s %s ${cxx_warnings} ${cppflags} '
-                        '%s ${includes} ${in}' % (
-                        cxx, ' '.join(cxxflags), ' '.join(cppflags), includes),
+                command=command % (cxx, ' '.join(cxxflags), ' '.join(cppflags),
+                                   '${cxx_warnings}', includes),
                 description='CXX ${in}',
                 depfile='${out}.d',
                 deps='gcc')
         if config.get_item('cc_config', 'header_inclusion_dependencies'):
-            preprocess = '%s -o /dev/null -E -H %s %s -w ${cppflags} %s ${includes} ${in} 2>${out}'
-            self.generate_rule(name='cchdrs',
-                    command=preprocess % (cc, ' '.join(cflags), ' '.join(cppflags), includes),
-                    description='CC HDRS ${in}')
-            self.generate_rule(name='cxxhdrs',
-                    command=preprocess % (cxx, ' '.join(cxxflags), ' '.join(cppflags), includes),
-                    description='CXX HDRS ${in}')
+            args = '%s ${name} ${out} ${out}.rsp ${in} ${srcs}' % self.build_dir
+            self.generate_rule(name='hdrsverify',
+                    command=self.generate_toolchain_command('hdrs_verify', suffix=args),
+                    description='VERIFY HDRS ${name}',
+                    rspfile='${out}.rsp',
+                    rspfile_content='${declared_hdrs}')
         securecc = '%s %s' % (cc_config['securecc'], cxx)
         self._add_rule('''
 build __securecc_phony__ : phony
@@ -506,11 +580,13 @@ build __securecc_phony__ : phony
         self.generate_rule(name='link',
                            command='%s -o ${out} %s ${ldflags} ${in} ${extra_ldflags}' % (
                                    ld, ' '.join(ldflags)),
-                           description='LINK ${out}')
+                           description='LINK ${out}',
+                           pool='link_pool')
         self.generate_rule(name='solink',
                            command='%s -o ${out} -shared %s ${ldflags} ${in} ${extra_ldflags}' % (
                                    ld, ' '.join(ldflags)),
-                           description='SHAREDLINK ${out}')
+                           description='SHAREDLINK ${out}',
+                           pool='link_pool')
 
     def generate_proto_rules(self):
         proto_config = config.get_section('proto_library_config')
@@ -570,12 +646,14 @@ protocpythonpluginflags =
         args = '${name} ${path} ${out} ${in}'
         self.generate_rule(name='resource_index',
                            command=self.generate_toolchain_command('resource_index', suffix=args),
-                           description='RESOURCE INDEX ${out}')
+                           description='RESOURCE INDEX ${out}',
+                           cached=True)
         self.generate_rule(name='resource',
                            command='xxd -i ${in} | '
                                    'sed -e "s/^unsigned char /const char RESOURCE_/g" '
                                    '-e "s/^unsigned int /const unsigned int RESOURCE_/g" > ${out}',
-                           description='RESOURCE ${in}')
+                           description='RESOURCE ${in}',
+                           cached=True)
 
     def get_java_command(self, java_config, cmd):
         java_home = java_config['java_home']
@@ -611,7 +689,8 @@ javacflags =
                                    '%s && sleep 0.5 && '
                                    '%s cf ${out} -C ${classes_dir} .' % (
                                    ' '.join(cmd), jar),
-                           description='JAVAC ${in}')
+                           description='JAVAC ${in}',
+                           pool='java_pool')
 
     def generate_java_resource_rules(self):
         self.generate_rule(name='javaresource',
@@ -638,7 +717,9 @@ javacflags =
         args = '%s ${mainclass} ${out} ${in}' % bootjar
         self.generate_rule(name='onejar',
                            command=self.generate_toolchain_command('java_onejar', suffix=args),
-                           description='ONE JAR ${out}')
+                           description='ONE JAR ${out}',
+                           pool='java_pool',
+                           cached=True)
         self.generate_rule(name='javabinary',
                            command=self.generate_toolchain_command('java_binary'),
                            description='JAVA BIN ${out}')
@@ -666,7 +747,8 @@ scalacflags = -nowarn
         ]
         self.generate_rule(name='scalac',
                            command=' '.join(cmd),
-                           description='SCALAC ${out}')
+                           description='SCALAC ${out}',
+                           pool='java_pool')
         args = '%s %s ${out} ${in}' % (java, scala)
         self.generate_rule(name='scalatest',
                            command=self.generate_toolchain_command('scala_test', suffix=args),
@@ -680,11 +762,14 @@ scalacflags = -nowarn
         args = '%s ${out} ${in}' % jar
         self.generate_rule(name='javajar',
                            command=self.generate_toolchain_command('java_jar', suffix=args),
-                           description='JAVA JAR ${out}')
+                           description='JAVA JAR ${out}',
+                           cached=True)
         self.generate_java_test_rules()
         self.generate_rule(name='fatjar',
                            command=self.generate_toolchain_command('java_fatjar'),
-                           description='FAT JAR ${out}')
+                           description='FAT JAR ${out}',
+                           pool='java_pool',
+                           cached=True)
         self.generate_java_binary_rules()
         self.generate_scala_rules(java_config)
 
@@ -709,11 +794,13 @@ pythonbasedir = __pythonbasedir__
         args = '${pythonbasedir} ${out} ${in}'
         self.generate_rule(name='pythonlibrary',
                            command=self.generate_toolchain_command('python_library', suffix=args),
-                           description='PYTHON LIBRARY ${out}')
+                           description='PYTHON LIBRARY ${out}',
+                           cached=True)
         args = '${pythonbasedir} ${mainentry} ${out} ${in}'
         self.generate_rule(name='pythonbinary',
                            command=self.generate_toolchain_command('python_binary', suffix=args),
-                           description='PYTHON BINARY ${out}')
+                           description='PYTHON BINARY ${out}',
+                           cached=True)
 
     def generate_go_rules(self):
         go_home = config.get_item('go_config', 'go_home')
@@ -759,7 +846,9 @@ pool %s
         args = '${out} ${in} ${entries}'
         self.generate_rule(name='package',
                            command=self.generate_toolchain_command('package', suffix=args),
-                           description='PACKAGE ${out}')
+                           description='PACKAGE ${out}',
+                           pool='package_pool',
+                           cached=True)
 
     def generate_version_rules(self):
         revision, url = blade_util.load_scm(self.build_dir)
@@ -785,7 +874,13 @@ build %s: cxx %s
         cmd = ['PYTHONPATH=%s:$$PYTHONPATH' % self.blade_path]
         if prefix:
             cmd.append(prefix)
-        cmd.append('python -m toolchain %s' % builder)
+        if self.toolchain_socket:
+            # Run in the toolchain server to save the startup cost,
+            # the client falls back to run toolchain directly
+            cmd.append('python -S -m toolchain_client %s %s' % (
+                       self.toolchain_socket, builder))
+        else:
+            cmd.append('python -m toolchain %s' % builder)
         if suffix:
             cmd.append(suffix)
         else:
@@ -795,6 +890,8 @@ build %s: cxx %s
     def generate(self):
         """Generate ninja rules. """
         self.generate_top_level_vars()
+        self.generate_action_cache_vars()
+        self.generate_pools()
         self.generate_common_rules()
         self.generate_cc_rules()
         self.generate_proto_rules()
@@ -827,6 +924,14 @@ class RulesGenerator(object):
             pass
         os.symlink(os.path.abspath(self.build_dir), 'blade-bin')
 
+    def _get_cuda_include(self):
+        """Returns cuda include only if there are cuda targets to be built,
+        to avoid probing nvcc for nothing. """
+        for target in self.blade.get_build_targets().itervalues():
+            if target.type.startswith('cu_'):
+                return self.scons_platform.get_cuda_include()
+        return []
+
     def generate_build_rules(self):
         """Generate build rules for underlying build system. """
         raise NotImplementedError
@@ -847,7 +952,7 @@ class SconsRulesGenerator(RulesGenerator):
         options = self.blade.get_options()
         gcc_version = self.scons_platform.get_gcc_version()
         python_inc = self.scons_platform.get_python_include()
-        cuda_inc = self.scons_platform.get_cuda_include()
+        cuda_inc = self._get_cuda_include()
         self.scons_script_header_generator = SconsScriptHeaderGenerator(
                 options,
                 self.build_dir,
@@ -865,16 +970,25 @@ class SconsRulesGenerator(RulesGenerator):
 
 
 class NinjaRulesGenerator(RulesGenerator):
-    """Generate ninja rules to build.ninja. """
+    """Generate ninja rules to build.ninja.
+
+    Rules of targets are written into a ninja file per source dir under
+    <build_dir>/.ninja, which is included by build.ninja via subninja.
+    Each file is only rewritten when its content changes, so ninja files
+    are kept between runs and a change in one BUILD file only rewrites
+    its own fragment. Files of dirs which have no targets any more are
+    removed.
+
+    """
     def __init__(self, ninja_path, blade_path, blade):
         RulesGenerator.__init__(self, ninja_path, blade_path, blade)
+        self.ninja_dir = os.path.join(self.build_dir, '.ninja')
 
-    def generate_build_rules(self):
-        """Generate ninja rules to build.ninja. """
+    def _generate_header_rules(self):
         options = self.blade.get_options()
         gcc_version = self.scons_platform.get_gcc_version()
         python_inc = self.scons_platform.get_python_include()
-        cuda_inc = self.scons_platform.get_cuda_include()
+        cuda_inc = self._get_cuda_include()
         ninja_script_header_generator = NinjaScriptHeaderGenerator(
                 options,
                 self.build_dir,
@@ -884,7 +998,65 @@ class NinjaRulesGenerator(RulesGenerator):
                 cuda_inc,
                 self.blade.build_environment,
                 self.blade.svn_root_dirs)
-        rules = ninja_script_header_generator.generate()
+        return ninja_script_header_generator.generate()
+
+    def _subninja_path(self, path):
+        return os.path.join(self.ninja_dir, path, 'build.ninja')
+
+    def _prune_subninja_files(self, subninja_paths):
+        """Remove ninja files of source dirs which have no targets now. """
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.ninja_dir, topdown=False):
+            for name in filenames:
+                path = os.path.normpath(os.path.join(dirpath, name))
+                if path not in subninja_paths:
+                    os.remove(path)
+                    removed += 1
+            if dirpath != self.ninja_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        if removed:
+            console.info('%d stale ninja files removed' % removed)
+
+    def generate_build_rules(self):
+        """Generate ninja rules to build.ninja. """
+        rules = self._generate_header_rules()
         rules += self.blade.gen_targets_rules()
         return rules
 
+    def generate_build_script(self):
+        """Generate build.ninja and the ninja files of source dirs. """
+        rules = self._generate_header_rules()
+        header = rules[:]
+        written = 0
+        rules_by_dir = self.blade.gen_targets_rules_by_dir()
+        for path, dir_rules in rules_by_dir:
+            if _write_file_if_changed(self._subninja_path(path), dir_rules):
+                written += 1
+            rules += dir_rules
+        # Sort to keep build.ninja unchanged when only the order of targets changes
+        for path in sorted([path for path, dir_rules in rules_by_dir]):
+            header.append('subninja %s\n' % self._subninja_path(path))
+        if _write_file_if_changed(self.script_path, header):
+            written += 1
+        self._prune_subninja_files(set([os.path.normpath(self._subninja_path(path))
+                                        for path, dir_rules in rules_by_dir]))
+        console.info('%d of %d ninja files updated' % (written, len(rules_by_dir) + 1))
+        return rules
+
+
+def _write_file_if_changed(path, lines):
+    """Write lines into the file only if the content digest changes.
+
+    Keep the file untouched otherwise, so its mtime is unchanged.
+    Returns whether the file is written.
+
+    """
+    content = ''.join(lines)
+    if os.path.isfile(path) and blade_util.md5sum_file(path) == blade_util.md5sum(content):
+        return False
+    dir = os.path.dirname(path)
+    if dir and not os.path.isdir(dir):
+        os.makedirs(dir)
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
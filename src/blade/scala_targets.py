@@ -197,11 +197,12 @@ class ScalaFatLibrary(ScalaTarget):
 class ScalaTest(ScalaFatLibrary):
     """ScalaTest"""
     def __init__(self, name, srcs, deps, resources, source_encoding, warnings,
-                 testdata, kwargs):
+                 testdata, cpu, memory, kwargs):
         ScalaFatLibrary.__init__(self, name, srcs, deps, resources, source_encoding,
                                  warnings, [], kwargs)
         self.type = 'scala_test'
         self.data['testdata'] = var_to_list(testdata)
+        self._init_test_resources(cpu, memory)
         scalatest_libs = config.get_item('scala_test_config', 'scalatest_libs')
         if scalatest_libs:
             self._add_hardcode_java_library(scalatest_libs)
@@ -283,6 +284,8 @@ def scala_test(name,
                source_encoding=None,
                warnings=None,
                testdata=[],
+               cpu=1,
+               memory=0,
                **kwargs):
     """Define scala_test target. """
     target = ScalaTest(name,
@@ -292,6 +295,8 @@ def scala_test(name,
                        source_encoding,
                        warnings,
                        testdata,
+                       cpu,
+                       memory,
                        kwargs)
     blade.blade.register_target(target)
 
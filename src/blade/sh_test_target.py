@@ -37,6 +37,8 @@ class ShellTest(Target):
                  srcs,
                  deps,
                  testdata,
+                 cpu,
+                 memory,
                  kwargs):
         srcs = var_to_list(srcs)
         deps = var_to_list(deps)
@@ -52,6 +54,7 @@ class ShellTest(Target):
                         kwargs)
 
         self._process_test_data(testdata)
+        self._init_test_resources(cpu, memory)
 
     def _process_test_data(self, testdata):
         """
@@ -136,11 +139,15 @@ def sh_test(name,
             srcs,
             deps=[],
             testdata=[],
+            cpu=1,
+            memory=0,
             **kwargs):
     blade.blade.register_target(ShellTest(name,
                                           srcs,
                                           deps,
                                           testdata,
+                                          cpu,
+                                          memory,
                                           kwargs))
 
 
@@ -56,10 +56,12 @@ class SwigLibrary(CcTarget):
         self.data['python_vars'] = []
         self.data['python_sources'] = []
 
-        scons_platform = self.blade.get_scons_platform()
-        self.php_inc_list = scons_platform.get_php_include()
         self.options = self.blade.get_options()
 
+    def _rehydrate(self, blade):
+        CcTarget._rehydrate(self, blade)
+        self.options = blade.get_options()
+
     def _expand_deps_generation(self):
         build_targets = self.blade.get_build_targets()
         for dep in self.expanded_deps:
@@ -333,8 +335,9 @@ class SwigLibrary(CcTarget):
                     phpswig_flags += ' -cpperraswarn'
 
         self._write_rule('%s.Append(SWIGPHPFLAGS="%s")' % (env_name, phpswig_flags))
-        if self.php_inc_list:
-            self._write_rule('%s.Append(CPPPATH=%s)' % (env_name, self.php_inc_list))
+        php_inc_list = self.blade.get_scons_platform().get_php_include()
+        if php_inc_list:
+            self._write_rule('%s.Append(CPPPATH=%s)' % (env_name, php_inc_list))
 
         dep_files = []
         dep_files_map = {}
@@ -403,7 +406,7 @@ class SwigLibrary(CcTarget):
             self.data.get('generate_java')):
             self._swig_library_rules_java(dep_files_map)
         if getattr(self.options, 'generate_php', False):
-            if not self.php_inc_list:
+            if not self.blade.get_scons_platform().get_php_include():
                 console.error_exit('failed to build //%s:%s, please install php modules' % (
                            self.path, self.name))
             else:
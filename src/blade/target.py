@@ -74,6 +74,29 @@ class Target(object):
         self.data['generated_hdrs'] = []
         self.__cached_generate_header_files = None
 
+    def __getstate__(self):
+        """Exclude the references to blade manager when being pickled. """
+        state = self.__dict__.copy()
+        del state['blade']
+        del state['target_database']
+        return state
+
+    def _rehydrate(self, blade):
+        """Restore the target unpickled from the BUILD load cache.
+
+        The constructor is not executed for a cached target, so restore
+        the references to blade manager and redo the global side effects
+        of the constructor, such as source file owner checking and system
+        library registration.
+
+        """
+        self.blade = blade
+        self.target_database = blade.get_target_database()
+        self._check_srcs()
+        for dkey in self.expanded_deps:
+            if dkey[0] == '#':
+                self._add_system_library(dkey, '#' + dkey[1])
+
     def _clone_env(self):
         """Clone target's environment. """
         self._write_rule('%s = top_env.Clone()' % self._env_name())
@@ -92,6 +115,16 @@ class Target(object):
             console.error_exit('//%s: unrecognized options %s' % (
                                self.fullname, kwargs))
 
+    def _init_test_resources(self, cpu, memory):
+        """Set the cpu cores and memory(MB) used by the test when running. """
+        if not isinstance(cpu, (int, float)) or cpu <= 0:
+            console.error_exit('//%s: cpu should be a positive number' % self.fullname)
+        if not isinstance(memory, (int, long)) or memory < 0:
+            console.error_exit('//%s: memory should be a non-negative integer in MB' %
+                               self.fullname)
+        self.data['cpu'] = cpu
+        self.data['memory'] = memory
+
     def _allow_duplicate_source(self):
         """Whether the target allows duplicate source file with other targets. """
         return False
@@ -664,6 +697,8 @@ class Target(object):
             ins.append('||')
             ins += order_only_deps
         self._write_rule('build %s: %s %s' % (' '.join(outs), rule, ' '.join(ins)))
+        self.blade.register_ninja_outputs(
+                self.key, rule, [o for o in outs if o != '|'])
 
         if variables:
             assert isinstance(variables, dict)
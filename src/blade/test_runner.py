@@ -14,6 +14,8 @@
 """
 
 
+import cPickle
+import math
 import os
 import sys
 import subprocess
@@ -25,6 +27,7 @@ import console
 
 from blade_util import environ_add_path
 from blade_util import md5sum
+from blade_util import md5sum_file
 from test_scheduler import TestScheduler
 
 
@@ -60,6 +63,66 @@ def _diff_env(a, b):
     return (dict(seta - setb), dict(setb - seta))
 
 
+class FileDigestCache(object):
+    """Persistent cache of file content digests.
+
+    Each file is recorded with its inode, size and mtime, a file is read
+    and hashed again only when any of them changes.
+
+    """
+    _VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.digests = {}  # path -> ((inode, size, mtime), digest)
+        self.modified = False
+        self.start_time = time.time()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    version, digests = cPickle.load(f)
+                if version == self._VERSION:
+                    self.digests = digests
+            except Exception:
+                console.warning('Failed to load file digests %s, ignored' % self.path)
+
+    def digest(self, path):
+        """Return the md5sum of the file content. """
+        st = os.stat(path)
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        entry = self.digests.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        digest = md5sum_file(path)
+        # Changes in the same time slot of mtime can not be detected
+        if st.st_mtime < self.start_time - 1:
+            self.digests[path] = (key, digest)
+            self.modified = True
+        return digest
+
+    def save(self):
+        """Write the cache back to disk if it was modified. """
+        if not self.modified or not os.path.isdir(os.path.dirname(self.path)):
+            return
+        for path in self.digests.keys():
+            if not os.path.isfile(path):
+                del self.digests[path]
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((self._VERSION, self.digests), f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+
+def _list_files(path):
+    """Return path itself if it is a file, or all files under it recursively. """
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+        files += [os.path.join(dirpath, name) for name in filenames]
+    return files
+
+
 class TestRunner(binary_runner.BinaryRunner):
     """TestRunner. """
     def __init__(self, targets, options, target_database, direct_targets):
@@ -78,16 +141,26 @@ class TestRunner(binary_runner.BinaryRunner):
         self.run_all_reason = ''
         self.title = '=' * 13
         self.skipped_tests = []
+        self.test_shards = {}  # target key -> number of shards
         self.coverage = getattr(options, 'coverage', False)
-        if not self.options.fulltest:
-            if os.path.exists(self.inctest_md5_file):
-                try:
-                    f = open(self.inctest_md5_file)
-                    self.last_test_stamp = eval(f.read())
-                    f.close()
-                except (IOError, SyntaxError):
-                    console.warning('error loading incremental test history, will run full test')
-                    self.run_all_reason = 'NO_HISTORY'
+        self.digest_cache = None
+        if config.get_item('global_config', 'test_related_digest') == 'content':
+            self.digest_cache = FileDigestCache(
+                    os.path.join(self.build_dir, '.blade_test_digests'))
+        # The history is also loaded by full test for the costs of tests
+        if os.path.exists(self.inctest_md5_file):
+            try:
+                f = open(self.inctest_md5_file)
+                self.last_test_stamp = eval(f.read())
+                f.close()
+            except (IOError, SyntaxError):
+                console.warning('error loading incremental test history, will run full test')
+                self.run_all_reason = 'NO_HISTORY'
+        if self.options.fulltest:
+            # Full test runs all tests, only the costs in the history are used
+            self.last_test_stamp = {
+                    'md5': {},
+                    'costtime': self.last_test_stamp.get('costtime', {})}
 
         self.test_stamp['testarg'] = md5sum(str(self.options.args))
         env_keys = os.environ.keys()
@@ -164,22 +237,26 @@ class TestRunner(binary_runner.BinaryRunner):
             if os.path.exists(data_target_path):
                 related_file_data_list.append(data_target_path)
 
+        related_file_data_list = sum(
+                [_list_files(f) for f in related_file_data_list], [])
         related_file_list.sort()
         related_file_data_list.sort()
 
-        test_target_str = ''
-        test_target_data_str = ''
-        for f in related_file_list:
-            mtime = os.path.getmtime(f)
-            ctime = os.path.getctime(f)
-            test_target_str += str(mtime) + str(ctime)
+        return (md5sum(self._get_files_stamp(related_file_list)),
+                md5sum(self._get_files_stamp(related_file_data_list)))
 
-        for f in related_file_data_list:
-            mtime = os.path.getmtime(f)
-            ctime = os.path.getctime(f)
-            test_target_data_str += str(mtime) + str(ctime)
-
-        return md5sum(test_target_str), md5sum(test_target_data_str)
+    def _get_files_stamp(self, files):
+        """Return the stamp string of files, from the content digests if
+        enabled, otherwise from the mtimes and ctimes. """
+        stamp = ''
+        for f in files:
+            if self.digest_cache:
+                stamp += f + self.digest_cache.digest(f)
+            else:
+                mtime = os.path.getmtime(f)
+                ctime = os.path.getctime(f)
+                stamp += str(mtime) + str(ctime)
+        return stamp
 
     def _generate_inctest_run_list(self):
         """Get incremental test run list. """
@@ -234,6 +311,34 @@ class TestRunner(binary_runner.BinaryRunner):
         for key in diff_keys:
             self.test_stamp['md5'][key] = self.last_test_stamp['md5'][key]
 
+    def _update_tests_costs(self):
+        """Record costs of tests run this time into the test stamp. """
+        costs = dict(self.last_test_stamp.get('costtime', {}))
+        for v in self.tests_run_map.itervalues():
+            if v.get('result'):
+                costs[v['runfile']] = v['costtime']
+        self.test_stamp['costtime'] = costs
+
+    def _get_test_shard_count(self, target, costtime):
+        """Return the number of shards to run the cc_test.
+
+        The shard_count of the target is used if it is specified, otherwise
+        a test which took longer than auto_shard_time last time is sharded
+        automatically, limited by the number of test jobs.
+
+        """
+        if target.type != 'cc_test' or target.data.get('exclusive'):
+            return 1
+        shard_count = target.data.get('shard_count')
+        if shard_count:
+            return shard_count
+        auto_shard_time = config.get_item('cc_test_config', 'auto_shard_time')
+        if (auto_shard_time > 0 and costtime is not None and
+            costtime > auto_shard_time):
+            return max(min(int(math.ceil(costtime / auto_shard_time)),
+                           self.options.test_jobs), 1)
+        return 1
+
     def _get_java_coverage_data(self):
         """
         Return a list of tuples(source directory, class directory, execution data)
@@ -302,10 +407,13 @@ class TestRunner(binary_runner.BinaryRunner):
 
     def _write_test_history(self):
         """write md5sum to file. """
+        self._update_tests_costs()
         f = open(self.inctest_md5_file, 'w')
         print >> f, str(self.test_stamp)
         f.close()
         self._check_inctest_md5sum_file()
+        if self.digest_cache:
+            self.digest_cache.save()
 
     def _write_tests_detail_map(self):
         """write the tests detail map for further use. """
@@ -319,6 +427,13 @@ class TestRunner(binary_runner.BinaryRunner):
         for key in self.skipped_tests:
             console.info('%s:%s skipped' % (key[0], key[1]), prefix = False)
 
+    def _clean_env(self):
+        """clean test environment, including runfiles of test shards. """
+        binary_runner.BinaryRunner._clean_env(self)
+        for key, shard_count in self.test_shards.iteritems():
+            for shard in range(shard_count):
+                self._clean_target(self.targets[key], shard)
+
     def _show_tests_detail(self):
         """Show the tests detail after scheduling them. """
         tests = []
@@ -355,6 +470,8 @@ class TestRunner(binary_runner.BinaryRunner):
             for target in failed_targets:
                 print >>sys.stderr, '%s, exit code: %s' % (
                         target.fullname, target.data['test_exit_code'])
+                if 'test_log' in target.data:
+                    print >>sys.stderr, '    output: %s' % target.data['test_log']
                 test_file_name = os.path.abspath(self._executable(target))
                 # Do not skip failed test by default
                 if test_file_name in self.test_stamp['md5']:
@@ -375,6 +492,8 @@ class TestRunner(binary_runner.BinaryRunner):
         """Run all the test target programs. """
         self._generate_inctest_run_list()
         tests_run_list = []
+        tests_costs = {}
+        last_costs = self.last_test_stamp.get('costtime', {})
         for target in self.targets.values():
             if not target.type.endswith('_test'):
                 continue
@@ -382,27 +501,41 @@ class TestRunner(binary_runner.BinaryRunner):
                 if not target.data.get('always_run'):
                     self.skipped_tests.append((target.path, target.name))
                     continue
-            test_env = self._prepare_env(target)
             cmd = [os.path.abspath(self._executable(target))]
             cmd += self.options.args
-            if console.color_enabled:
-                test_env['GTEST_COLOR'] = 'yes'
+            if cmd[0] in last_costs:
+                tests_costs[target.key] = last_costs[cmd[0]]
+            shard_count = self._get_test_shard_count(target, last_costs.get(cmd[0]))
+            if shard_count > 1:
+                self.test_shards[target.key] = shard_count
+                shards = range(shard_count)
             else:
-                test_env['GTEST_COLOR'] = 'no'
-            test_env['GTEST_OUTPUT'] = 'xml'
-            test_env['HEAPCHECK'] = target.data.get('heap_check', '')
-            pprof_path = config.get_item('cc_test_config', 'pprof_path')
-            if pprof_path:
-                test_env['PPROF_PATH'] = os.path.abspath(pprof_path)
-            if self.coverage:
-                test_env['BLADE_COVERAGE'] = 'true'
-            tests_run_list.append((target, self._runfiles_dir(target), test_env, cmd))
+                shards = [None]
+            for shard in shards:
+                test_env = self._prepare_env(target, shard)
+                if console.color_enabled:
+                    test_env['GTEST_COLOR'] = 'yes'
+                else:
+                    test_env['GTEST_COLOR'] = 'no'
+                test_env['GTEST_OUTPUT'] = 'xml'
+                test_env['HEAPCHECK'] = target.data.get('heap_check', '')
+                pprof_path = config.get_item('cc_test_config', 'pprof_path')
+                if pprof_path:
+                    test_env['PPROF_PATH'] = os.path.abspath(pprof_path)
+                if self.coverage:
+                    test_env['BLADE_COVERAGE'] = 'true'
+                if shard is not None:
+                    test_env['GTEST_TOTAL_SHARDS'] = str(shard_count)
+                    test_env['GTEST_SHARD_INDEX'] = str(shard)
+                tests_run_list.append((target, self._runfiles_dir(target, shard),
+                                       test_env, cmd, shard))
 
         sys.stdout.flush()
         concurrent_jobs = self.options.test_jobs
         scheduler = TestScheduler(tests_run_list,
                                   concurrent_jobs,
-                                  self.tests_run_map)
+                                  self.tests_run_map,
+                                  tests_costs)
         try:
             scheduler.schedule_jobs()
         except KeyboardInterrupt:
@@ -12,7 +12,11 @@
 """
 
 
-import Queue
+import errno
+import fcntl
+import heapq
+import os
+import select
 import signal
 import subprocess
 import sys
@@ -20,8 +24,8 @@ import threading
 import time
 import traceback
 
+import blade_trace
 import blade_util
-import config
 import console
 
 
@@ -31,15 +35,166 @@ _SIGNAL_MAP = dict([
 ])
 
 
+class WorkerEvents(object):
+    """Events from worker threads to the scheduler.
+
+    Workers write a byte into a pipe when any event happens, so the
+    scheduler waits on it by select and wakes up immediately. Deadlines of
+    running jobs are kept in a heap, the scheduler sleeps until the
+    earliest one if no other event happens.
+
+    """
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        # A full pipe already has pending events
+        flags = fcntl.fcntl(self.write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.deadlines = []  # heap of (deadline, thread id, thread)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def close(self):
+        """Close the pipe, workers may be still running after interrupted. """
+        self.lock.acquire()
+        self.closed = True
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        self.lock.release()
+
+    def notify(self):
+        self.lock.acquire()
+        try:
+            if not self.closed:
+                os.write(self.write_fd, 'x')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        finally:
+            self.lock.release()
+
+    def add_deadline(self, deadline, thread):
+        self.lock.acquire()
+        heapq.heappush(self.deadlines, (deadline, thread.thread_id, thread))
+        self.lock.release()
+        self.notify()
+
+    def pop_expired(self, now):
+        """Pop threads whose deadlines expired, return them and the next deadline. """
+        expired = []
+        self.lock.acquire()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            expired.append(heapq.heappop(self.deadlines)[2])
+        next_deadline = self.deadlines[0][0] if self.deadlines else None
+        self.lock.release()
+        return expired, next_deadline
+
+    def wait(self, timeout):
+        """Wait for any event until timeout, None means forever. """
+        try:
+            readable = select.select([self.read_fd], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if readable:
+            os.read(self.read_fd, 4096)
+
+
+def _job_resources(job):
+    """Return the (cpu, memory) declared by the target of the job. """
+    data = job[0].data
+    return data.get('cpu', 1), data.get('memory', 0)
+
+
+class TestJobQueue(object):
+    """The queue of test jobs admitted by the capacity of cpu and memory.
+
+    A job is got only if its cpu and memory fit in the capacity left by the
+    running jobs, the first fitting job in order is chosen. A job larger
+    than the whole capacity runs when there is no other running job.
+    None capacity means unlimited.
+
+    """
+    def __init__(self, jobs, cpu_capacity, memory_capacity):
+        self.jobs = list(jobs)
+        self.cpu_capacity = cpu_capacity
+        self.memory_capacity = memory_capacity
+        self.cpu_used, self.memory_used = 0, 0
+        self.running = 0
+        self.busy_cpu_time = 0
+        self.cond = threading.Condition()
+
+    def _fit(self, job):
+        if not self.running:
+            return True
+        cpu, memory = _job_resources(job)
+        if self.cpu_capacity is not None and self.cpu_used + cpu > self.cpu_capacity:
+            return False
+        if (self.memory_capacity is not None and
+            self.memory_used + memory > self.memory_capacity):
+            return False
+        return True
+
+    def _pop_fit(self):
+        """Pop the first fitting job and take its resources, or return None. """
+        for i, job in enumerate(self.jobs):
+            if self._fit(job):
+                del self.jobs[i]
+                cpu, memory = _job_resources(job)
+                self.cpu_used += cpu
+                self.memory_used += memory
+                self.running += 1
+                return job
+        return None
+
+    def get(self):
+        """Wait for the next admitted job, return None if there is no more job. """
+        self.cond.acquire()
+        try:
+            while self.jobs:
+                job = self._pop_fit()
+                if job:
+                    return job
+                self.cond.wait()
+            return None
+        finally:
+            self.cond.release()
+
+    def done(self, job, costtime):
+        """Release resources of the finished job. """
+        self.cond.acquire()
+        cpu, memory = _job_resources(job)
+        self.cpu_used -= cpu
+        self.memory_used -= memory
+        self.running -= 1
+        if self.cpu_capacity is not None:
+            cpu = min(cpu, self.cpu_capacity)
+        self.busy_cpu_time += cpu * costtime
+        self.cond.notifyAll()
+        self.cond.release()
+
+    def close(self):
+        """Drop jobs not started yet. """
+        self.cond.acquire()
+        self.jobs = []
+        self.cond.notifyAll()
+        self.cond.release()
+
+    def empty(self):
+        return not self.jobs
+
+
 class WorkerThread(threading.Thread):
-    def __init__(self, id, job_queue, job_handler, redirect):
+    def __init__(self, id, job_queue, job_handler, redirect, events):
         """Init methods for this thread. """
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, name='test worker %d' % id)
         self.thread_id = id
         self.running = True
+        self.finished = False
         self.job_queue = job_queue
         self.job_handler = job_handler
         self.redirect = redirect
+        self.events = events
         self.job_start_time, self.job_timeout = 0, 0
         self.job_process = None
         self.job_name = ''
@@ -55,6 +210,7 @@ class WorkerThread(threading.Thread):
     def terminate(self):
         """Terminate the worker. """
         self.running = False
+        self.job_queue.close()
 
     def cleanup_job(self):
         """Clean up job data. """
@@ -66,20 +222,22 @@ class WorkerThread(threading.Thread):
     def set_job_data(self, p, name, timeout):
         """Set the popen object and name if the job is run in a subprocess. """
         self.job_process, self.job_name, self.job_timeout = p, name, timeout
+        if timeout is not None:
+            self.events.add_deadline(self.job_start_time + timeout, self)
 
     def check_job_timeout(self, now):
         """Check whether the job is timeout or not.
 
         This method simply checks job timeout and returns immediately.
-        The caller should invoke this method repeatedly so that a job
-        which takes a very long time would be timeout sooner or later.
+        The caller invokes it when the deadline of a job expired, another
+        job started later by this thread is not affected.
         """
         try:
             self.job_lock.acquire()
             if (not self.job_is_timeout and self.job_start_time and
                 self.job_timeout is not None and
                 self.job_name and self.job_process is not None):
-                if self.job_start_time + self.job_timeout < now:
+                if self.job_start_time + self.job_timeout <= now:
                     self.job_is_timeout = True
                     console.error('%s: TIMEOUT\n' % self.job_name)
                     self.job_process.terminate()
@@ -91,13 +249,15 @@ class WorkerThread(threading.Thread):
         try:
             if self.job_handler:
                 job_queue = self.job_queue
-                while not job_queue.empty() and self.running:
-                    try:
-                        job = job_queue.get_nowait()
-                    except Queue.Empty:
-                        continue
+                while self.running:
+                    job = job_queue.get()
+                    if job is None:
+                        break
                     self.job_start_time = time.time()
-                    self.job_handler(job, self.redirect, self)
+                    try:
+                        self.job_handler(job, self.redirect, self)
+                    finally:
+                        job_queue.done(job, time.time() - self.job_start_time)
                     try:
                         self.job_lock.acquire()
                         self.cleanup_job()
@@ -107,35 +267,138 @@ class WorkerThread(threading.Thread):
                 self._process()
         except:
             traceback.print_exc()
+        finally:
+            self.finished = True
+            self.events.notify()
+
+
+# Expected cost of tests when there is no history at all
+_DEFAULT_TEST_COST = 1.0
+
+# Name of the file in the runfiles dir which the test output is written into
+TEST_LOG = 'test.log'
+
+# Number of lines printed from the end of the output of a failed test
+_TEST_LOG_TAIL_LINES = 100
+
+
+def _tail(path, lines):
+    """Return the last lines of the file without reading it all. """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = pos = f.tell()
+        data = ''
+        while pos > 0 and data.count('\n') <= lines:
+            pos = max(pos - 65536, 0)
+            f.seek(pos)
+            data = f.read(end - pos)
+    return '\n'.join(data.splitlines()[-lines:])
 
 
 class TestScheduler(object):
     """TestScheduler. """
-    def __init__(self, tests_list, jobs, tests_run_map):
-        """init method. """
+    def __init__(self, tests_list, jobs, tests_run_map, tests_costs=None):
+        """init method.
+
+        tests_costs is the dict of target key -> costtime of the last run,
+        tests are scheduled longest first according to it.
+
+        Each job is a tuple (target, run_dir, env, cmd, shard), shard is the
+        index of the gtest shard or None if the test is not sharded. Results
+        of all shards of a test are merged into one entry of tests_run_map.
+
+        """
         self.tests_list = tests_list
         self.jobs = jobs
         self.tests_run_map = tests_run_map
+        self.tests_costs = tests_costs or {}
         self.tests_run_map_lock = threading.Lock()
         self.cpu_core_num = blade_util.cpu_count()
-        self.num_of_tests = len(self.tests_list)
+        self.shards = {}  # target key -> number of shards
+        for job in self.tests_list:
+            if job[4] is not None:
+                self.shards[job[0].key] = self.shards.get(job[0].key, 0) + 1
+        self.shards_left = dict(self.shards)
+        self.num_of_tests = len(set(job[0].key for job in self.tests_list))
         self.max_worker_threads = 16
         self.failed_targets = []
         self.failed_targets_lock = threading.Lock()
         self.num_of_run_tests = 0
         self.num_of_run_tests_lock = threading.Lock()
-        self.job_queue = Queue.Queue(0)
-        self.exclusive_job_queue = Queue.Queue(0)
-
-    def _get_workers_num(self):
-        """get the number of thread workers. """
+        self.job_queue = None
+        self.exclusive_job_queue = None
+        self.events = None
+        self.expected_makespan = 0
+        self.makespan = 0
+        self.idle_time = 0
+
+    def _get_cpu_capacity(self):
+        """get the number of cpu cores to run tests. """
         max_workers = max(self.cpu_core_num, self.max_worker_threads)
         if self.jobs <= 1:
             return 1
         elif self.jobs > max_workers:
             self.jobs = max_workers
+        return self.jobs
+
+    @staticmethod
+    def _get_memory_capacity():
+        """get the memory(MB) to run tests. """
+        return blade_util.available_memory() / (1024 * 1024)
+
+    @staticmethod
+    def _get_workers_num(jobs, cpu_capacity):
+        """get the number of thread workers, enough to run as many jobs
+        as the capacity allows. """
+        if not jobs:
+            return 0
+        min_cpu = min(_job_resources(job)[0] for job in jobs)
+        return max(min(len(jobs), int(cpu_capacity / min_cpu)), 1)
+
+    def _expected_costs(self):
+        """Return the dict of target key -> expected cost of each test.
+
+        Tests without history are expected to cost the average of others.
 
-        return min(self.num_of_tests, self.jobs)
+        """
+        keys = set(job[0].key for job in self.tests_list)
+        costs = [self.tests_costs[key] for key in keys if key in self.tests_costs]
+        if costs:
+            default_cost = sum(costs) / len(costs)
+        else:
+            default_cost = _DEFAULT_TEST_COST
+        return dict((key, self.tests_costs.get(key, default_cost)) for key in keys)
+
+    def _sort_jobs(self, expected_costs):
+        """Sort jobs longest expected first, so a long test does not start at the end. """
+        return sorted(self.tests_list,
+                      key=lambda job: expected_costs[job[0].key],
+                      reverse=True)
+
+    def _job_name(self, job):
+        target, shard = job[0], job[4]
+        if shard is None:
+            return target.fullname
+        return '%s(shard %d/%d)' % (target.fullname, shard, self.shards[target.key])
+
+    @staticmethod
+    def _predict_makespan(jobs, costs, cpu_capacity, memory_capacity):
+        """Predict the makespan of running jobs admitted by the capacity. """
+        job_queue = TestJobQueue(jobs, cpu_capacity, memory_capacity)
+        now = 0
+        running = []  # heap of (end time, serial, job)
+        serial = 0
+        while True:
+            job = job_queue._pop_fit()
+            while job:
+                heapq.heappush(running, (now + costs[job[0].key], serial, job))
+                serial += 1
+                job = job_queue._pop_fit()
+            if not running:
+                return now
+            entry = heapq.heappop(running)
+            now = entry[0]
+            job_queue.done(entry[2], 0)
 
     def _get_result(self, returncode):
         """translate result from returncode. """
@@ -146,33 +409,43 @@ class TestScheduler(object):
         return result
 
     def _run_job_redirect(self, job, job_thread):
-        """run job and redirect the output. """
-        target, run_dir, test_env, cmd = job
-        test_name = target.fullname
+        """run job and redirect the output into the test log in run_dir.
+
+        Only the tail of the output is printed if the test failed.
+        """
+        target, run_dir, test_env, cmd = job[:4]
+        test_name = self._job_name(job)
         shell = target.data.get('run_in_shell', False)
         if shell:
             cmd = subprocess.list2cmdline(cmd)
         timeout = target.data.get('test_timeout')
         console.info('[%s/%s] Running %s' % (self.num_of_run_tests, self.num_of_tests, cmd))
-        p = subprocess.Popen(cmd,
-                             env=test_env,
-                             cwd=run_dir,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
-                             close_fds=True,
-                             shell=shell)
-        job_thread.set_job_data(p, test_name, timeout)
-        stdout = p.communicate()[0]
+        log = os.path.join(run_dir, TEST_LOG)
+        with open(log, 'w') as f:
+            p = subprocess.Popen(cmd,
+                                 env=test_env,
+                                 cwd=run_dir,
+                                 stdout=f,
+                                 stderr=subprocess.STDOUT,
+                                 close_fds=True,
+                                 shell=shell)
+            job_thread.set_job_data(p, test_name, timeout)
+            p.wait()
         result = self._get_result(p.returncode)
-        console.info('Output of %s:\n%s\n%s finished: %s\n' % (
-                     test_name, stdout, test_name, result))
+        if p.returncode:
+            console.info('Last %d lines of output of %s:\n%s\n%s finished: %s, '
+                         'full output in %s\n' % (
+                         _TEST_LOG_TAIL_LINES, test_name,
+                         _tail(log, _TEST_LOG_TAIL_LINES), test_name, result, log))
+        else:
+            console.info('%s finished: %s\n' % (test_name, result))
         console.flush()
         return p.returncode
 
     def _run_job(self, job, job_thread):
         """run job, do not redirect the output. """
-        target, run_dir, test_env, cmd = job
-        test_name = target.fullname
+        target, run_dir, test_env, cmd = job[:4]
+        test_name = self._job_name(job)
         shell = target.data.get('run_in_shell', False)
         if shell:
             cmd = subprocess.list2cmdline(cmd)
@@ -189,7 +462,7 @@ class TestScheduler(object):
     def _process_job(self, job, redirect, job_thread):
         """process routine.
 
-        Each test is a tuple (target, run_dir, env, cmd)
+        Each test is a tuple (target, run_dir, env, cmd, shard)
 
         """
         target = job[0]
@@ -202,56 +475,69 @@ class TestScheduler(object):
                 returncode = self._run_job(job, job_thread)
         except OSError, e:
             console.error('%s: Create test process error: %s' %
-                          (target.fullname, str(e)))
+                          (self._job_name(job), str(e)))
             returncode = 255
 
-        costtime = time.time() - start_time
+        end_time = time.time()
+        costtime = end_time - start_time
+        blade_trace.add_event(self._job_name(job), 'test', start_time, end_time,
+                              {'result': self._get_result(returncode)})
 
         if returncode:
-            target.data['test_exit_code'] = returncode
             self.failed_targets_lock.acquire()
-            self.failed_targets.append(target)
+            # Only the first failed shard is reported
+            if target not in self.failed_targets:
+                target.data['test_exit_code'] = returncode
+                if redirect:
+                    target.data['test_log'] = os.path.join(job[1], TEST_LOG)
+                self.failed_targets.append(target)
             self.failed_targets_lock.release()
 
         self.tests_run_map_lock.acquire()
         run_item_map = self.tests_run_map.get(target.key, {})
         if run_item_map:
-            run_item_map['result'] = self._get_result(returncode)
-            run_item_map['costtime'] = costtime
+            if run_item_map['result'] in ('', 'SUCCESS'):
+                run_item_map['result'] = self._get_result(returncode)
+            # Costs of all shards, which decides the shards next time
+            run_item_map['costtime'] += costtime
         self.tests_run_map_lock.release()
 
         self.num_of_run_tests_lock.acquire()
-        self.num_of_run_tests += 1
+        if target.key in self.shards_left:
+            self.shards_left[target.key] -= 1
+            if not self.shards_left[target.key]:
+                self.num_of_run_tests += 1
+        else:
+            self.num_of_run_tests += 1
         self.num_of_run_tests_lock.release()
 
     def print_summary(self):
         """print the summary output of tests. """
-        console.info('There are %d tests scheduled to run by scheduler' % (len(self.tests_list)))
-
-    def _join_thread(self, t):
-        """Join thread and keep signal awareable"""
-        # The Thread.join without timeout will block signals, which makes
-        # blade can't be terminated by Ctrl-C
-        while t.isAlive():
-            t.join(1)
+        console.info('There are %d tests scheduled to run by scheduler' % self.num_of_tests)
+        console.info('Tests makespan: expected %.2fs, actual %.2fs, '
+                     'idle cpu %.2fs' % (
+                     self.expected_makespan, self.makespan, self.idle_time))
 
     def _wait_worker_threads(self, threads):
-        """Wait for worker threads to complete. """
-        test_timeout = config.get_item('global_config', 'test_timeout')
+        """Wait for worker threads to complete.
+
+        Wake up when any worker finished or the deadline of any job expired.
+        """
         try:
             while threads:
-                time.sleep(1)  # Check every second
                 now = time.time()
-                dead_threads = []
-                for t in threads:
-                    if t.isAlive():
-                        if test_timeout is not None:
-                            t.check_job_timeout(now)
-                    else:
-                        dead_threads.append(t)
-
-                for dt in dead_threads:
-                    threads.remove(dt)
+                expired, next_deadline = self.events.pop_expired(now)
+                for t in expired:
+                    t.check_job_timeout(now)
+                for t in [t for t in threads if t.finished]:
+                    t.join()
+                    threads.remove(t)
+                if not threads:
+                    break
+                timeout = None
+                if next_deadline is not None:
+                    timeout = max(next_deadline - now, 0)
+                self.events.wait(timeout)
         except KeyboardInterrupt:
             console.error('KeyboardInterrupt: Terminate workers...')
             for t in threads:
@@ -263,29 +549,52 @@ class TestScheduler(object):
         if self.num_of_tests <= 0:
             return
 
-        num_of_workers = self._get_workers_num()
-        console.info('spawn %d worker(s) to run tests' % num_of_workers)
+        cpu_capacity = self._get_cpu_capacity()
+        memory_capacity = self._get_memory_capacity()
 
-        for i in self.tests_list:
-            target = i[0]
-            if target.data.get('exclusive'):
-                self.exclusive_job_queue.put(i)
+        expected_costs = self._expected_costs()
+        for key, shard_count in self.shards.iteritems():
+            expected_costs[key] /= shard_count
+        jobs, exclusive_jobs = [], []
+        for i in self._sort_jobs(expected_costs):
+            if i[0].data.get('exclusive'):
+                exclusive_jobs.append(i)
             else:
-                self.job_queue.put(i)
-
-        redirect = num_of_workers > 1
-        threads = []
-        for i in range(num_of_workers):
-            t = WorkerThread(i, self.job_queue, self._process_job, redirect)
-            t.start()
-            threads.append(t)
-        self._wait_worker_threads(threads)
-
-        if not self.exclusive_job_queue.empty():
-            console.info('spawn 1 worker to run exclusive tests')
-            last_t = WorkerThread(num_of_workers, self.exclusive_job_queue,
-                                  self._process_job, False)
-            last_t.start()
-            self._wait_worker_threads([last_t])
+                jobs.append(i)
+        self.job_queue = TestJobQueue(jobs, cpu_capacity, memory_capacity)
+        self.exclusive_job_queue = TestJobQueue(exclusive_jobs, None, None)
+        self.expected_makespan = (
+                self._predict_makespan(jobs, expected_costs,
+                                       cpu_capacity, memory_capacity) +
+                sum(expected_costs[job[0].key] for job in exclusive_jobs))
+
+        num_of_workers = self._get_workers_num(jobs, cpu_capacity)
+        console.info('spawn %d worker(s) to run tests, capacity: %s cpu, %d MB memory' % (
+                     num_of_workers, cpu_capacity, memory_capacity))
+        self.events = WorkerEvents()
+        try:
+            start_time = time.time()
+            # Outputs of tests running in parallel are written into their logs
+            redirect = num_of_workers > 1
+            threads = []
+            for i in range(num_of_workers):
+                t = WorkerThread(i, self.job_queue, self._process_job,
+                                 redirect, self.events)
+                t.start()
+                threads.append(t)
+            self._wait_worker_threads(threads)
+            elapsed_time = time.time() - start_time
+            self.idle_time = max(cpu_capacity * elapsed_time -
+                                 self.job_queue.busy_cpu_time, 0)
+
+            if not self.exclusive_job_queue.empty():
+                console.info('spawn 1 worker to run exclusive tests')
+                last_t = WorkerThread(num_of_workers, self.exclusive_job_queue,
+                                      self._process_job, False, self.events)
+                last_t.start()
+                self._wait_worker_threads([last_t])
+            self.makespan = time.time() - start_time
+        finally:
+            self.events.close()
 
         self.print_summary()
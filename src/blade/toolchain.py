@@ -454,12 +454,13 @@ def _pybin_add_pylib(pybin, libname, dirs, dirs_with_init_py):
 
 def _pybin_add_zip(pybin, libname, filter, dirs, dirs_with_init_py):
     with zipfile.ZipFile(libname, 'r') as lib:
-        name_list = lib.namelist()
-        for name in name_list:
+        for info in lib.infolist():
+            name = info.filename
             if filter(name):
                 if dirs is not None and dirs_with_init_py is not None:
                     _update_init_py_dirs(name, dirs, dirs_with_init_py)
-                pybin.writestr(name, lib.read(name))
+                # Copy the compressed data directly without recompressing
+                blade_util.zip_copy_member(lib, info, pybin)
 
 
 def _pybin_add_egg(pybin, libname):
@@ -483,7 +484,15 @@ def _pybin_add_whl(pybin, libname, dirs, dirs_with_init_py):
 def generate_python_binary(basedir, mainentry, path, args):
     if basedir == '__pythonbasedir__':
         basedir = ''
-    pybin = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    # Write bootstrap before zip, it is also a valid zip file.
+    # unzip will seek actually start until meet the zip magic number.
+    # The offsets in the zip are relative to the start of the file
+    # since the zip is written after the bootstrap into the same file.
+    bootstrap = ('#!/bin/sh\n\n'
+                 'PYTHONPATH="$0:$PYTHONPATH" exec python -m "%s" "$@"\n') % mainentry
+    f = open(path, 'wb')
+    f.write(bootstrap)
+    pybin = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
     dirs, dirs_with_init_py = set(), set()
     for arg in args:
         if arg.endswith('.pylib'):
@@ -501,17 +510,6 @@ def generate_python_binary(basedir, mainentry, path, args):
         pybin.writestr(os.path.join(dir, '__init__.py'), '')
     pybin.writestr('__init__.py', '')
     pybin.close()
-
-    f = open(path, 'rb')
-    zip_content = f.read()
-    f.close()
-    # Insert bootstrap before zip, it is also a valid zip file.
-    # unzip will seek actually start until meet the zip magic number.
-    bootstrap = ('#!/bin/sh\n\n'
-                 'PYTHONPATH="$0:$PYTHONPATH" exec python -m "%s" "$@"\n') % mainentry
-    f = open(path, 'wb')
-    f.write(bootstrap)
-    f.write(zip_content)
     f.close()
     os.chmod(path, 0755)
 
@@ -520,6 +518,121 @@ def generate_python_binary_entry(args):
     generate_python_binary(args[0], args[1], args[2], args[3:])
 
 
+def _parse_hdr_level(line):
+    pos = line.find(' ')
+    if pos <= 0 or line[:pos].strip('.'):
+        return -1, ''
+    level, hdr = pos, line[pos + 1:]
+    if hdr.startswith('./'):
+        hdr = hdr[2:]
+    return level, hdr
+
+
+def extract_generated_hdrs_inclusion_stacks(path, build_dir):
+    """Extract generated headers and inclusion stacks for each one of them.
+
+    Given the following inclusions found in the app/example/foo.cc.o.H:
+
+        . ./app/example/foo.h
+        .. build64_release/app/example/proto/foo.pb.h
+        ... build64_release/common/rpc/rpc_service.pb.h
+        . build64_release/app/example/proto/bar.pb.h
+        . ./common/rpc/rpc_client.h
+        .. build64_release/common/rpc/rpc_options.pb.h
+
+    Return a list with each item being a list representing where the
+    generated header is included from in the current translation unit.
+
+    Note that ONLY the first generated header is tracked while other
+    headers included from the generated header directly or indirectly
+    are ignored since that part of inclusion is ensured by imports of
+    proto_library.
+
+    As shown in the example above, it returns:
+
+        [
+            ['app/example/foo.h', 'build64_release/app/example/proto/foo.pb.h'],
+            ['build64_release/app/example/proto/bar.pb.h'],
+            ['common/rpc/rpc_client.h', 'build64_release/common/rpc/rpc_options.pb.h'],
+        ]
+    """
+    stacks, hdrs_stack = [], []
+
+    def _process_hdr(level, hdr, current_level):
+        if hdr.startswith('/'):
+            skip_level = level
+        elif hdr.startswith(build_dir):
+            skip_level = level
+            stacks.append(hdrs_stack + [hdr])
+        else:
+            current_level = level
+            hdrs_stack.append(hdr)
+            skip_level = -1
+        return current_level, skip_level
+
+    current_level = 0
+    skip_level = -1
+    with open(path) as f:
+        for line in f.read().splitlines():
+            if line.startswith('Multiple include guards may be useful for'):
+                break
+            level, hdr = _parse_hdr_level(line)
+            if level == -1:
+                # Diagnostics of the compiler
+                continue
+            if level > current_level:
+                if skip_level != -1 and level > skip_level:
+                    continue
+                assert level == current_level + 1
+                current_level, skip_level = _process_hdr(level, hdr, current_level)
+            else:
+                while current_level >= level:
+                    current_level -= 1
+                    hdrs_stack.pop()
+                current_level, skip_level = _process_hdr(level, hdr, current_level)
+
+    return stacks
+
+
+def verify_header_inclusion_dependencies(name, build_dir, declared_hdrs, sources, hdrs_stacks):
+    """Verify generated headers included by sources are declared in deps. """
+    ok = True
+    for source, path in zip(sources, hdrs_stacks):
+        for stack in extract_generated_hdrs_inclusion_stacks(path, build_dir):
+            generated_hdr = stack[-1]
+            if generated_hdr not in declared_hdrs:
+                ok = False
+                stack.pop()
+                if not stack:
+                    msg = ['In file included from %s' % source]
+                else:
+                    stack.reverse()
+                    msg = ['In file included from %s' % stack[0]]
+                    prefix = '                 from %s'
+                    msg += [prefix % h for h in stack[1:]]
+                    msg.append(prefix % source)
+                console.info('\n%s' % '\n'.join(msg))
+                console.error('%s: Missing dependency declaration in BUILD for %s.' % (
+                              name, generated_hdr))
+    return ok
+
+
+def generate_hdrs_verify_entry(args):
+    build_dir, name, stamp, declared_hdrs_file = args[:4]
+    inputs = args[4:]
+    assert len(inputs) % 2 == 0
+    middle = len(inputs) / 2
+    hdrs_stacks, sources = inputs[:middle], inputs[middle:]
+    declared_hdrs = set()
+    if os.path.exists(declared_hdrs_file):
+        with open(declared_hdrs_file) as f:
+            declared_hdrs.update(f.read().split())
+    if not verify_header_inclusion_dependencies(name, build_dir, declared_hdrs,
+                                                sources, hdrs_stacks):
+        return 1
+    open(stamp, 'w').close()
+
+
 toolchains = {
     'scm' : generate_scm_entry,
     'package' : generate_package_entry,
@@ -536,6 +649,7 @@ toolchains = {
     'shell_testdata' : generate_shell_testdata_entry,
     'python_library' : generate_python_library_entry,
     'python_binary' : generate_python_binary_entry,
+    'hdrs_verify' : generate_hdrs_verify_entry,
 }
 
 
@@ -0,0 +1,62 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+"""
+
+This module is the tiny client to run toolchain functions in the
+toolchain server, which saves the cost of starting a python interpreter
+and importing toolchain modules for each building action.
+
+    python -S -m toolchain_client <socket> <toolchain_name> args...
+
+It only imports builtin modules to start fast, and falls back to run
+`python -m toolchain` directly if the server is unavailable.
+
+"""
+
+
+import marshal
+import os
+import socket
+import sys
+
+
+def _run_directly(args):
+    """Replace current process with the direct toolchain invocation. """
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable, '-m', 'toolchain'] + args)
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return ''.join(chunks)
+        chunks.append(chunk)
+
+
+def main(argv):
+    socket_path, args = argv[0], argv[1:]
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(marshal.dumps((os.getcwd(), dict(os.environ), args)))
+        sock.shutdown(socket.SHUT_WR)
+        response = _recv_all(sock)
+    except socket.error:
+        response = None
+    finally:
+        sock.close()
+    if not response:
+        _run_directly(args)
+    returncode, stdout, stderr = marshal.loads(response)
+    sys.stdout.write(stdout)
+    sys.stdout.flush()
+    sys.stderr.write(stderr)
+    sys.stderr.flush()
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,137 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+"""
+
+This module implements the toolchain server, a long-lived process which
+runs toolchain functions for building actions sent by toolchain_client
+over a unix socket. Each request is handled in a process forked from the
+server, which has imported all of the toolchain modules already.
+
+"""
+
+
+import marshal
+import os
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import time
+
+import console
+
+
+# Max length of unix socket path is 108 on linux, including the NUL
+_MAX_SOCKET_PATH_LEN = 107
+
+
+def socket_path(build_dir):
+    """Return the socket path of toolchain server in build_dir, or None if it is too long. """
+    path = os.path.join(build_dir, '.toolchain.sock')
+    if len(path) > _MAX_SOCKET_PATH_LEN:
+        return None
+    return path
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return ''.join(chunks)
+        chunks.append(chunk)
+
+
+def _run_toolchain(toolchains, cwd, env, args):
+    """Run the toolchain function in current process and capture its
+    stdout and stderr separately. """
+    stdout = tempfile.TemporaryFile()
+    stderr = tempfile.TemporaryFile()
+    os.dup2(stdout.fileno(), 1)
+    os.dup2(stderr.fileno(), 2)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        ret = toolchains[args[0]](args[1:])
+    except SystemExit, e:
+        ret = e.code
+    except Exception, e:
+        ret = 1
+        console.error(str(e))
+    if ret and not isinstance(ret, int):
+        print >>sys.stderr, ret
+        ret = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    stdout.seek(0)
+    stderr.seek(0)
+    return ret or 0, stdout.read(), stderr.read()
+
+
+class _ToolchainRequestHandler(SocketServer.BaseRequestHandler):
+    """Handle a request in the forked process. """
+    def handle(self):
+        cwd, env, args = marshal.loads(_recv_all(self.request))
+        response = _run_toolchain(self.server.toolchains, cwd, env, args)
+        self.request.sendall(marshal.dumps(response))
+
+
+class _ForkingUnixStreamServer(SocketServer.ForkingMixIn,
+                               SocketServer.UnixStreamServer):
+    # Concurrency is limited by the jobs number of ninja
+    max_children = 1024
+
+
+def serve(path):
+    """Serve on the unix socket until the parent process exits. """
+    # Import toolchain modules before forking any request handler
+    import toolchain
+    if os.path.exists(path):
+        os.remove(path)
+    server = _ForkingUnixStreamServer(path, _ToolchainRequestHandler)
+    server.toolchains = toolchain.toolchains
+    server.timeout = 1
+    parent = os.getppid()
+    while os.getppid() == parent:
+        server.handle_request()
+
+
+class ToolchainServer(object):
+    """Manage the toolchain server process during building. """
+
+    def __init__(self, build_dir, blade_path):
+        self.path = socket_path(build_dir)
+        self.blade_path = blade_path
+        self.process = None
+
+    def start(self):
+        """Start the server and wait it ready. Actions fall back to run
+        toolchain directly if it fails to start. """
+        if not self.path:
+            return
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+                [self.blade_path] + [p for p in [env.get('PYTHONPATH')] if p])
+        self.process = subprocess.Popen(
+                [sys.executable, '-m', 'toolchain_server', self.path], env=env)
+        for i in range(100):
+            if os.path.exists(self.path) or self.process.poll() is not None:
+                break
+            time.sleep(0.02)
+        if not os.path.exists(self.path):
+            console.warning('Failed to start toolchain server, run toolchain directly')
+
+    def stop(self):
+        if self.process:
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+            self.process = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1])
@@ -23,16 +23,19 @@ from cc_test_test import TestCcTest
 from gen_rule_test import TestGenRule
 from java_jar_test import TestJavaJar
 from lex_yacc_test import TestLexYacc
-from load_builds_test import TestLoadBuilds
+from load_builds_test import TestBuildDirIndex, TestLoadBuilds, TestLoadCache
 from proto_library_test import TestProtoLibrary
 from prebuild_cc_library_test import TestPrebuildCcLibrary
 from query_target_test import TestQuery
 from resource_library_test import TestResourceLibrary
 from swig_library_test import TestSwigLibrary
-from target_dependency_test import TestDepsAnalyzing
+from target_dependency_test import TestDepsAnalyzing, TestDepsCache
 
 from html_test_runner import HTMLTestRunner
-from test_target_test import TestTestRunner
+from test_target_test import TestFileDigestCache, TestTestHistory
+from test_target_test import TestTestRunner, TestTestShards
+from test_scheduler_test import TestJobAdmission, TestShardsResult
+from test_scheduler_test import TestTail, TestTestScheduler
 
 
 def _main():
@@ -47,12 +50,22 @@ def _main():
         unittest.defaultTestLoader.loadTestsFromTestCase(TestJavaJar),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestLexYacc),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestLoadBuilds),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestLoadCache),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestBuildDirIndex),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestProtoLibrary),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestResourceLibrary),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestSwigLibrary),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestDepsAnalyzing),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestDepsCache),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestQuery),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestTestRunner),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestFileDigestCache),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTestHistory),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTestScheduler),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTestShards),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestJobAdmission),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestShardsResult),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTail),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestPrebuildCcLibrary)
         ])
 
@@ -20,6 +20,10 @@ from blade.blade import Blade
 from blade.argparse import Namespace
 
 
+# Target modules are imported lazily after chdir into testdata
+blade.__path__ = [os.path.abspath(p) for p in blade.__path__]
+
+
 class TargetTest(unittest.TestCase):
     """base class Test """
     def doSetUp(self, path, target='...', full_targets=None,
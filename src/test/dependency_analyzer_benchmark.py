@@ -0,0 +1,93 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+
+"""
+ Benchmark of the dependency analyzer on synthetic target graphs.
+
+ Usage: python dependency_analyzer_benchmark.py [target_count ...]
+
+"""
+
+
+import random
+import sys
+import time
+
+sys.path.append('..')
+from blade import dependency_analyzer
+
+
+class FakeTarget(object):
+    """Minimal target which provides what the analyzer needs. """
+    def __init__(self, key, deps):
+        self.key = key
+        self.fullname = '%s:%s' % key
+        self.expanded_deps = deps
+
+    def _expand_deps_generation(self):
+        pass
+
+
+def generate_graph(count, seed=0):
+    """Generate a layered graph like a protobuf heavy service tree.
+
+    Each BUILD dir holds a proto library and several cc libraries. Dirs
+    are arranged in layers, every target depends on a few targets of the
+    nearby dirs in the lower layer and all proto libraries depend on the
+    common protobuf library.
+
+    """
+    rand = random.Random(seed)
+    protobuf = ('thirdparty/protobuf', 'protobuf')
+    targets = {protobuf: FakeTarget(protobuf, [])}
+    layers = 12
+    targets_per_dir = 5
+    layer_size = max(count // layers, targets_per_dir)
+    window = 100
+    layer_keys = []
+    for i in range(count - 1):
+        layer, pos = divmod(i, layer_size)
+        if pos == 0:
+            layer_keys.append([])
+        path = 'layer%d/dir%d' % (layer, pos // targets_per_dir)
+        if pos % targets_per_dir == 0:
+            key = (path, 'proto')
+            deps = [protobuf]
+        else:
+            key = (path, 'lib%d' % (pos % targets_per_dir))
+            deps = [(path, 'proto')]
+        if layer > 0:
+            lower = layer_keys[layer - 1]
+            start = max(pos - window // 2, 0)
+            lower = lower[start:start + window]
+            deps += rand.sample(lower, min(len(lower), rand.randint(1, 6)))
+        targets[key] = FakeTarget(key, deps)
+        layer_keys[layer].append(key)
+    return targets
+
+
+def benchmark(count):
+    targets = generate_graph(count)
+    edges = sum(len(t.expanded_deps) for t in targets.itervalues())
+    start = time.time()
+    dependency_analyzer._expand_deps(targets)
+    expand_cost = time.time() - start
+    start = time.time()
+    dependency_analyzer._topological_sort(targets)
+    sort_cost = time.time() - start
+    expanded = sum(len(t.expanded_deps) for t in targets.itervalues())
+    print ('%6d targets, %7d direct deps, %9d expanded deps: '
+           'expand %.3fs, sort %.3fs, analyze %.3fs' % (
+           len(targets), edges, expanded,
+           expand_cost, sort_cost, expand_cost + sort_cost))
+
+
+def main(argv):
+    counts = [int(c) for c in argv] or [1000, 10000, 50000]
+    for count in counts:
+        benchmark(count)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,120 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+
+"""
+ Benchmark of the fat jar assembly on synthetic jar sets, compares copying
+ the compressed entries directly with decompressing and recompressing them.
+
+ Usage: python fatjar_benchmark.py [jar_count [entries_per_jar]]
+
+"""
+
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.append('..')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'blade'))
+import blade_util
+import fatjar
+
+
+def generate_jars(jar_dir, jar_count, entries_per_jar, seed=0):
+    """Generate jars with compressible class like entries.
+
+    Some entries are shared among jars to produce conflicts, and each jar
+    contains a manifest and a license which should be excluded.
+
+    """
+    rand = random.Random(seed)
+    words = ['java/lang/Object', 'Code', 'LineNumberTable', 'StackMapTable',
+             'org/apache/spark/rdd/RDD', 'scala/collection/Seq', '<init>']
+    jars = []
+    for i in range(jar_count):
+        path = os.path.join(jar_dir, 'lib%d.jar' % i)
+        jar = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        jar.writestr('META-INF/MANIFEST.MF', 'Manifest-Version: 1.0\n')
+        jar.writestr('META-INF/LICENSE', 'License of lib%d\n' % i)
+        jar.writestr('com/example/lib%d/' % i, '')
+        for j in range(entries_per_jar):
+            if j % 50 == 0:
+                name = 'com/example/common/Shared%d.class' % j
+            else:
+                name = 'com/example/lib%d/Class%d.class' % (i, j)
+            size = rand.randint(512, 16384)
+            content = ''.join(rand.choice(words) for k in range(size // 8))
+            jar.writestr(name, content[:size])
+        jar.close()
+        jars.append(path)
+    return jars
+
+
+def _recompress_member(src, zinfo, dst, arcname=None):
+    dst.writestr(arcname or zinfo.filename, src.read(zinfo))
+
+
+def _run(target, jars, copy_member):
+    saved = blade_util.zip_copy_member
+    blade_util.zip_copy_member = copy_member
+    # Suppress the conflict reports
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        fatjar.generate_fat_jar(target, jars)
+        return time.time() - start
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        blade_util.zip_copy_member = saved
+
+
+def _verify(raw_target, recompress_target):
+    raw = zipfile.ZipFile(raw_target)
+    recompress = zipfile.ZipFile(recompress_target)
+    assert raw.testzip() is None
+    assert raw.namelist() == recompress.namelist()
+    for name in raw.namelist():
+        if name != 'META-INF/MANIFEST.MF':
+            assert raw.read(name) == recompress.read(name), name
+    raw.close()
+    recompress.close()
+
+
+def benchmark(jar_count, entries_per_jar):
+    work_dir = tempfile.mkdtemp()
+    try:
+        jars = generate_jars(work_dir, jar_count, entries_per_jar)
+        input_size = sum(os.path.getsize(jar) for jar in jars)
+        raw_target = os.path.join(work_dir, 'out', 'raw.jar')
+        recompress_target = os.path.join(work_dir, 'out', 'recompress.jar')
+        recompress_cost = _run(recompress_target, jars, _recompress_member)
+        raw_cost = _run(raw_target, jars, blade_util.zip_copy_member)
+        _verify(raw_target, recompress_target)
+        print ('%4d jars, %6d entries, %7.1f MB: recompress %.3fs, '
+               'raw copy %.3fs, speedup %.1fx' % (
+               jar_count, jar_count * entries_per_jar,
+               input_size / 1048576.0, recompress_cost, raw_cost,
+               recompress_cost / max(raw_cost, 0.001)))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def main(argv):
+    if argv:
+        jar_count = int(argv[0])
+        entries_per_jar = int(argv[1]) if len(argv) > 1 else 200
+        benchmark(jar_count, entries_per_jar)
+    else:
+        for jar_count, entries_per_jar in [(10, 200), (50, 200), (200, 200)]:
+            benchmark(jar_count, entries_per_jar)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
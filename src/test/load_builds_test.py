@@ -12,7 +12,16 @@
 """
 
 
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
 import blade_test
+import blade.config
+import blade.load_build_files
+from blade.argparse import Namespace
 
 
 class TestLoadBuilds(blade_test.TargetTest):
@@ -62,5 +71,141 @@ class TestLoadBuilds(blade_test.TargetTest):
 
         self.assertEqual(target_count, 10)
 
+
+class TestLoadCache(unittest.TestCase):
+    """Test the cache of BUILD files is invalidated by their dependencies. """
+    def setUp(self):
+        """setup method. """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.build_dir = os.path.join(self.tmp_dir, 'build64_release')
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        os.mkdir(self.build_dir)
+        os.mkdir(self.source_dir)
+        self.build_file = os.path.join(self.source_dir, 'BUILD')
+        self._write(self.build_file, 'cc_library(name="a", srcs="a.cpp")\n')
+        self.config_file = os.path.join(self.tmp_dir, 'BLADE_ROOT')
+        self._write(self.config_file, 'cc_config(extra_incs=[])\n')
+        self.blade_file = os.path.join(self.tmp_dir, 'blade.zip')
+        self._write(self.blade_file, 'blade')
+        self.loaded_files = blade.config.get_loaded_files()
+        self.saved_loaded_files = self.loaded_files[:]
+        self.loaded_files[:] = [self.config_file]
+        self.saved_blade_path = blade.load_build_files._BLADE_PATH
+        blade.load_build_files._BLADE_PATH = self.blade_file
+        self.options = Namespace(m='64', arch='x86_64', profile='release')
+
+    def tearDown(self):
+        """tear down method. """
+        blade.load_build_files._BLADE_PATH = self.saved_blade_path
+        self.loaded_files[:] = self.saved_loaded_files
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def _write(path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _store(self):
+        cache = blade.load_build_files.LoadCache(self.build_dir, self.options)
+        cache.store(self.source_dir, self.build_file,
+                    {'includes': [], 'globs': []}, 'targets')
+        cache.save()
+
+    def _lookup(self, options=None):
+        cache = blade.load_build_files.LoadCache(self.build_dir,
+                                                 options or self.options)
+        return cache.lookup(self.source_dir, self.build_file)
+
+    def testHit(self):
+        """Test unchanged BUILD file is loaded from the cache. """
+        self._store()
+        self.assertEqual(self._lookup(), 'targets')
+
+    def testBuildFileChanged(self):
+        """Test changing the BUILD file invalidates its entry. """
+        self._store()
+        self._write(self.build_file, 'cc_library(name="b", srcs="b.cpp")\n')
+        self.assertEqual(self._lookup(), None)
+
+    def testConfigChanged(self):
+        """Test changing a config file drops the cache. """
+        self._store()
+        self._write(self.config_file, 'cc_config(extra_incs=["inc"])\n')
+        self.assertEqual(self._lookup(), None)
+
+    def testBladeChanged(self):
+        """Test changing blade itself drops the cache. """
+        self._store()
+        self._write(self.blade_file, 'new blade')
+        self.assertEqual(self._lookup(), None)
+
+    def testOptionsChanged(self):
+        """Test changing m, arch or profile drops the cache. """
+        self._store()
+        self.assertEqual(self._lookup(), 'targets')
+        for name, value in [('m', '32'), ('arch', 'i386'), ('profile', 'debug')]:
+            options = Namespace(**vars(self.options))
+            setattr(options, name, value)
+            self.assertEqual(self._lookup(options), None, name)
+
+
+class TestBuildDirIndex(unittest.TestCase):
+    """Test the index of dirs used to expand path/... targets. """
+    def setUp(self):
+        """setup method. """
+        self.cur_dir = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        for path in ['a/b', 'c', '.svn', 'build64_release']:
+            os.makedirs(path)
+        for path in ['a/BUILD', 'a/b/BUILD', '.svn/BUILD', 'build64_release/BUILD']:
+            open(path, 'w').close()
+        # Dirs changed within the current second are not recorded into index
+        past = time.time() - 100
+        for path in ['.', 'a', 'a/b', 'c', '.svn', 'build64_release']:
+            os.utime(path, (past, past))
+        self.global_config = blade.config.get_section('global_config')
+        self.load_excludes = self.global_config['load_excludes']
+
+    def tearDown(self):
+        """tear down method. """
+        self.global_config['load_excludes'] = self.load_excludes
+        os.chdir(self.cur_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def _find_build_dirs():
+        index = blade.load_build_files.BuildDirIndex('build64_release')
+        result = index.find_build_dirs('.')
+        index.save()
+        return index, sorted(result)
+
+    def testFindBuildDirs(self):
+        """Test the index is reused and excludes build and hidden dirs. """
+        index, result = self._find_build_dirs()
+        self.assertEqual(result, ['./a', './a/b'])
+        self.assertTrue(index.modified)
+        index, result = self._find_build_dirs()
+        self.assertEqual(result, ['./a', './a/b'])
+        self.assertEqual(len(index.dirs), 4)
+        self.assertFalse(index.modified)
+
+    def testBuildFileAddedAndRemoved(self):
+        """Test dirs are listed again after BUILD files are added or removed. """
+        self._find_build_dirs()
+        open('c/BUILD', 'w').close()
+        self.assertEqual(self._find_build_dirs()[1], ['./a', './a/b', './c'])
+        os.remove('a/b/BUILD')
+        self.assertEqual(self._find_build_dirs()[1], ['./a', './c'])
+
+    def testLoadExcludesChanged(self):
+        """Test changing load_excludes drops the index. """
+        self._find_build_dirs()
+        self.global_config['load_excludes'] = self.load_excludes + ['a/b']
+        self.assertEqual(self._find_build_dirs()[1], ['./a'])
+        self.global_config['load_excludes'] = ['build64_release']
+        self.assertEqual(self._find_build_dirs()[1], ['./.svn', './a', './a/b'])
+
+
 if __name__ == '__main__':
     blade_test.run(TestLoadBuilds)
@@ -0,0 +1,61 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+
+"""
+ Benchmark of the blade startup time, runs `blade query` on a tiny
+ workspace which contains only one cc_library repeatedly.
+
+ Usage: python startup_benchmark.py [runs]
+
+"""
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+_BLADE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'blade')
+
+
+def create_workspace(root):
+    open(os.path.join(root, 'BLADE_ROOT'), 'w').close()
+    os.mkdir(os.path.join(root, 'foo'))
+    with open(os.path.join(root, 'foo', 'BUILD'), 'w') as f:
+        f.write("cc_library(name = 'foo', srcs = 'foo.cpp')\n")
+    open(os.path.join(root, 'foo', 'foo.cpp'), 'w').close()
+
+
+def run_query(root):
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        returncode = subprocess.call(
+                [sys.executable, _BLADE_PATH, 'query', '--deps', '//foo:foo'],
+                cwd=root, stdout=devnull, stderr=devnull)
+    if returncode:
+        sys.exit('blade query failed, exit(%s)' % returncode)
+    return time.time() - start
+
+
+def main(argv):
+    runs = int(argv[0]) if argv else 10
+    root = tempfile.mkdtemp()
+    try:
+        create_workspace(root)
+        # The first run creates the build dir and the caches in it
+        first = run_query(root)
+        costs = sorted(run_query(root) for i in range(runs))
+        print ('blade query: first run %.3fs, %d runs min %.3fs, '
+               'median %.3fs, max %.3fs' % (
+               first, runs, costs[0], costs[len(costs) // 2], costs[-1]))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
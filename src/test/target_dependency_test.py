@@ -13,7 +13,12 @@
 
 
 import os
+import shutil
+import tempfile
+import unittest
+
 import blade_test
+from blade import dependency_analyzer
 
 
 class TestDepsAnalyzing(blade_test.TargetTest):
@@ -78,5 +83,80 @@ class TestDepsAnalyzing(blade_test.TargetTest):
         self.assertNotIn(cc_library_poppy, java_jar_deps)
 
 
+class FakeTarget(object):
+    """Minimal target which provides what the analyzer needs. """
+    def __init__(self, key, deps):
+        self.fullname = '%s:%s' % key
+        self.expanded_deps = list(deps)
+
+    def _expand_deps_generation(self):
+        pass
+
+
+class TestDepsCache(unittest.TestCase):
+    """Test reusing the expanded deps of last analyzing. """
+    def setUp(self):
+        """setup method. """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, '.blade_deps_cache')
+        self.graph = {
+            ('common', 'base'): [],
+            ('common', 'proto'): [('common', 'base')],
+            ('foo', 'foo'): [('common', 'proto')],
+            ('bar', 'bar'): [('common', 'base')],
+            ('app', 'server'): [('foo', 'foo'), ('bar', 'bar')],
+            ('app', 'server_test'): [('app', 'server')],
+        }
+
+    def tearDown(self):
+        """tear down method. """
+        shutil.rmtree(self.tmp_dir)
+
+    def _analyze(self, cache_path):
+        targets = dict((key, FakeTarget(key, deps))
+                       for key, deps in self.graph.iteritems())
+        sorted_keys, successors = dependency_analyzer.analyze_deps(
+                targets, cache_path)
+        expanded_deps = dict((key, t.expanded_deps)
+                             for key, t in targets.iteritems())
+        return expanded_deps, sorted_keys
+
+    def _assertSameAsFresh(self):
+        cached, cached_keys = self._analyze(self.cache_path)
+        fresh, fresh_keys = self._analyze(None)
+        self.assertEqual(cached, fresh)
+        self.assertEqual(sorted(cached_keys), sorted(fresh_keys))
+
+    def testUnchanged(self):
+        """Test the result is reused as a whole if nothing changed. """
+        self._assertSameAsFresh()
+        self._assertSameAsFresh()
+        self.assertEqual(self._analyze(self.cache_path)[0][('app', 'server_test')],
+                         [('app', 'server'), ('foo', 'foo'), ('common', 'proto'),
+                          ('bar', 'bar'), ('common', 'base')])
+
+    def testDepAdded(self):
+        """Test adding a dep updates all its dependers. """
+        self._assertSameAsFresh()
+        self.graph[('bar', 'bar')].append(('common', 'proto'))
+        self._assertSameAsFresh()
+
+    def testDepRemoved(self):
+        """Test removing a dep updates all its dependers. """
+        self._assertSameAsFresh()
+        self.graph[('common', 'proto')] = []
+        self._assertSameAsFresh()
+
+    def testTargetAddedAndRemoved(self):
+        """Test adding and removing targets. """
+        self._assertSameAsFresh()
+        self.graph[('foo', 'util')] = [('common', 'base')]
+        self.graph[('foo', 'foo')] = [('foo', 'util')]
+        self._assertSameAsFresh()
+        del self.graph[('foo', 'util')]
+        self.graph[('foo', 'foo')] = []
+        self._assertSameAsFresh()
+
+
 if __name__ == '__main__':
     blade_test.run(TestDepsAnalyzing)
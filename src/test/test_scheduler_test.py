@@ -0,0 +1,233 @@
+# Copyright (c) 2017 Tencent Inc.
+# All rights reserved.
+
+
+"""
+ This is the test module to test the scheduling of tests.
+
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import blade_test
+from blade import test_scheduler
+from blade.target import Target
+from blade.test_scheduler import TestJobQueue
+from blade.test_scheduler import TestScheduler
+
+
+class FakeTarget(object):
+    """Minimal target which provides what the scheduler needs. """
+    def __init__(self, name, **data):
+        self.path = 'test'
+        self.name = name
+        self.key = (self.path, name)
+        self.fullname = '%s:%s' % self.key
+        self.type = 'cc_test'
+        self.data = data
+
+
+def _make_job(target, shard=None):
+    return (target, '%s.runfiles' % target.name, {}, [target.name], shard)
+
+
+class TestTestScheduler(unittest.TestCase):
+    """Test scheduling tests by their history costs. """
+    def setUp(self):
+        """setup method. """
+        self.targets = dict((name, FakeTarget(name)) for name in 'abcd')
+        self.jobs = [_make_job(self.targets[name]) for name in 'dbca']
+        self.costs = {('test', 'a'): 4.0, ('test', 'b'): 3.0,
+                      ('test', 'c'): 2.0, ('test', 'd'): 1.0}
+
+    def _job_names(self, jobs):
+        return ''.join([job[0].name for job in jobs])
+
+    def testExpectedCosts(self):
+        """Test tests without history are expected to cost the average. """
+        del self.costs[('test', 'b')]
+        del self.costs[('test', 'c')]
+        scheduler = TestScheduler(self.jobs, 2, {}, self.costs)
+        expected_costs = scheduler._expected_costs()
+        self.assertEqual(expected_costs[('test', 'a')], 4.0)
+        self.assertEqual(expected_costs[('test', 'b')], 2.5)
+        self.assertEqual(expected_costs[('test', 'c')], 2.5)
+        self.assertEqual(expected_costs[('test', 'd')], 1.0)
+
+    def testExpectedCostsWithoutHistory(self):
+        """Test the default cost is used if no test has history. """
+        scheduler = TestScheduler(self.jobs, 2, {})
+        expected_costs = scheduler._expected_costs()
+        self.assertEqual(set(expected_costs.values()),
+                         set([test_scheduler._DEFAULT_TEST_COST]))
+
+    def testLongestFirst(self):
+        """Test jobs are sorted longest expected first. """
+        scheduler = TestScheduler(self.jobs, 2, {}, self.costs)
+        jobs = scheduler._sort_jobs(scheduler._expected_costs())
+        self.assertEqual(self._job_names(jobs), 'abcd')
+
+    def testJobQueueOrder(self):
+        """Test the job queue keeps the order of jobs. """
+        job_queue = TestJobQueue(self.jobs, 4, None)
+        jobs = [job_queue.get() for i in range(4)]
+        self.assertEqual(self._job_names(jobs), 'dbca')
+        self.assertTrue(job_queue.empty())
+
+    def testPredictMakespan(self):
+        """Test predicting the makespan of longest first scheduling. """
+        scheduler = TestScheduler(self.jobs, 2, {}, self.costs)
+        jobs = scheduler._sort_jobs(self.costs)
+        self.assertEqual(TestScheduler._predict_makespan(jobs, self.costs, 1, None), 10.0)
+        self.assertEqual(TestScheduler._predict_makespan(jobs, self.costs, 2, None), 5.0)
+        self.assertEqual(TestScheduler._predict_makespan(jobs, self.costs, 4, None), 4.0)
+        # Shortest first leaves the longest test at the end
+        self.assertEqual(TestScheduler._predict_makespan(
+                         list(reversed(jobs)), self.costs, 2, None), 6.0)
+
+
+class TestJobAdmission(unittest.TestCase):
+    """Test admitting tests by the capacity of cpu and memory. """
+    def _make_jobs(self, *resources):
+        return [_make_job(FakeTarget('t%d' % i, cpu=cpu, memory=memory))
+                for i, (cpu, memory) in enumerate(resources)]
+
+    def testAdmitByCpu(self):
+        """Test the first job fitting in the cpu left is admitted. """
+        jobs = self._make_jobs((2, 0), (3, 0), (1, 0), (2, 0))
+        job_queue = TestJobQueue(jobs, 4, None)
+        self.assertTrue(job_queue._pop_fit() is jobs[0])
+        self.assertFalse(job_queue._fit(jobs[1]))
+        self.assertTrue(job_queue._pop_fit() is jobs[2])
+        self.assertTrue(job_queue._pop_fit() is None)
+        job_queue.done(jobs[0], 1.0)
+        self.assertTrue(job_queue._pop_fit() is jobs[1])
+        self.assertEqual(job_queue.cpu_used, 4)
+        self.assertTrue(job_queue._pop_fit() is None)
+
+    def testAdmitByMemory(self):
+        """Test the first job fitting in the memory left is admitted. """
+        jobs = self._make_jobs((1, 600), (1, 600), (1, 300))
+        job_queue = TestJobQueue(jobs, 8, 1000)
+        self.assertTrue(job_queue._pop_fit() is jobs[0])
+        self.assertTrue(job_queue._pop_fit() is jobs[2])
+        self.assertTrue(job_queue._pop_fit() is None)
+        job_queue.done(jobs[0], 1.0)
+        self.assertTrue(job_queue._pop_fit() is jobs[1])
+        self.assertEqual(job_queue.memory_used, 900)
+
+    def testLargeJobRunsAlone(self):
+        """Test a job larger than the whole capacity runs alone. """
+        jobs = self._make_jobs((4, 0), (1, 2000), (1, 0))
+        job_queue = TestJobQueue(jobs, 2, 1000)
+        self.assertTrue(job_queue._pop_fit() is jobs[0])
+        self.assertTrue(job_queue._pop_fit() is None)
+        job_queue.done(jobs[0], 10.0)
+        # Cpu beyond the capacity is not counted as busy
+        self.assertEqual(job_queue.busy_cpu_time, 20.0)
+        self.assertTrue(job_queue._pop_fit() is jobs[1])
+        self.assertTrue(job_queue._pop_fit() is None)
+        job_queue.done(jobs[1], 1.0)
+        self.assertTrue(job_queue._pop_fit() is jobs[2])
+        self.assertTrue(job_queue.empty())
+
+    def testInitTestResources(self):
+        """Test validating the cpu and memory of tests. """
+        target = Target.__new__(Target)
+        target.fullname = 'test:a'
+        target.data = {}
+        target._init_test_resources(0.5, 1024)
+        self.assertEqual((target.data['cpu'], target.data['memory']), (0.5, 1024))
+        for cpu, memory in [(0, 0), (-1, 0), ('2', 0),
+                            (1, -1), (1, 1.5), (1, '100')]:
+            self.assertRaises(SystemExit, target._init_test_resources, cpu, memory)
+
+
+class TestShardsResult(unittest.TestCase):
+    """Test merging results of shards of a test. """
+    def setUp(self):
+        """setup method. """
+        self.run_dir = tempfile.mkdtemp()
+        self.target = FakeTarget('a')
+        self.jobs = [self._make_shard_job(shard, returncode)
+                     for shard, returncode in enumerate([0, 1, 2])]
+        self.tests_run_map = {self.target.key: {
+                'runfile': 'a', 'result': '', 'reason': 'FULLTEST', 'costtime': 0}}
+        self.scheduler = TestScheduler(self.jobs, 1, self.tests_run_map)
+        self.events = test_scheduler.WorkerEvents()
+        self.worker = test_scheduler.WorkerThread(0, None, None, False, self.events)
+
+    def tearDown(self):
+        """tear down method. """
+        self.events.close()
+        shutil.rmtree(self.run_dir)
+
+    def _make_shard_job(self, shard, returncode):
+        cmd = [sys.executable, '-c', 'import sys; sys.exit(%d)' % returncode]
+        return (self.target, self.run_dir, {}, cmd, shard)
+
+    def testMergeShards(self):
+        """Test the first failed shard decides the result of the test. """
+        scheduler = self.scheduler
+        self.assertEqual(scheduler.num_of_tests, 1)
+        scheduler._process_job(self.jobs[0], False, self.worker)
+        self.assertEqual(self.tests_run_map[self.target.key]['result'], 'SUCCESS')
+        scheduler._process_job(self.jobs[1], False, self.worker)
+        scheduler._process_job(self.jobs[2], True, self.worker)
+        run_item = self.tests_run_map[self.target.key]
+        self.assertEqual(run_item['result'], 'FAILED:1')
+        self.assertEqual(scheduler.failed_targets, [self.target])
+        self.assertEqual(self.target.data['test_exit_code'], 1)
+        self.assertEqual(scheduler.num_of_run_tests, 1)
+
+    def testShardsCost(self):
+        """Test the cost of a test is the sum of costs of its shards. """
+        scheduler = self.scheduler
+        scheduler._process_job(self.jobs[0], False, self.worker)
+        cost = self.tests_run_map[self.target.key]['costtime']
+        self.assertTrue(cost > 0)
+        self.assertEqual(scheduler.num_of_run_tests, 0)
+        scheduler._process_job(self.jobs[1], False, self.worker)
+        self.assertTrue(self.tests_run_map[self.target.key]['costtime'] > cost)
+        self.assertEqual(scheduler.num_of_run_tests, 0)
+
+
+class TestTail(unittest.TestCase):
+    """Test printing the tail of the test log. """
+    def setUp(self):
+        """setup method. """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, test_scheduler.TEST_LOG)
+
+    def tearDown(self):
+        """tear down method. """
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_lines(self, count):
+        lines = ['line %d %s' % (i, 'x' * 100) for i in range(count)]
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return lines
+
+    def testLargeFile(self):
+        """Test the tail of a file larger than a read block. """
+        lines = self._write_lines(10000)
+        self.assertTrue(os.path.getsize(self.path) > 65536 * 10)
+        self.assertEqual(test_scheduler._tail(self.path, 100), '\n'.join(lines[-100:]))
+        self.assertEqual(test_scheduler._tail(self.path, 1000), '\n'.join(lines[-1000:]))
+
+    def testFewLines(self):
+        """Test a file with fewer lines than requested. """
+        lines = self._write_lines(10)
+        self.assertEqual(test_scheduler._tail(self.path, 100), '\n'.join(lines))
+        self._write_lines(0)
+        self.assertEqual(test_scheduler._tail(self.path, 100), '')
+
+
+if __name__ == '__main__':
+    blade_test.run(TestTestScheduler)
@@ -12,7 +12,14 @@
 
 
 import os
+import shutil
+import tempfile
+import time
+import unittest
+
 import blade_test
+import blade.config
+from blade import test_runner
 
 
 class TestTestRunner(blade_test.TargetTest):
@@ -70,5 +77,171 @@ class TestTestRunner(blade_test.TargetTest):
         self.assertEqual(ret_code, 1)
 
 
+class TestTestHistory(blade_test.TargetTest):
+    """Test the history of tests used by the test runner. """
+    def setUp(self):
+        """setup method. """
+        self.doSetUp('test_test_runner', fulltest=True, args='',
+                     test_jobs=1, show_details=True)
+        self.runfile = os.path.abspath('build64_release/test_test_runner/string_test_main')
+        self.stamp_file = '.blade.test.stamp'
+        with open(self.stamp_file, 'w') as f:
+            f.write(repr({'md5': {self.runfile: ('binary', 'testdata')},
+                          'costtime': {self.runfile: 5.0, '/old_test': 7.0}}))
+
+    def tearDown(self):
+        """tear down method. """
+        os.remove(self.stamp_file)
+        blade_test.TargetTest.tearDown(self)
+
+    def _test_runner(self):
+        return test_runner.TestRunner(self.all_targets, self.options,
+                                      self.blade.get_target_database(),
+                                      self.direct_targets)
+
+    def testFullTestHistory(self):
+        """Test full test only loads the costs of tests from the history. """
+        runner = self._test_runner()
+        self.assertEqual(runner.last_test_stamp['md5'], {})
+        self.assertEqual(runner.last_test_stamp['costtime'],
+                         {self.runfile: 5.0, '/old_test': 7.0})
+
+    def testUpdateTestsCosts(self):
+        """Test only costs of tests run this time are updated. """
+        runner = self._test_runner()
+        runner.tests_run_map = {
+                ('test_test_runner', 'string_test_main'): {
+                        'runfile': self.runfile, 'result': 'SUCCESS',
+                        'reason': 'FULLTEST', 'costtime': 3.0},
+                ('test_test_runner', 'not_run'): {
+                        'runfile': '/not_run', 'result': '',
+                        'reason': 'FULLTEST', 'costtime': 0}}
+        runner._update_tests_costs()
+        self.assertEqual(runner.test_stamp['costtime'],
+                         {self.runfile: 3.0, '/old_test': 7.0})
+
+
+class TestTestShards(blade_test.TargetTest):
+    """Test running shards of cc_test in parallel. """
+    def setUp(self):
+        """setup method. """
+        self.doSetUp('test_test_runner', fulltest=True, args='',
+                     test_jobs=4, show_details=True)
+        self.cc_test_config = blade.config.get_section('cc_test_config')
+        self.auto_shard_time = self.cc_test_config['auto_shard_time']
+        self.cc_test_config['auto_shard_time'] = 10
+        self.target = self.all_targets[('test_test_runner', 'string_test_main')]
+        self.runner = test_runner.TestRunner(self.all_targets, self.options,
+                                             self.blade.get_target_database(),
+                                             self.direct_targets)
+
+    def tearDown(self):
+        """tear down method. """
+        self.cc_test_config['auto_shard_time'] = self.auto_shard_time
+        blade_test.TargetTest.tearDown(self)
+
+    def testShardCount(self):
+        """Test choosing the number of shards. """
+        runner = self.runner
+        self.assertEqual(runner._get_test_shard_count(self.target, None), 1)
+        self.assertEqual(runner._get_test_shard_count(self.target, 5.0), 1)
+        self.assertEqual(runner._get_test_shard_count(self.target, 25.0), 3)
+        # Limited by the number of test jobs
+        self.assertEqual(runner._get_test_shard_count(self.target, 100.0), 4)
+        self.target.data['shard_count'] = 2
+        self.assertEqual(runner._get_test_shard_count(self.target, None), 2)
+        self.target.data['exclusive'] = True
+        self.assertEqual(runner._get_test_shard_count(self.target, 100.0), 1)
+        library = self.all_targets[('test_test_runner', 'lowercase')]
+        self.assertEqual(runner._get_test_shard_count(library, 100.0), 1)
+
+    def testCleanShardsRunfiles(self):
+        """Test runfiles of all shards are cleaned. """
+        runner = self.runner
+        test_dir = os.path.join(runner.build_dir, 'test_test_runner')
+        if not os.path.exists(test_dir):
+            os.makedirs(test_dir)
+        runner.test_shards[self.target.key] = 2
+        profile_links = []
+        for shard in [None, 0, 1]:
+            runner._prepare_env(self.target, shard)
+            profile_links.append(os.path.join(runner._runfiles_dir(self.target, shard),
+                                              os.path.basename(runner.build_dir)))
+        try:
+            self.assertEqual(len(set(profile_links)), 3)
+            for link in profile_links:
+                self.assertTrue(os.path.lexists(link))
+            runner._clean_env()
+            for link in profile_links:
+                self.assertFalse(os.path.lexists(link))
+        finally:
+            for shard in [None, 0, 1]:
+                shutil.rmtree(runner._runfiles_dir(self.target, shard))
+
+
+class TestFileDigestCache(unittest.TestCase):
+    """Test the persistent cache of file digests. """
+    def setUp(self):
+        """setup method. """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, '.blade_file_digests')
+        self.path = os.path.join(self.tmp_dir, 'data')
+        self._write('content1', time.time() - 100)
+        self.hashed = []
+        self.md5sum_file = test_runner.md5sum_file
+        def md5sum_file(path):
+            self.hashed.append(path)
+            return self.md5sum_file(path)
+        test_runner.md5sum_file = md5sum_file
+
+    def tearDown(self):
+        """tear down method. """
+        test_runner.md5sum_file = self.md5sum_file
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, content, mtime):
+        with open(self.path, 'w') as f:
+            f.write(content)
+        os.utime(self.path, (mtime, mtime))
+
+    def _digest(self):
+        cache = test_runner.FileDigestCache(self.cache_path)
+        digest = cache.digest(self.path)
+        cache.save()
+        return digest
+
+    def testUnchanged(self):
+        """Test the digest of an unchanged file is not computed again. """
+        digest = self._digest()
+        self.assertEqual(self.hashed, [self.path])
+        self.assertEqual(self._digest(), digest)
+        self.assertEqual(self.hashed, [self.path])
+
+    def testTouched(self):
+        """Test touching the file without changing its content. """
+        digest = self._digest()
+        os.utime(self.path, (time.time() - 50, time.time() - 50))
+        self.assertEqual(self._digest(), digest)
+        self.assertEqual(len(self.hashed), 2)
+        self.assertEqual(self._digest(), digest)
+        self.assertEqual(len(self.hashed), 2)
+
+    def testContentChanged(self):
+        """Test changing the content with the same size. """
+        digest = self._digest()
+        self._write('content2', time.time() - 50)
+        new_digest = self._digest()
+        self.assertNotEqual(new_digest, digest)
+        self.assertEqual(new_digest, self.md5sum_file(self.path))
+
+    def testRecentlyChanged(self):
+        """Test the digest of a file changed just now is not recorded. """
+        self._write('content1', time.time())
+        digest = self._digest()
+        self._write('content2', time.time())
+        self.assertNotEqual(self._digest(), digest)
+        self.assertEqual(len(self.hashed), 2)
+
+
 if __name__ == '__main__':
     blade_test.run(TestTestRunner)